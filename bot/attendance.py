@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+from discord.ext import commands
+import config
+from database import Database
+from utils import Topic
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceTracker:
+    """
+    In-memory accumulator of the time members spend in active sessions
+
+    Join, leave, start and end events, and voice-state updates when config.attendance_voice is
+    set, only open and close intervals in memory. The accumulated seconds are written to the
+    attendances table in one executemany transaction every config.attendance_flush_interval
+    seconds and on shutdown, so a busy voice channel never costs a commit per event.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        # (guild_id, topic_name) -> (topic_id, attendee ids) for every active topic
+        self._topics: Dict[Tuple[int, str], Tuple[int, Set[int]]] = {}
+        # (topic_id, user_id) -> (guild_id, when the open interval started)
+        self._since: Dict[Tuple[int, int], Tuple[int, float]] = {}
+        # (topic_id, user_id) -> (guild_id, seconds not yet written)
+        self._spent: Dict[Tuple[int, int], Tuple[int, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        Track the topics that are already active and start the flush timer
+
+        Time while the bot was down is not counted, the intervals open again from now.
+        """
+        for topic in await Topic.getActiveTopics():
+            members = await Topic.getTopicMembers(topic[6], topic[1])
+            self.topicStarted(topic, [member[2] for member in members])
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the flush timer and write everything accumulated so far
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def isPresent(self, guild_id: int, user_id: int) -> bool:
+        """
+        Whether an attendee's time counts right now: always, or only while in a voice channel of the guild
+
+        Parameters:
+            guild_id (int): The guild ID
+            user_id (int): The user ID
+
+        Returns:
+            bool: Whether the user is present
+        """
+        if not config.attendance_voice:
+            return True
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return False
+        return any(user_id in channel.voice_states for channel in guild.voice_channels + guild.stage_channels)
+
+    def topicStarted(self, topic: Tuple, member_ids: Iterable[int]):
+        """
+        Start counting for the author and members of a topic that became active
+
+        Parameters:
+            topic (Tuple): The topic row
+            member_ids (Iterable[int]): The IDs of its members
+        """
+        guild_id, topic_name = topic[6], topic[1]
+        attendees = self._topics.setdefault((guild_id, topic_name), (topic[0], set()))[1]
+        for user_id in (topic[5], *member_ids):
+            attendees.add(user_id)
+            if self.isPresent(guild_id, user_id):
+                self._open(topic[0], guild_id, user_id)
+
+    def joined(self, topic: Tuple, user_id: int):
+        """
+        Start counting for a new member if the topic is already active
+
+        Parameters:
+            topic (Tuple): The topic row
+            user_id (int): The user ID
+        """
+        tracked = self._topics.get((topic[6], topic[1]))
+        if tracked is None:
+            return
+        tracked[1].add(user_id)
+        if self.isPresent(topic[6], user_id):
+            self._open(tracked[0], topic[6], user_id)
+
+    def left(self, guild_id: int, topic_name: str, user_id: int):
+        tracked = self._topics.get((guild_id, topic_name))
+        if tracked is None:
+            return
+        tracked[1].discard(user_id)
+        self._close(tracked[0], guild_id, user_id)
+
+    def topicEnded(self, guild_id: int, topic_name: str):
+        tracked = self._topics.pop((guild_id, topic_name), None)
+        if tracked is None:
+            return
+        for user_id in tracked[1]:
+            self._close(tracked[0], guild_id, user_id)
+
+    def voiceChanged(self, guild_id: int, user_id: int, connected: bool):
+        """
+        Open or close the intervals of a user in every active topic of a guild they attend
+
+        Parameters:
+            guild_id (int): The guild ID
+            user_id (int): The user ID
+            connected (bool): Whether the user is now in a voice channel
+        """
+        for (topic_guild_id, _), (topic_id, attendees) in self._topics.items():
+            if topic_guild_id != guild_id or user_id not in attendees:
+                continue
+            if connected:
+                self._open(topic_id, guild_id, user_id)
+            else:
+                self._close(topic_id, guild_id, user_id)
+
+    def syncPresence(self):
+        """
+        Reconcile every open interval with who is present, e.g. once the guild caches are ready
+        """
+        for (guild_id, _), (topic_id, attendees) in self._topics.items():
+            for user_id in attendees:
+                if self.isPresent(guild_id, user_id):
+                    self._open(topic_id, guild_id, user_id)
+                else:
+                    self._close(topic_id, guild_id, user_id)
+
+    def pendingSeconds(self, guild_id: int, user_id: int) -> int:
+        """
+        The seconds a user has accumulated in a guild that are not in the database yet
+
+        Parameters:
+            guild_id (int): The guild ID
+            user_id (int): The user ID
+
+        Returns:
+            int: The unwritten seconds, including open intervals
+        """
+        now = time.time()
+        seconds = sum(spent for (_, spent_user), (spent_guild, spent) in self._spent.items() if (spent_guild, spent_user) == (guild_id, user_id))
+        seconds += sum(now - started for (_, open_user), (open_guild, started) in self._since.items() if (open_guild, open_user) == (guild_id, user_id))
+        return int(seconds)
+
+    def _open(self, topic_id: int, guild_id: int, user_id: int):
+        self._since.setdefault((topic_id, user_id), (guild_id, time.time()))
+
+    def _close(self, topic_id: int, guild_id: int, user_id: int):
+        interval = self._since.pop((topic_id, user_id), None)
+        if interval is not None:
+            self._add(topic_id, guild_id, user_id, time.time() - interval[1])
+
+    def _add(self, topic_id: int, guild_id: int, user_id: int, seconds: float):
+        spent = self._spent.get((topic_id, user_id), (guild_id, 0.0))[1]
+        self._spent[(topic_id, user_id)] = (guild_id, spent + seconds)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.attendance_flush_interval)
+            try:
+                await self.flush()
+            except Exception as exc:
+                logger.exception('Attendance flush failed due to %s: %s', exc.__class__.__name__, exc)
+
+    async def flush(self) -> int:
+        """
+        Write the accumulated seconds, including the part of each open interval so far, in one transaction
+
+        Returns:
+            int: The number of attendance rows written
+        """
+        now = time.time()
+        for (topic_id, user_id), (guild_id, started) in self._since.items():
+            self._add(topic_id, guild_id, user_id, now - started)
+            self._since[(topic_id, user_id)] = (guild_id, now)
+        rows = []
+        for (topic_id, user_id), (guild_id, spent) in self._spent.items():
+            # whole seconds are written, the fraction waits for the next flush
+            if spent >= 1:
+                rows.append((topic_id, user_id, guild_id, int(spent), int(now)))
+        if not rows:
+            return 0
+        for topic_id, user_id, guild_id, seconds, _ in rows:
+            remainder = self._spent[(topic_id, user_id)][1] - seconds
+            if remainder > 0:
+                self._spent[(topic_id, user_id)] = (guild_id, remainder)
+            else:
+                del self._spent[(topic_id, user_id)]
+        try:
+            async with Database.write() as db:
+                await db.executemany('''
+                    INSERT INTO attendances (topic_id, user_id, guild_id, seconds, last_seen)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (topic_id, user_id) DO UPDATE SET
+                        seconds=seconds + excluded.seconds, last_seen=excluded.last_seen
+                ''', rows)
+        except Exception:
+            # keep the time for the next attempt
+            for topic_id, user_id, guild_id, seconds, _ in rows:
+                self._add(topic_id, guild_id, user_id, seconds)
+            raise
+        logger.debug('Flushed attendance', extra={'count': len(rows)})
+        return len(rows)
@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for the data and rendering layer
+
+Run from the bot/ directory with `python -m benchmarks`, see `python -m benchmarks --help`.
+"""
@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import config
+from database import Database
+from migrations import Migrations
+from cache import SessionCache
+from rendering import EmbedCache
+from log import Log
+from benchmarks.cases import Cases
+from benchmarks.runner import Runner, formatResults
+from benchmarks.seed import Seed, Volumes
+from benchmarks.stubs import StubClient
+
+
+def parseArgs() -> argparse.Namespace:
+    defaults = Volumes()
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark the data and rendering layer against a seeded temporary database')
+    parser.add_argument('--guilds', type=int, default=defaults.guilds)
+    parser.add_argument('--historical-topics', type=int, default=defaults.historical_topics)
+    parser.add_argument('--live-topics', type=int, default=defaults.live_topics)
+    parser.add_argument('--members', type=int, default=defaults.members)
+    parser.add_argument('--reminders', type=int, default=defaults.reminders)
+    parser.add_argument('--resources', type=int, default=defaults.resources)
+    parser.add_argument('--iterations', type=int, default=200, help='timed iterations per case')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed iterations per case')
+    parser.add_argument('--due-batch', type=int, default=20, help='topics made due before each Check tick, and concurrent joins per join storm')
+    parser.add_argument('--cold-cache', action='store_true', help='leave SessionCache unwarmed so every read hits SQLite')
+    parser.add_argument('--filter', help='only run cases whose name contains this text')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='write the log lines of the data layer while the cases run')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    parser.add_argument('--compare', help='a JSON file from an earlier run to compare p50 latencies against')
+    return parser.parse_args()
+
+
+async def main(args: argparse.Namespace):
+    volumes = Volumes(args.guilds, args.historical_topics, args.live_topics, args.members, args.reminders, args.resources)
+    rng = random.Random(args.seed)
+    if args.verbose:
+        Log.setup()
+    directory = tempfile.mkdtemp(prefix='studyassist-bench-')
+    path = os.path.join(directory, 'study.db')
+    await Database.connect(path, config.database_pool_size)
+    try:
+        await Migrations.apply()
+        started = time.perf_counter()
+        dataset = await Seed.populate(volumes, rng)
+        print(f'Seeded {path} in {time.perf_counter() - started:.1f}s')
+        if args.cold_cache:
+            SessionCache.clear()
+        else:
+            await SessionCache.warm()
+        cases = Cases(dataset, rng, StubClient(), args.due_batch).build()
+        if args.filter:
+            cases = [case for case in cases if args.filter.lower() in case.name.lower()]
+        results = await Runner(args.iterations, args.warmup).measureAll(cases)
+    finally:
+        await Database.close()
+        Log.stop()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = {result['name']: result for result in json.load(file)['results']}
+    print(formatResults(results, baseline))
+    print(f'Embed cache: {EmbedCache.hits} hits, {EmbedCache.misses} misses')
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'volumes': volumes._asdict(),
+                'iterations': args.iterations,
+                'cold_cache': args.cold_cache,
+                'results': [result._asdict() for result in results],
+            }, file, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parseArgs()))
@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import random
+from typing import List
+from database import Database
+from cache import SessionCache
+from operations import Operations
+from outbox import Outbox
+from utils import Check, Reminder, Resource, TimeCalculations, Topic
+from benchmarks.seed import Dataset, USER_BASE
+from benchmarks.runner import Case
+from benchmarks.stubs import StubClient
+
+
+class Cases:
+    """
+    Builds the benchmark cases over a seeded dataset
+
+    Read cases pick a random live topic per iteration; write cases use fresh names and users
+    so every iteration takes the success path.
+    """
+    def __init__(self, dataset: Dataset, rng: random.Random, client: StubClient, due_batch: int):
+        self.dataset = dataset
+        self.rng = rng
+        self.client = client
+        self.due_batch = due_batch
+        self._ids = itertools.count(1)
+
+    def topic(self):
+        return self.rng.choice(self.dataset.live_topics)
+
+    def topicKey(self):
+        topic = self.topic()
+        return topic[6], topic[1]
+
+    def authorKey(self):
+        topic = self.topic()
+        return topic[6], topic[5]
+
+    def member(self):
+        return self.rng.choice(self.dataset.members)
+
+    def freshId(self) -> int:
+        return USER_BASE * 2 + next(self._ids)
+
+    async def _insertTopics(self, status: str, start_ts: int, end_ts: int, reminders: int, members: int):
+        # bypasses Operations so setup does not depend on the code under test
+        async with Database.write() as db:
+            for _ in range(self.due_batch):
+                guild_id = self.rng.choice(self.dataset.guild_ids)
+                topic_id = self.freshId()
+                async with db.execute('''
+                    INSERT INTO topics (name, status, start_ts, duration, author_id, guild_id, end_ts)
+                    VALUES (?, ?, ?, 1, ?, ?, ?)
+                    RETURNING *
+                ''', (f'Due {topic_id}', status, start_ts, topic_id, guild_id, end_ts)) as cursor:
+                    topic = await cursor.fetchone()
+                SessionCache.putTopic(topic)
+                for _ in range(reminders):
+                    user_id = self.freshId()
+                    await db.execute('INSERT INTO reminders (guild_id, user_id, topic_name) VALUES (?, ?, ?)', (guild_id, user_id, topic[1]))
+                    SessionCache.addReminder(guild_id, user_id, topic[1])
+                for _ in range(members):
+                    async with db.execute('''
+                        INSERT INTO topic_members (guild_id, topic_name, user_id) VALUES (?, ?, ?) RETURNING *
+                    ''', (guild_id, topic[1], self.freshId())) as cursor:
+                        SessionCache.addMember(await cursor.fetchone())
+
+    async def makeTopicsDueToStart(self):
+        now = TimeCalculations.now()
+        await self._insertTopics('upcoming', now - 1, now + 3600, reminders=5, members=5)
+
+    async def makeTopicsDueToEnd(self):
+        now = TimeCalculations.now()
+        await self._insertTopics('active', now - 120, now - 1, reminders=0, members=5)
+
+    async def createLiveTopic(self):
+        self._created = (await Operations.createTopic(self.rng.choice(self.dataset.guild_ids), f'Bench {self.freshId()}', self.freshId())).topic
+
+    async def joinFreshMember(self):
+        topic = self.topic()
+        self._joined = (topic[6], topic[1], self.freshId())
+        await Operations.joinTopic(*self._joined)
+
+    async def joinStorm(self):
+        # concurrent joins into one topic, as when a popular session opens; they share group commits
+        topic = self.topic()
+        await asyncio.gather(*(Operations.joinTopic(topic[6], topic[1], self.freshId()) for _ in range(self.due_batch)))
+
+    async def queueMessages(self):
+        topic = self.topic()
+        payload = Outbox.payload(content='Benchmark')
+        async with Database.write() as db:
+            await Outbox.enqueue(db, [(f'bench:{self.freshId()}', topic[6], self.freshId(), payload) for _ in range(self.due_batch)])
+
+    async def addUpcomingMember(self):
+        topic = self.rng.choice([topic for topic in self.dataset.live_topics if topic[2] == 'upcoming'])
+        self._joined = (topic[6], topic[1], self.freshId())
+        await Operations.joinTopic(*self._joined)
+
+    def build(self) -> List[Case]:
+        hot = self.dataset.hot_topic
+        guild_ids = self.dataset.guild_ids
+        return [
+            # Topic reads
+            Case('Topic.getActiveTopics', lambda: Topic.getActiveTopics()),
+            Case('Topic.getUpcomingTopics', lambda: Topic.getUpcomingTopics()),
+            Case('Topic.getTopics', lambda: Topic.getTopics(self.rng.choice(guild_ids))),
+            Case('Topic.getTopicByName', lambda: Topic.getTopicByName(*self.topicKey())),
+            Case('Topic.getDetails', lambda: Topic.getDetails(*self.topicKey())),
+            Case('Topic.activeOrUpcomingTopicExists', lambda: Topic.activeOrUpcomingTopicExists(*self.topicKey())),
+            Case('Topic.checkIfAlreadyJoined', lambda: Topic.checkIfAlreadyJoined(*self.member())),
+            Case('Topic.checkIfAuthor', lambda: (lambda topic: Topic.checkIfAuthor(topic[6], topic[1], topic[5]))(self.topic())),
+            Case('Topic.isTopicStarted', lambda: Topic.isTopicStarted(*self.topicKey())),
+            Case('Topic.isTopicEnded', lambda: Topic.isTopicEnded(*self.topicKey())),
+            Case('Topic.authorHasActiveOrUpcomingTopic', lambda: Topic.authorHasActiveOrUpcomingTopic(*self.authorKey())),
+            Case('Topic.getTopicNameByAuthor', lambda: Topic.getTopicNameByAuthor(*self.authorKey())),
+            Case('Topic.getTopicMembers (hot)', lambda: Topic.getTopicMembers(hot[6], hot[1])),
+            Case('Topic.getTopicMembersPage (hot)', lambda: Topic.getTopicMembersPage(hot[6], hot[1])),
+            Case('Topic.countTopicMembers (hot)', lambda: Topic.countTopicMembers(hot[6], hot[1])),
+            Case('Topic.getLiveTopicsPage', lambda: Topic.getLiveTopicsPage(self.rng.choice(guild_ids))),
+            Case('Topic.countLiveTopics', lambda: Topic.countLiveTopics(self.rng.choice(guild_ids))),
+            # rendering
+            Case('Topic.createTopicEmbed', lambda: Topic.createTopicEmbed(self.topic())),
+            Case('Topic.createTopicEmbed (hot)', lambda: Topic.createTopicEmbed(hot)),
+            Case('Topic.createTopicEmbed (end)', lambda: Topic.createTopicEmbed(hot, end=True, members=SessionCache.getMembers(hot[6], hot[1]))),
+            Case('Topic.createTopicsListEmbed', lambda: self.listEmbed()),
+            Case('Topic.createTopicMembersEmbed', lambda: self.membersEmbed()),
+            Case('Topic.createTopicResourcesEmbed', lambda: Topic.createTopicResourcesEmbed(*self.topicKey())),
+            Case('Topic.notifyTopicMembers (hot)', lambda: Topic.notifyTopicMembers(self.client, hot[6], hot[1], 'Benchmark', self.freshId())),
+            # Reminder and Resource reads
+            Case('Reminder.getRemindersByTopic', lambda: Reminder.getRemindersByTopic(*self.topicKey())),
+            Case('Reminder.getRemindersByUser', lambda: Reminder.getRemindersByUser(self.rng.choice(guild_ids), self.member()[2])),
+            Case('Reminder.getReminderUserIds', lambda: Reminder.getReminderUserIds(*self.topicKey())),
+            Case('Reminder.reminderExists', lambda: (lambda member: Reminder.reminderExists(member[0], member[2], member[1]))(self.member())),
+            Case(f'Outbox.deliverDue ({self.due_batch} queued)', lambda: self.client.outbox.deliverDue(), setup=self.queueMessages),
+            Case('Resource.getResources', lambda: Resource.getResources(*self.topicKey())),
+            # writes
+            Case('Resource.addResource', lambda: (lambda topic: Resource.addResource(topic[6], topic[1], topic[5], topic[2], 'https://example.com'))(self.topic())),
+            Case('Operations.createTopic', self.createLiveTopic),
+            Case('Operations.endTopic', lambda: Operations.endTopic(self._created[6], self._created[1], self._created[5]), setup=self.createLiveTopic),
+            Case('Operations.joinTopic', self.joinFreshMember),
+            Case(f'Operations.joinTopic ({self.due_batch} concurrent)', self.joinStorm),
+            Case('Operations.leaveTopic', lambda: Operations.leaveTopic(*self._joined), setup=self.joinFreshMember),
+            Case('Operations.setReminder', lambda: Operations.setReminder(self._joined[0], self._joined[1], self._joined[2]), setup=self.addUpcomingMember),
+            # scheduler ticks, each ending or starting a batch of due topics
+            Case(f'Check.checkStartTimes ({self.due_batch} due)', lambda: Check.checkStartTimes(self.client), setup=self.makeTopicsDueToStart),
+            Case(f'Check.checkEndTimes ({self.due_batch} due)', lambda: Check.checkEndTimes(self.client), setup=self.makeTopicsDueToEnd),
+        ]
+
+    async def listEmbed(self):
+        topics = await Topic.getLiveTopicsPage(self.rng.choice(self.dataset.guild_ids))
+        return await Topic.createTopicsListEmbed(topics, total=len(topics))
+
+    async def membersEmbed(self):
+        hot = self.dataset.hot_topic
+        members = await Topic.getTopicMembersPage(hot[6], hot[1])
+        return await Topic.createTopicMembersEmbed(hot[1], members, total=len(members))
@@ -0,0 +1,96 @@
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+from database import Database
+
+
+class Case(NamedTuple):
+    name: str
+    run: Callable[[], Awaitable]
+    # untimed work before each iteration, e.g. making topics due for a Check tick
+    setup: Optional[Callable[[], Awaitable]] = None
+
+
+class Result(NamedTuple):
+    name: str
+    iterations: int
+    ops_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    queries_per_op: float
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Runner:
+    def __init__(self, iterations: int, warmup: int):
+        self.iterations = iterations
+        self.warmup = warmup
+
+    async def measure(self, case: Case) -> Result:
+        """
+        Time one case, excluding its setup and warm-up iterations
+
+        Parameters:
+            case (Case): The case to run
+
+        Returns:
+            Result: The throughput, latency percentiles and queries per operation
+        """
+        for _ in range(self.warmup):
+            if case.setup is not None:
+                await case.setup()
+            await case.run()
+        samples = []
+        queries = 0
+        for _ in range(self.iterations):
+            if case.setup is not None:
+                await case.setup()
+            before = Database.statementCount()
+            started = time.perf_counter()
+            await case.run()
+            samples.append(time.perf_counter() - started)
+            queries += Database.statementCount() - before
+        total = sum(samples)
+        return Result(
+            name=case.name,
+            iterations=self.iterations,
+            ops_per_sec=self.iterations / total if total else float('inf'),
+            p50_ms=percentile(samples, 0.50) * 1000,
+            p99_ms=percentile(samples, 0.99) * 1000,
+            queries_per_op=queries / self.iterations,
+        )
+
+    async def measureAll(self, cases: List[Case]) -> List[Result]:
+        return [await self.measure(case) for case in cases]
+
+
+def formatResults(results: List[Result], baseline: Dict[str, dict]=None) -> str:
+    """
+    Render results as a fixed-width table, with the p50 change against a baseline run when given
+
+    Parameters:
+        results (List[Result]): The results to render
+        baseline (Dict[str, dict]): Earlier results keyed by case name
+
+    Returns:
+        str: The table
+    """
+    width = max(len(result.name) for result in results)
+    header = f"{'case':<{width}}  {'ops/sec':>10}  {'p50 ms':>8}  {'p99 ms':>8}  {'queries':>7}"
+    if baseline:
+        header += f"  {'p50 vs base':>11}"
+    lines = [header, '-' * len(header)]
+    for result in results:
+        line = (f'{result.name:<{width}}  {result.ops_per_sec:>10.1f}  {result.p50_ms:>8.3f}  '
+                f'{result.p99_ms:>8.3f}  {result.queries_per_op:>7.2f}')
+        if baseline:
+            previous = baseline.get(result.name)
+            if previous and previous['p50_ms']:
+                line += f"  {(result.p50_ms / previous['p50_ms'] - 1) * 100:>+10.1f}%"
+            else:
+                line += f"  {'n/a':>11}"
+        lines.append(line)
+    return '\n'.join(lines)
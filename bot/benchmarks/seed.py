@@ -0,0 +1,89 @@
+import random
+from typing import List, NamedTuple, Tuple
+from database import Database
+from utils import TimeCalculations
+
+# keeps generated IDs in a range that looks like Discord snowflakes
+USER_BASE = 10 ** 17
+GUILD_BASE = 10 ** 18
+
+
+class Volumes(NamedTuple):
+    guilds: int = 10
+    historical_topics: int = 100_000
+    live_topics: int = 1_000
+    members: int = 10_000
+    reminders: int = 50_000
+    resources: int = 5_000
+
+
+class Dataset(NamedTuple):
+    """The seeded guilds and live topics the benchmark cases pick their arguments from"""
+    guild_ids: List[int]
+    live_topics: List[Tuple]
+    hot_topic: Tuple
+    members: List[Tuple[int, str, int]]
+
+
+class Seed:
+    @staticmethod
+    async def populate(volumes: Volumes, rng: random.Random) -> Dataset:
+        """
+        Fill an empty, migrated database with ended, active and upcoming topics and their rows
+
+        Half of the members join one hot topic so its roster is large enough to paginate.
+
+        Parameters:
+            volumes (Volumes): How many rows to create
+            rng (random.Random): The random source, seeded for repeatable runs
+
+        Returns:
+            Dataset: The seeded guilds, live topics and memberships
+        """
+        now = TimeCalculations.now()
+        guild_ids = [GUILD_BASE + (i << 22) for i in range(volumes.guilds)]
+        historical = [
+            (f'History {i}', 'ended', now - rng.randrange(86400, 86400 * 365), rng.choice((0, 30, 60, 90)),
+             USER_BASE + rng.randrange(volumes.historical_topics), rng.choice(guild_ids), None)
+            for i in range(volumes.historical_topics)
+        ]
+        live = []
+        for i in range(volumes.live_topics):
+            # one live topic per author per guild, so authors are unique within the live set
+            upcoming = i % 2 == 0
+            start = now + rng.randrange(600, 86400) if upcoming else now - rng.randrange(60, 3600)
+            duration = rng.choice((30, 60, 120))
+            live.append((f'Live {i}', 'upcoming' if upcoming else 'active', start, duration,
+                         USER_BASE + i, guild_ids[i % len(guild_ids)], start + duration * 60))
+        async with Database.write() as db:
+            await db.executemany('''
+                INSERT INTO topics (name, status, start_ts, duration, author_id, guild_id, end_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', historical + live)
+            async with db.execute('''
+                SELECT * FROM topics WHERE status IN ('active', 'upcoming') ORDER BY id
+            ''') as cursor:
+                live_topics = [tuple(row) for row in await cursor.fetchall()]
+            hot_topic = live_topics[0]
+            members = []
+            for i in range(volumes.members):
+                topic = hot_topic if i % 2 == 0 else live_topics[i % len(live_topics)]
+                members.append((topic[6], topic[1], USER_BASE + volumes.live_topics + i))
+            await db.executemany('''
+                INSERT OR IGNORE INTO topic_members (guild_id, topic_name, user_id) VALUES (?, ?, ?)
+            ''', members)
+            upcoming_topics = [topic for topic in live_topics if topic[2] == 'upcoming']
+            await db.executemany('''
+                INSERT OR IGNORE INTO reminders (guild_id, user_id, topic_name) VALUES (?, ?, ?)
+            ''', [
+                (topic[6], USER_BASE + rng.randrange(volumes.members * 10), topic[1])
+                for topic in (rng.choice(upcoming_topics) for _ in range(volumes.reminders))
+            ])
+            await db.executemany('''
+                INSERT INTO resources (guild_id, topic_name, author_id, status, url) VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (topic[6], topic[1], topic[5], topic[2], f'https://example.com/resources/{i}')
+                for i, topic in enumerate(rng.choice(live_topics) for _ in range(volumes.resources))
+            ])
+            await db.execute('ANALYZE')
+        return Dataset(guild_ids, live_topics, hot_topic, members)
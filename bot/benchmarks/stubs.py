@@ -0,0 +1,37 @@
+from typing import Dict, Optional
+from attendance import AttendanceTracker
+from outbox import Outbox
+
+
+class StubUser:
+    """Stands in for discord.User, counting direct messages instead of sending them"""
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class StubClient:
+    """
+    Stands in for discord.Client with the few methods the data layer calls
+
+    Every user resolves from the client cache, so delivery is measured without any HTTP.
+    """
+    def __init__(self):
+        self._users: Dict[int, StubUser] = {}
+        self.attendance = AttendanceTracker(self)
+        self.outbox = Outbox(self)
+
+    def get_guild(self, guild_id: int) -> None:
+        return None
+
+    def get_user(self, user_id: int) -> Optional[StubUser]:
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = StubUser(user_id)
+        return user
+
+    async def fetch_user(self, user_id: int) -> StubUser:
+        return self.get_user(user_id)
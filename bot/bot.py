@@ -1,29 +1,139 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional
 from discord.ext import commands
 import discord
 import config
+from log import Log
+from database import Database
+from migrations import Migrations
+from cache import SessionCache
+from scheduler import SessionScheduler
+from metrics import Metrics, StartupTimer
+from enrichment import ResourceEnricher
+from attendance import AttendanceTracker
+from writebehind import GroupCommit
+from outbox import Outbox
 
-class Bot(commands.Bot):
+logger = logging.getLogger(__name__)
+
+# AutoShardedBot runs every shard of this process on one connection pool and one scheduler
+BotBase = commands.AutoShardedBot if config.sharded else commands.Bot
+
+class Bot(BotBase):
     def __init__(self, intents: discord.Intents, **kwargs):
+        if config.sharded:
+            kwargs.setdefault('shard_count', config.shard_count)
+            kwargs.setdefault('shard_ids', config.shard_ids)
+        # times every Discord HTTP request for the per-command stats
+        kwargs.setdefault('http_trace', Metrics.httpTrace())
         super().__init__(command_prefix=commands.when_mentioned_or(config.prefix), intents=intents, **kwargs)
+        self.scheduler = SessionScheduler(self)
+        self.enricher = ResourceEnricher()
+        self.attendance = AttendanceTracker(self)
+        self.outbox = Outbox(self)
+        self.startup = StartupTimer()
+        self._finish_startup: Optional[asyncio.Task] = None
 
     async def setup_hook(self):
-        for cog in config.cogs:
+        self.startup.mark('login')
+        # only what the first command needs runs before connecting, the rest waits for the gateway
+        with self.startup.phase('database'):
+            await Database.connect(config.database_path, config.database_pool_size)
+            await Migrations.apply()
+        with self.startup.phase('cache'):
+            await SessionCache.warm()
+            await self.attendance.start()
+        with self.startup.phase('cogs'):
+            await self.loadCogs(config.cogs)
+        self._finish_startup = asyncio.create_task(self.finishStartup())
+
+    async def finishStartup(self):
+        """
+        Once the gateway is ready, load the deferred cogs, start the enricher and the outbox and sync the command tree if it changed
+        """
+        await self.wait_until_ready()
+        self.startup.mark('gateway')
+        with self.startup.phase('deferred cogs'):
+            await self.loadCogs(config.deferred_cogs)
+        with self.startup.phase('enricher'):
+            await self.enricher.start()
+        # picks up the messages left pending or claimed when the last run stopped
+        await self.outbox.start()
+        with self.startup.phase('command sync'):
+            try:
+                await self.syncCommands()
+            except (discord.HTTPException, OSError) as exc:
+                logger.exception('Could not sync the command tree due to %s: %s', exc.__class__.__name__, exc)
+        logger.info('Startup finished: %s', self.startup.breakdown(), extra={'duration_ms': round(self.startup.elapsed() * 1000, 2)})
+
+    async def loadCogs(self, cogs: List[str]):
+        for cog in cogs:
             try:
                 await self.load_extension(cog)
-                print(f'Loaded extension {cog}')
+                logger.info('Loaded extension %s', cog)
             except Exception as exc:
-                print(f'Could not load extension {cog} due to {exc.__class__.__name__}: {exc}')
+                logger.exception('Could not load extension %s due to %s: %s', cog, exc.__class__.__name__, exc)
+
+    def commandTreeHash(self) -> str:
+        payload = json.dumps([command.to_dict(self.tree) for command in self.tree.get_commands()], sort_keys=True)
+        return hashlib.sha256(f'{self.application_id}:{config.legacy_command_guild_id}:{payload}'.encode()).hexdigest()
+
+    async def syncCommands(self):
+        """
+        Sync the application command tree, unless it matches the tree synced last time
+
+        The tree is synced globally. Older versions synced it to a single guild, so with
+        config.legacy_command_guild_id set the commands of that guild are cleared in the same sync.
+        """
+        digest = self.commandTreeHash()
+        try:
+            with open(config.command_tree_hash_file) as file:
+                if file.read().strip() == digest:
+                    logger.info('Command tree unchanged, skipping sync')
+                    return
+        except FileNotFoundError:
+            pass
+        if config.legacy_command_guild_id is not None:
+            guild = discord.Object(id=config.legacy_command_guild_id)
+            self.tree.clear_commands(guild=guild)
+            await self.tree.sync(guild=guild)
+            logger.info('Cleared the guild commands of %s', config.legacy_command_guild_id)
+        await self.tree.sync()
+        temporary = f'{config.command_tree_hash_file}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(digest)
+        os.replace(temporary, config.command_tree_hash_file)
+        logger.info('Synced command tree')
 
-        await self.tree.sync(guild=discord.Object(id=config.guild_id))
+    async def close(self):
+        if self._finish_startup is not None:
+            self._finish_startup.cancel()
+        await self.scheduler.stop()
+        await self.enricher.stop()
+        # the batch being sent is recorded before the HTTP session closes
+        await self.outbox.stop()
+        # the last interval of attendance is written before the pool closes
+        await self.attendance.stop()
+        await super().close()
+        # answer the commands still waiting on a group commit before the pool closes
+        await GroupCommit.drain()
+        await Database.close()
+        Log.stop()
 
     async def on_ready(self):
-        print(f'Logged on as {self.user} (ID: {self.user.id})')
+        logger.info('Logged on as %s (ID: %s)', self.user, self.user.id)
     
     
+Log.setup()
 intents = discord.Intents.default()
 intents.message_content = True
 bot = Bot(intents=intents)
 
 # write general commands here
 
-bot.run(config.token)
+# logging is already routed through Log, so discord.py must not install its own handler
+bot.run(config.token, log_handler=None)
@@ -0,0 +1,182 @@
+from typing import Dict, List, Optional, Set, Tuple
+from database import Database
+from rendering import EmbedCache
+from search import PrefixIndex
+
+LIVE_STATUSES = ('active', 'upcoming')
+
+
+class SessionCache:
+    """
+    In-memory copy of the active and upcoming topics with their members and reminders
+
+    Warmed once at startup and updated write-through by the mutating methods in utils.py,
+    so read-only checks on live topics never touch SQLite. Until it is warmed every
+    lookup reports a miss and callers read from the database instead. Topics are keyed
+    by (guild_id, topic_name) and only guilds on this process's shards are loaded. The
+    autocomplete PrefixIndex follows the live topics held here.
+
+    With config.shared_database other processes write to the same file; refresh() rewarms the
+    cache whenever PRAGMA data_version shows a commit made by another connection.
+    """
+    ready: bool = False
+    # data_version of the writer when the cache was last loaded, it only moves on commits by other connections
+    _data_version: Optional[int] = None
+    _topics: Dict[Tuple[int, str], Tuple] = {}
+    _members: Dict[Tuple[int, str], Dict[int, Tuple]] = {}
+    _reminders: Dict[Tuple[int, str], Set[int]] = {}
+    _authors: Dict[Tuple[int, int], str] = {}
+
+    @staticmethod
+    async def warm():
+        """
+        Load every live topic of the guilds on this process's shards with its members and reminders
+        """
+        # holding the writer keeps this process's own commits out while the version is taken and the rows loaded
+        async with Database.exclusive() as db:
+            await SessionCache._load(db)
+
+    @staticmethod
+    async def refresh() -> bool:
+        """
+        Rewarm the cache if another process has committed since it was loaded
+
+        Returns:
+            bool: Whether the cache was reloaded
+        """
+        async with Database.exclusive() as db:
+            if SessionCache.ready and await SessionCache._dataVersion(db) == SessionCache._data_version:
+                return False
+            await SessionCache._load(db)
+        return True
+
+    @staticmethod
+    async def _dataVersion(db) -> int:
+        async with db.execute('PRAGMA data_version') as cursor:
+            return (await cursor.fetchone())[0]
+
+    @staticmethod
+    async def _load(db):
+        SessionCache.clear()
+        shard_filter, shard_params = Database.shardFilter('topics.guild_id')
+        # one read transaction, so the rows and the version come from the same snapshot
+        await db.execute('BEGIN')
+        try:
+            await SessionCache._loadRows(db, shard_filter, shard_params)
+        finally:
+            await db.execute('COMMIT')
+        SessionCache.ready = True
+
+    @staticmethod
+    async def _loadRows(db, shard_filter: str, shard_params: list):
+        SessionCache._data_version = await SessionCache._dataVersion(db)
+        async with db.execute(f'''
+            SELECT * FROM topics WHERE (status='active' OR status='upcoming'){shard_filter} ORDER BY id
+        ''', shard_params) as cursor:
+            for topic in await cursor.fetchall():
+                SessionCache.putTopic(topic)
+        async with db.execute(f'''
+            SELECT topic_members.* FROM topic_members
+            JOIN topics ON topics.guild_id = topic_members.guild_id AND topics.name = topic_members.topic_name
+            WHERE (topics.status='active' OR topics.status='upcoming'){shard_filter}
+            ORDER BY topic_members.id
+        ''', shard_params) as cursor:
+            for member in await cursor.fetchall():
+                SessionCache.addMember(member)
+        async with db.execute(f'''
+            SELECT reminders.guild_id, reminders.user_id, reminders.topic_name FROM reminders
+            JOIN topics ON topics.guild_id = reminders.guild_id AND topics.name = reminders.topic_name
+            WHERE (topics.status='active' OR topics.status='upcoming'){shard_filter}
+        ''', shard_params) as cursor:
+            for guild_id, user_id, topic_name in await cursor.fetchall():
+                SessionCache.addReminder(guild_id, user_id, topic_name)
+
+    @staticmethod
+    def clear():
+        SessionCache.ready = False
+        EmbedCache.clear()
+        PrefixIndex.clear()
+        SessionCache._topics = {}
+        SessionCache._members = {}
+        SessionCache._reminders = {}
+        SessionCache._authors = {}
+
+    @staticmethod
+    def getTopic(guild_id: int, topic_name: str) -> Optional[Tuple]:
+        return SessionCache._topics.get((guild_id, topic_name))
+
+    @staticmethod
+    def getTopicsByStatus(status: str) -> List[Tuple]:
+        return [topic for topic in SessionCache._topics.values() if topic[2] == status]
+
+    @staticmethod
+    def getTopicNameByAuthor(guild_id: int, author_id: int) -> Optional[str]:
+        return SessionCache._authors.get((guild_id, author_id))
+
+    @staticmethod
+    def getMembers(guild_id: int, topic_name: str) -> List[Tuple]:
+        return list(SessionCache._members.get((guild_id, topic_name), {}).values())
+
+    @staticmethod
+    def isMember(guild_id: int, topic_name: str, user_id: int) -> bool:
+        return user_id in SessionCache._members.get((guild_id, topic_name), ())
+
+    @staticmethod
+    def getReminderUsers(guild_id: int, topic_name: str) -> List[int]:
+        return list(SessionCache._reminders.get((guild_id, topic_name), ()))
+
+    @staticmethod
+    def hasReminder(guild_id: int, user_id: int, topic_name: str) -> bool:
+        return user_id in SessionCache._reminders.get((guild_id, topic_name), ())
+
+    @staticmethod
+    def putTopic(topic: Tuple):
+        if topic[2] not in LIVE_STATUSES:
+            SessionCache.removeTopic(topic[6], topic[1])
+            return
+        if (topic[6], topic[1]) not in SessionCache._topics:
+            PrefixIndex.add(topic[6], topic[1])
+        SessionCache._topics[(topic[6], topic[1])] = tuple(topic)
+        SessionCache._authors[(topic[6], topic[5])] = topic[1]
+        EmbedCache.bump((topic[6], topic[1]))
+
+    @staticmethod
+    def setStatus(guild_id: int, topic_name: str, status: str):
+        topic = SessionCache._topics.get((guild_id, topic_name))
+        if topic is not None:
+            SessionCache.putTopic(topic[:2] + (status,) + topic[3:])
+
+    @staticmethod
+    def removeTopic(guild_id: int, topic_name: str):
+        key = (guild_id, topic_name)
+        topic = SessionCache._topics.pop(key, None)
+        if topic is not None:
+            PrefixIndex.remove(guild_id, topic_name)
+        if topic is not None and SessionCache._authors.get((guild_id, topic[5])) == topic_name:
+            del SessionCache._authors[(guild_id, topic[5])]
+        SessionCache._members.pop(key, None)
+        SessionCache._reminders.pop(key, None)
+        EmbedCache.forget(key)
+
+    @staticmethod
+    def addMember(member: Tuple):
+        key = (member[5], member[1])
+        SessionCache._members.setdefault(key, {})[member[2]] = tuple(member)
+        EmbedCache.bump(key)
+
+    @staticmethod
+    def removeMember(guild_id: int, topic_name: str, user_id: int):
+        SessionCache._members.get((guild_id, topic_name), {}).pop(user_id, None)
+        EmbedCache.bump((guild_id, topic_name))
+
+    @staticmethod
+    def addReminder(guild_id: int, user_id: int, topic_name: str):
+        SessionCache._reminders.setdefault((guild_id, topic_name), set()).add(user_id)
+
+    @staticmethod
+    def removeReminder(guild_id: int, user_id: int, topic_name: str):
+        SessionCache._reminders.get((guild_id, topic_name), set()).discard(user_id)
+
+    @staticmethod
+    def removeReminders(guild_id: int, topic_name: str):
+        SessionCache._reminders.pop((guild_id, topic_name), None)
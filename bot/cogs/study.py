@@ -1,72 +1,308 @@
+import logging
+import math
+from typing import List, Literal, Optional
 from discord.ext import commands
+from discord import app_commands
 import discord
-from utils import Topic, TimeCalculations, Utils, Reminder
-from components import AddResourceView
+from utils import Attendance, Topic, TimeCalculations, Utils
+from operations import Operations, Outcome
+from components import AddResourceView, MemberRosterView, TopicListView
+from metrics import Metrics
+from ratelimit import Admission, CommandLimits, Overloaded, RateLimited, Throttled
+from cache import SessionCache
+from search import MAX_COMPLETIONS, PrefixIndex, TopicSearch
+from series import Series
 import config
+
+logger = logging.getLogger(__name__)
+
+
+class DateConverter(commands.Converter):
+    """Converts a YYYY-MM-DD date to the timestamp of the end of that day in UTC"""
+    async def convert(self, ctx: commands.Context, argument: str) -> int:
+        try:
+            return Series.parseUntil(argument)
+        except ValueError:
+            raise commands.BadArgument(f'{argument} is not a date in the form YYYY-MM-DD')
     
+class SeriesEditFlags(commands.FlagConverter, case_insensitive=True):
+    """What to change about a series, named so that each value is unambiguous: topic: Physics duration: 90"""
+    topic: str = commands.flag(description='The recurring session')
+    rule: Optional[Literal['daily', 'weekly']] = commands.flag(default=None, description='How often the session repeats')
+    until: Optional[DateConverter] = commands.flag(default=None, description='The last day of the series, as YYYY-MM-DD')
+    start: Optional[int] = commands.flag(default=None, description='Minutes from now until the next session starts')
+    duration: Optional[int] = commands.flag(default=None, description='The duration of each session in minutes')
+
 class Study(commands.Cog):
     """The description for Create goes here."""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.topic =  None
+        self.limits = CommandLimits(config.rate_limit_user, config.rate_limit_guild, config.rate_limit_commands)
+        self.admission = Admission(config.max_running_commands, config.command_queue_size, config.command_queue_timeout)
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        # the group's hooks run before its subcommand's, only the subcommand is limited and measured
+        if isinstance(ctx.command, commands.Group):
+            return
+        self.limits.check(ctx)
+        if ctx.interaction is not None and self.admission.mustWait():
+            # the wait for a slot may outlast the three seconds an interaction has to be answered
+            await ctx.defer()
+        await self.admission.acquire()
+        ctx.admitted = True
+        ctx.metrics_token = Metrics.begin()
+
+    def releaseSlot(self, ctx: commands.Context):
+        # runs from the after-hook and the error listener, whichever comes first frees the slot
+        if getattr(ctx, 'admitted', False):
+            ctx.admitted = False
+            self.admission.release()
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        # a hybrid command invoked as a slash command skips the after-hooks when it raises, and so
+        # does cog_command_error when the command's own handler raises, but this event always fires
+        if ctx.cog is self:
+            self.releaseSlot(ctx)
+            self.recordSpan(ctx, True)
+
+    async def cog_after_invoke(self, ctx: commands.Context):
+        self.releaseSlot(ctx)
+        self.recordSpan(ctx, ctx.command_failed)
+
+    def recordSpan(self, ctx: commands.Context, failed: bool):
+        # like the slot, the span is closed by whichever of the after-hook and the error listener runs first
+        token = getattr(ctx, 'metrics_token', None)
+        if token is None:
+            return
+        ctx.metrics_token = None
+        latency = Metrics.end(token, ctx.command.qualified_name, failed)
+        logger.debug('Command finished', extra={
+            'command': ctx.command.qualified_name, 'guild': ctx.guild.id if ctx.guild else None, 'user': ctx.author.id,
+            'duration_ms': round(latency * 1000, 2), 'failed': failed,
+        })
     
-    @commands.group(name='study', invoke_without_command=False)
+    async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        # runs after the command's own handler, which leaves these to it
+        if isinstance(error, RateLimited):
+            logger.info('Rate limited per %s', error.scope, extra={'guild': ctx.guild.id if ctx.guild else None, 'user': ctx.author.id, 'command': ctx.command.qualified_name})
+            if error.first:
+                who = 'This server is' if error.scope == 'guild' else 'You are'
+                await ctx.send(f'{who} sending commands too quickly. Please try again in {math.ceil(error.retry_after)} seconds.', ephemeral=True)
+        elif isinstance(error, Overloaded):
+            logger.warning('Shed command, too many in flight', extra={'guild': ctx.guild.id if ctx.guild else None, 'user': ctx.author.id, 'command': ctx.command.qualified_name})
+            await ctx.send('The bot is busy right now. Please try again in a moment.', ephemeral=True)
+
+    async def resolveTopicName(self, ctx: commands.Context, topic_name: str, autocorrect: bool=True) -> Optional[str]:
+        """
+        Find the live topic a mistyped name refers to, or tell the user which topics come close
+
+        Parameters:
+            ctx (commands.Context): The command context
+            topic_name (str): The name that did not match a live topic exactly
+            autocorrect (bool): Whether a single close match may be used in its place; commands that change
+                memberships only suggest, since e.g. "Physics session 1" is close to "Physics session 2"
+
+        Returns:
+            Optional[str]: The name of the only close match, or None after replying that the topic does not exist
+        """
+        matches = await TopicSearch.search(ctx.guild.id, topic_name, limit=5)
+        topic = TopicSearch.bestMatch(matches) if autocorrect else None
+        if topic is not None:
+            return topic[1]
+        if matches:
+            suggestions = ', '.join(f'`{match.topic[1]}`' for match in matches)
+            await ctx.send(f'The topic does not exist. Did you mean {suggestions}?', ephemeral=True)
+        else:
+            await ctx.send('The topic does not exist.', ephemeral=True)
+        return None
+
+    async def topic_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        # served from the in-memory prefix index, never from SQLite
+        if interaction.guild_id is None:
+            return []
+        return [app_commands.Choice(name=name[:100], value=name) for name in PrefixIndex.complete(interaction.guild_id, current)]
+
+    async def own_topic_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        if interaction.guild_id is None:
+            return []
+        topic_name = SessionCache.getTopicNameByAuthor(interaction.guild_id, interaction.user.id)
+        if topic_name is None or not PrefixIndex.normalize(topic_name).startswith(PrefixIndex.normalize(current)):
+            return []
+        return [app_commands.Choice(name=topic_name[:100], value=topic_name)]
+
+    async def series_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        # a guild has few series, so their names are matched in memory and only reloaded from SQLite once they are stale
+        if interaction.guild_id is None:
+            return []
+        prefix = PrefixIndex.normalize(current)
+        names = [name for name in await Series.getSeriesNames(interaction.guild_id) if any(key.startswith(prefix) for key in PrefixIndex.keys(name))]
+        return [app_commands.Choice(name=name[:100], value=name) for name in names[:MAX_COMPLETIONS]]
+
+    @commands.hybrid_group(name='study', invoke_without_command=False)
+    @commands.guild_only()
     async def study(self, ctx: commands.Context):
         if ctx.invoked_subcommand is None:
             await ctx.send('Invalid study command. Please use `!study <command> <topic>` to create a new study session.', ephemeral=True)
     
     @study.command(name='create', description='Create a new study session', help='Create a new study session')
-    async def create(self, ctx: commands.Context, *args):
-        topic_name, start_time, duration = Utils.parseCreateArgs(args)
-        print(f"Topic: {topic_name}, Start Time: {start_time}, Duration: {duration}")
-        # Check if the topic already exists
-        topic_exists = await Topic.activeOrUpcomingTopicExists(topic_name)
-        print(f"Topic Exists: {topic_exists}")
-        if topic_exists:
+    @app_commands.describe(session='The topic name, then optionally the minutes until it starts and its duration in minutes, e.g. Physics 5 60')
+    async def create(self, ctx: commands.Context, *, session: str):
+        topic_name, start_time, duration = Utils.parseCreateArgs(session.split())
+        logger.debug('Creating topic starting in %s minutes for %s minutes', start_time, duration, extra={'guild': ctx.guild.id, 'topic': topic_name})
+        if start_time:
+            start_time = TimeCalculations.minutesToTimestamp(int(start_time))
+        if duration:
+            duration = int(duration)
+
+        result = await Operations.createTopic(ctx.guild.id, topic_name, ctx.author.id, start_time, duration)
+        if result.outcome is Outcome.TOPIC_EXISTS:
             await ctx.send('There is already an active topic. Please join that topic or wait for it to end.')
             return
-        author_has_active_or_upcoming_topic = await Topic.authorHasActiveOrUpcomingTopic(ctx.author.id)
-        if author_has_active_or_upcoming_topic:
+        if result.outcome is Outcome.AUTHOR_HAS_TOPIC:
             await ctx.send('You cannot create a new topic because you have an active or upcoming topic.')
             return
-        self.topic = Topic(topic_name, ctx.author.id, ctx.guild.id)
-        
-        if start_time:
-            start_time = TimeCalculations.minutesToDateTime(int(start_time))
-        if duration:
-            duration = int(duration)
-            
-        await self.topic.insertTopicToDatabase(start_time, duration)
-        topic_row = await self.topic.getActiveOrUpcomingTopicByName(topic_name)
-        embed = await self.topic.createTopicEmbed(topic_row)
+        self.bot.scheduler.scheduleTopic(result.topic)
+        if result.topic[2] == 'active':
+            self.bot.attendance.topicStarted(result.topic, [])
+        embed = await Topic.createTopicEmbed(result.topic)
         await ctx.send(embed=embed)
 
     @create.error
     async def create_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send('Please provide a topic name.', ephemeral=True)
         elif isinstance(error, commands.BadArgument):
             await ctx.send('Please provide a valid start time and duration.', ephemeral=True)
-            print(error)
+            logger.info('Invalid create arguments: %s', error, extra={'guild': ctx.guild.id if ctx.guild else None, 'user': ctx.author.id})
         elif isinstance(error, commands.CheckFailure):
             await ctx.send('You have an active topic. Please join that topic or wait for it to end.', ephemeral=True)
         else:
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
     
+    @study.command(name='repeat', description='Create a recurring study session', help='Create a study session that repeats daily or weekly until a date (YYYY-MM-DD)')
+    @app_commands.describe(rule='How often the session repeats', until='The last day of the series, as YYYY-MM-DD', session='The topic name, then the minutes until the first session starts and its duration in minutes, e.g. Physics 5 60')
+    async def repeat(self, ctx: commands.Context, rule: Literal['daily', 'weekly'], until: DateConverter, *, session: str):
+        topic_name, start_time, duration = Utils.parseCreateArgs(session.split())
+        if not duration:
+            await ctx.send('Please provide the duration of each session.', ephemeral=True)
+            return
+        start_time = TimeCalculations.minutesToTimestamp(int(start_time)) if start_time else TimeCalculations.now()
+        if start_time > until:
+            await ctx.send('The series would end before its first session.', ephemeral=True)
+            return
+        logger.debug('Creating %s series', rule, extra={'guild': ctx.guild.id, 'topic': topic_name})
+        result = await Operations.createSeries(ctx.guild.id, topic_name, ctx.author.id, rule, start_time, int(duration), until)
+        if result.outcome is Outcome.SERIES_EXISTS:
+            await ctx.send('There is already a recurring session with that name.', ephemeral=True)
+            return
+        self.bot.scheduler.scheduleSeries(result.series)
+        await ctx.send(f'{topic_name} repeats {rule} until {TimeCalculations.formatTimestamp(until, "D")}, the first session starts {TimeCalculations.formatTimestamp(start_time, "R")}.')
+
+    @repeat.error
+    async def repeat_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send('Please provide how often the session repeats, the end date and the topic name.', ephemeral=True)
+        elif isinstance(error, commands.BadArgument):
+            await ctx.send('Please provide daily or weekly, an end date as YYYY-MM-DD and a valid start time and duration.', ephemeral=True)
+        else:
+            await ctx.send('An error occurred. Please try again.', ephemeral=True)
+
+    @study.command(name='series', description='List the recurring study sessions', help='List the recurring study sessions of this server')
+    async def series(self, ctx: commands.Context):
+        rows = await Series.getSeries(ctx.guild.id)
+        if not rows:
+            await ctx.send('There are no recurring sessions.', ephemeral=True)
+            return
+        lines = [
+            f'- **{discord.utils.escape_markdown(name)}** {rule}, {TimeCalculations.minutesToText(duration)}, next {TimeCalculations.formatTimestamp(next_ts, "R")}, until {TimeCalculations.formatTimestamp(until_ts, "D")}'
+            for _, name, rule, duration, _, _, next_ts, until_ts, _ in rows[:config.list_page_size]
+        ]
+        if len(rows) > config.list_page_size:
+            lines.append(f'... and {len(rows) - config.list_page_size} more')
+        embed = discord.Embed(title='Recurring sessions', description='\n'.join(lines), color=discord.Color.green())
+        await ctx.send(embed=embed)
+
+    @study.command(name='series-edit', description='Change a recurring study session', help='Change how often a recurring session repeats, its end date, the minutes until its next session or its duration, e.g. topic: Physics duration: 90')
+    @app_commands.autocomplete(topic=series_autocomplete)
+    async def series_edit(self, ctx: commands.Context, *, flags: SeriesEditFlags):
+        topic, rule, until, start, duration = flags.topic, flags.rule, flags.until, flags.start, flags.duration
+        if rule is None and until is None and start is None and duration is None:
+            await ctx.send('Please provide what to change.', ephemeral=True)
+            return
+        start_time = TimeCalculations.minutesToTimestamp(start) if start is not None else None
+        result = await Operations.editSeries(ctx.guild.id, topic, ctx.author.id, rule, start_time, duration, until)
+        if result.outcome is Outcome.NOT_FOUND:
+            await ctx.send('There is no recurring session with that name.', ephemeral=True)
+            return
+        if result.outcome is Outcome.NOT_AUTHOR:
+            await ctx.send('Only the author can change a recurring session.', ephemeral=True)
+            return
+        if result.topic is not None:
+            # only the occurrence that has not started yet moved; a running one shares no name with it
+            # and keeps its end deadline, and one called off by the new end date just leaves a no-op tick
+            self.bot.scheduler.cancelTopic(ctx.guild.id, topic)
+            self.bot.scheduler.scheduleTopic(result.topic)
+        self.bot.scheduler.scheduleSeries(result.series)
+        await ctx.send(f'Updated {topic}, the next session starts {TimeCalculations.formatTimestamp(result.topic[3] if result.topic else result.series[6], "R")}.', ephemeral=True)
+
+    @series_edit.error
+    async def series_edit_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, (commands.MissingRequiredArgument, commands.MissingRequiredFlag)):
+            await ctx.send('Please provide the topic name and what to change, e.g. topic: Physics duration: 90', ephemeral=True)
+        elif isinstance(error, commands.BadArgument):
+            await ctx.send('Please provide rule: daily or weekly, until: an end date as YYYY-MM-DD and start: and duration: in whole minutes.', ephemeral=True)
+        else:
+            await ctx.send('An error occurred. Please try again.', ephemeral=True)
+
+    @study.command(name='series-cancel', description='Cancel a recurring study session', help='Cancel every future session of a recurring study session')
+    @app_commands.autocomplete(topic=series_autocomplete)
+    async def series_cancel(self, ctx: commands.Context, *, topic: str):
+        result = await Operations.cancelSeries(ctx.guild.id, topic, ctx.author.id)
+        if result.outcome is Outcome.NOT_FOUND:
+            await ctx.send('There is no recurring session with that name.', ephemeral=True)
+            return
+        if result.outcome is Outcome.NOT_AUTHOR:
+            await ctx.send('Only the author can cancel a recurring session.', ephemeral=True)
+            return
+        if result.topic is not None:
+            self.bot.scheduler.cancelTopic(ctx.guild.id, topic)
+        await ctx.send(f'Cancelled every future session of {topic}.')
+
+    @series_cancel.error
+    async def series_cancel_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send('Please provide the topic name.', ephemeral=True)
+        else:
+            await ctx.send('An error occurred. Please try again.', ephemeral=True)
+
     @study.command(name='details', description='Get details of the current study session', help='Get details of the current study session')
-    async def details(self, ctx: commands.Context, *topic_name):
-        topic_name = ' '.join(topic_name)
-        print(f"Details for Topic: {topic_name}")
-        topic_row = await Topic.getDetails(topic_name)
+    @app_commands.autocomplete(topic=topic_autocomplete)
+    async def details(self, ctx: commands.Context, *, topic: str):
+        topic_name = topic
+        logger.debug('Showing topic details', extra={'guild': ctx.guild.id, 'topic': topic_name})
+        topic_row = await Topic.getDetails(ctx.guild.id, topic_name)
         if not topic_row:
-            await ctx.send('The topic does not exist.', ephemeral=True)
-            return
+            topic_name = await self.resolveTopicName(ctx, topic_name)
+            if topic_name is None:
+                return
+            topic_row = await Topic.getDetails(ctx.guild.id, topic_name)
         topic_embed = await Topic.createTopicEmbed(topic_row)
         await ctx.send(embed=topic_embed)
     
     @details.error
     async def details_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send('Please provide a topic name.', ephemeral=True)
         elif isinstance(error, commands.CommandInvokeError):
@@ -76,27 +312,28 @@ class Study(commands.Cog):
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
     
     @study.command(name='join', description='Join the current study session', help='Join the current study session')
-    async def join(self, ctx: commands.Context, *topic_name):
-        topic_name = ' '.join(topic_name)
-        print(f"Joining Topic: {topic_name}")
-        topic_row = await Topic.getActiveOrUpcomingTopicByName(topic_name)
-        if not topic_row:
-            await ctx.send('The topic does not exist.', ephemeral=True)
+    @app_commands.autocomplete(topic=topic_autocomplete)
+    async def join(self, ctx: commands.Context, *, topic: str):
+        topic_name = topic
+        logger.debug('Joining topic', extra={'guild': ctx.guild.id, 'topic': topic_name, 'user': ctx.author.id})
+        result = await Operations.joinTopic(ctx.guild.id, topic_name, ctx.author.id)
+        if result.outcome is Outcome.NOT_FOUND:
+            await self.resolveTopicName(ctx, topic_name, autocorrect=False)
             return
-        user_joined = await Topic.checkIfAlreadyJoined(topic_name, ctx.author.id)
-        if user_joined:
+        if result.outcome is Outcome.ALREADY_JOINED:
             await ctx.send('You have already joined the topic.', ephemeral=True)
             return
-        is_author = await Topic.checkIfAuthor(topic_name, ctx.author.id)
-        if is_author:
+        if result.outcome is Outcome.IS_AUTHOR:
             await ctx.send('You are the author of the topic. You cannot join your own topic.', ephemeral=True)
             return
-        await Topic.joinTopic(topic_name, ctx.author.id)
-        topic_embed = await Topic.createTopicEmbed(topic_row)
+        self.bot.attendance.joined(result.topic, ctx.author.id)
+        topic_embed = await Topic.createTopicEmbed(result.topic)
         await ctx.send(embed=topic_embed)
     
     @join.error
     async def join_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send('Please provide a topic name.', ephemeral=True)
         elif isinstance(error, commands.CommandInvokeError):
@@ -106,27 +343,28 @@ class Study(commands.Cog):
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
             
     @study.command(name='leave', description='Leave the current study session', help='Leave the current study session')
-    async def leave(self, ctx: commands.Context, *topic_name):
-        topic_name = ' '.join(topic_name)
-        print(f"Leaving Topic: {topic_name}")
-        topic_row = await Topic.getActiveOrUpcomingTopicByName(topic_name)
-        if not topic_row:
-            await ctx.send('The topic does not exist.', ephemeral=True)
+    @app_commands.autocomplete(topic=topic_autocomplete)
+    async def leave(self, ctx: commands.Context, *, topic: str):
+        topic_name = topic
+        logger.debug('Leaving topic', extra={'guild': ctx.guild.id, 'topic': topic_name, 'user': ctx.author.id})
+        result = await Operations.leaveTopic(ctx.guild.id, topic_name, ctx.author.id)
+        if result.outcome is Outcome.NOT_FOUND:
+            await self.resolveTopicName(ctx, topic_name, autocorrect=False)
             return
-        is_member = await Topic.checkIfAlreadyJoined(topic_name, ctx.author.id)
-        if not is_member:
+        if result.outcome is Outcome.NOT_MEMBER:
             await ctx.send('You are not a member of the topic.', ephemeral=True)
             return
-        topic_author = await Topic.checkIfAuthor(topic_name, ctx.author.id)
-        if topic_author:
+        if result.outcome is Outcome.IS_AUTHOR:
             await ctx.send('You cannot leave your own topic because you are the author, but you can end it.', ephemeral=True)
             return
-        await Topic.leaveTopic(topic_name, ctx.author.id)
-        topic_embed = await Topic.createTopicEmbed(topic_row)
+        self.bot.attendance.left(ctx.guild.id, topic_name, ctx.author.id)
+        topic_embed = await Topic.createTopicEmbed(result.topic)
         await ctx.send(embed=topic_embed)
         
     @leave.error
     async def leave_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send('Please provide a topic name.', ephemeral=True)
         elif isinstance(error, commands.CommandInvokeError):
@@ -136,26 +374,26 @@ class Study(commands.Cog):
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
 
     @study.command(name='end', description='End the current study session', help='End the current study session')
-    async def end(self, ctx: commands.Context, *topic_name):
-        topic_name = ' '.join(topic_name)
-        print(f"Ending Topic: {topic_name}")
-        topic_row = await Topic.getActiveOrUpcomingTopicByName(topic_name)
-        if not topic_row:
+    @app_commands.autocomplete(topic=own_topic_autocomplete)
+    async def end(self, ctx: commands.Context, *, topic: str):
+        topic_name = topic
+        logger.debug('Ending topic', extra={'guild': ctx.guild.id, 'topic': topic_name, 'user': ctx.author.id})
+        result = await Operations.endTopic(ctx.guild.id, topic_name, ctx.author.id)
+        if result.outcome is Outcome.NOT_FOUND:
             await ctx.send('The topic does not exist.', ephemeral=True)
             return
-        is_author = await Topic.checkIfAuthor(topic_name, ctx.author.id)
-        if not is_author:
+        if result.outcome is Outcome.NOT_AUTHOR:
             await ctx.send('You are not the author of the topic. You cannot end the topic.', ephemeral=True)
             return
-        await Topic.endTopic(topic_name, ctx.author.id)
-        topic_embed = await Topic.createTopicEmbed(topic_row, end=True)
+        self.bot.scheduler.cancelTopic(ctx.guild.id, topic_name)
+        self.bot.attendance.topicEnded(ctx.guild.id, topic_name)
+        topic_embed = await Topic.createTopicEmbed(result.topic, end=True, members=result.members)
         await ctx.send(embed=topic_embed)
-        topic_members = await Topic.getTopicMembers(topic_name)
-        for member in topic_members:
-            await Topic.removeTopicMember(topic_name, member[2])
         
     @end.error
     async def end_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send('Please provide a topic name.', ephemeral=True)
         elif isinstance(error, commands.CommandInvokeError):
@@ -166,38 +404,86 @@ class Study(commands.Cog):
     
     @study.command(name='list', description='List all active study sessions', help='List all active study sessions')
     async def list(self, ctx: commands.Context):
-        active_topics = await Topic.getActiveTopics()
-        upcoming_topics = await Topic.getUpcomingTopics()
-        topic_rows = active_topics + upcoming_topics
-        if not topic_rows:
+        total = await Topic.countLiveTopics(ctx.guild.id)
+        if not total:
             await ctx.send('There are no active topics.', ephemeral=True)
             return
-        embed = await Topic.createTopicsListEmbed(topic_rows)
-        await ctx.send(embed=embed)
+        topic_rows = await Topic.getLiveTopicsPage(ctx.guild.id, limit=config.list_page_size)
+        view = TopicListView(ctx.guild.id, topic_rows, total)
+        await ctx.send(embed=await view.render(), view=view)
     
     @list.error
     async def list_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.CommandInvokeError):
             await ctx.send('There are no active topics.', ephemeral=True)
             raise error
         else:
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
 
+    @study.command(name='search', description='Search the active and upcoming study sessions by name', help='Search the active and upcoming study sessions by name, tolerating typos')
+    async def search(self, ctx: commands.Context, *, query: str):
+        if not query.strip():
+            await ctx.send('Please provide a search query.', ephemeral=True)
+            return
+        matches = await TopicSearch.search(ctx.guild.id, query, limit=config.list_page_size)
+        if not matches:
+            await ctx.send('No topics match your search.', ephemeral=True)
+            return
+        embed = await Topic.createTopicsListEmbed([match.topic for match in matches], title=f'Topics matching "{query}"')
+        await ctx.send(embed=embed)
+
+    @search.error
+    async def search_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send('Please provide a search query.', ephemeral=True)
+        else:
+            await ctx.send('An error occurred. Please try again.', ephemeral=True)
+
+    @study.command(name='members', description='List the members of a study session', help='List the members of a study session')
+    @app_commands.autocomplete(topic=topic_autocomplete)
+    async def members(self, ctx: commands.Context, *, topic: str):
+        topic_name = topic
+        topic_row = await Topic.getActiveOrUpcomingTopicByName(ctx.guild.id, topic_name)
+        if not topic_row:
+            await ctx.send('The topic does not exist.', ephemeral=True)
+            return
+        total = await Topic.countTopicMembers(ctx.guild.id, topic_name)
+        member_rows = await Topic.getTopicMembersPage(ctx.guild.id, topic_name, limit=config.members_page_size)
+        view = MemberRosterView(ctx.guild.id, topic_name, member_rows, total)
+        await ctx.send(embed=await view.render(), view=view)
+
+    @members.error
+    async def members_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send('Please provide a topic name.', ephemeral=True)
+        elif isinstance(error, commands.CommandInvokeError):
+            await ctx.send('The topic does not exist.', ephemeral=True)
+            raise error
+        else:
+            await ctx.send('An error occurred. Please try again.', ephemeral=True)
+
     @study.command(name='resources', description='Add resources to the current study session', help='Add resources to the current study session')
-    async def resources(self, ctx: commands.Context, *args):
-        topic_name = ' '.join(args)
-        print(f"Adding Resources to Topic: {topic_name}")
-        topic_row = await Topic.getActiveOrUpcomingTopicByName(topic_name)
+    @app_commands.autocomplete(topic=topic_autocomplete)
+    async def resources(self, ctx: commands.Context, *, topic: str):
+        topic_name = topic
+        logger.debug('Showing topic resources', extra={'guild': ctx.guild.id, 'topic': topic_name})
+        topic_row = await Topic.getActiveOrUpcomingTopicByName(ctx.guild.id, topic_name)
         if not topic_row:
             await ctx.send('The topic does not exist.', ephemeral=True)
             return
-        is_author = await Topic.checkIfAuthor(topic_name, ctx.author.id)
-        is_member = await Topic.checkIfAlreadyJoined(topic_name, ctx.author.id)
+        is_author = await Topic.checkIfAuthor(ctx.guild.id, topic_name, ctx.author.id)
+        is_member = await Topic.checkIfAlreadyJoined(ctx.guild.id, topic_name, ctx.author.id)
         if not is_member and not is_author:
             await ctx.send('You are not a member of the topic. Please join the topic to view resources.')
             return
-        view = AddResourceView(topic_name, ctx.author.id, topic_row[2])
-        embed = await Topic.createTopicResourcesEmbed(topic_name)
+        view = AddResourceView(ctx.guild.id, topic_name, ctx.author.id, topic_row[2])
+        embed = await Topic.createTopicResourcesEmbed(ctx.guild.id, topic_name)
         if is_author:
             await ctx.send(embed=embed, view=view)
         else:
@@ -205,6 +491,8 @@ class Study(commands.Cog):
     
     @resources.error
     async def resources_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send('Please provide a topic name.', ephemeral=True)
         elif isinstance(error, commands.CommandInvokeError):
@@ -214,30 +502,29 @@ class Study(commands.Cog):
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
 
     @study.command(name='remind', description='Remind member of the current study session', help='Remind members of the current study session')
-    async def remind(self, ctx: commands.Context, *topic_name):
-        topic_name = ' '.join(topic_name)
-        print(f"Reminding Members of Topic: {topic_name}")
-        topic_row = await Topic.getActiveOrUpcomingTopicByName(topic_name)
-        if not topic_row:
+    @app_commands.autocomplete(topic=topic_autocomplete)
+    async def remind(self, ctx: commands.Context, *, topic: str):
+        topic_name = topic
+        logger.debug('Setting reminder', extra={'guild': ctx.guild.id, 'topic': topic_name, 'user': ctx.author.id})
+        result = await Operations.setReminder(ctx.guild.id, topic_name, ctx.author.id)
+        if result.outcome is Outcome.NOT_FOUND:
             await ctx.send('The topic does not exist.', ephemeral=True)
             return
-        is_member = await Topic.checkIfAlreadyJoined(topic_name, ctx.author.id) or await Topic.checkIfAuthor(topic_name, ctx.author.id)
-        if not is_member:
+        if result.outcome is Outcome.NOT_MEMBER:
             await ctx.send('You are not a member of the topic. Please join the topic to receive reminders.')
             return
-        has_started = await Topic.isTopicStarted(topic_name)
-        if has_started:
+        if result.outcome is Outcome.ALREADY_STARTED:
             await ctx.send('The topic has already started.', ephemeral=True)
             return
-        reminer_exists = await Reminder.reminderExists(ctx.author.id, topic_name)
-        if reminer_exists:
+        if result.outcome is Outcome.REMINDER_EXISTS:
             await ctx.send('You have already set a reminder for that topic.', ephemeral=True)
             return
-        await Reminder.newReminder(ctx.author.id, topic_name)
         await ctx.send(f'Reminder is set for the topic: {topic_name}')
     
     @remind.error
     async def remind_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.send('Please provide a topic name.', ephemeral=True)
         elif isinstance(error, commands.CommandInvokeError):
@@ -247,24 +534,74 @@ class Study(commands.Cog):
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
 
     @study.command(name='notify', description='Notify members of the current study session', help='Notify members of the current study session')
-    async def notify(self, ctx: commands.Context, *message):
-        message = ' '.join(list(message))
-        topic_name = await Topic.getTopicNameByAuthor(ctx.author.id)
+    async def notify(self, ctx: commands.Context, *, message: str):
+        topic_name = await Topic.getTopicNameByAuthor(ctx.guild.id, ctx.author.id)
         if not topic_name:
             await ctx.send('You do not have an active topic.', ephemeral=True)
             return
-        print(f"Notifying Members: {message}")
-        await Topic.notifyTopicMembers(self.bot, topic_name, message)
+        logger.debug('Notifying members', extra={'guild': ctx.guild.id, 'topic': topic_name})
+        # a retried interaction or message carries the same id, so it is not delivered twice
+        key = ctx.interaction.id if ctx.interaction is not None else ctx.message.id
+        queued = await Topic.notifyTopicMembers(self.bot, ctx.guild.id, topic_name, message, key)
+        await ctx.send(f'Notifying {queued} members.', ephemeral=True)
     
     @notify.error
     async def notify_error(self, ctx: commands.Context, error: commands.CommandError):
-        if isinstance(error, commands.CommandInvokeError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send('Please provide a message.', ephemeral=True)
+        elif isinstance(error, commands.CommandInvokeError):
             await ctx.send('You do not have an active topic.', ephemeral=True)
             raise error
         else:
             await ctx.send('An error occurred. Please try again.', ephemeral=True)
-    
-    
+
+    @study.command(name='attendance', description='Show the time spent in study sessions', help='Show the time you or another member spent in study sessions')
+    async def attendance(self, ctx: commands.Context, member: discord.Member=None):
+        member = member or ctx.author
+        seconds = await Attendance.getTimeSpent(ctx.guild.id, member.id) + self.bot.attendance.pendingSeconds(ctx.guild.id, member.id)
+        sessions = await Attendance.getSessionCount(ctx.guild.id, member.id)
+        if not seconds:
+            await ctx.send(f'{member.display_name} has not attended any study session yet.', ephemeral=True)
+            return
+        await ctx.send(f'{member.display_name} has spent {TimeCalculations.minutesToText(seconds // 60)} in study sessions ({sessions} recorded).', ephemeral=True)
+
+    @attendance.error
+    async def attendance_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, commands.MemberNotFound):
+            await ctx.send('That member could not be found.', ephemeral=True)
+        else:
+            await ctx.send('An error occurred. Please try again.', ephemeral=True)
+
+    @study.command(name='stats', description='Show per-command latency and query statistics', help='Show per-command latency and query statistics (bot owner only)')
+    @commands.is_owner()
+    async def stats(self, ctx: commands.Context):
+        rows = Metrics.rows()
+        if not rows:
+            await ctx.send('No commands have been recorded yet.', ephemeral=True)
+            return
+        header = ['command', 'calls', 'errors', 'mean ms', 'p95 ms', 'queries', 'sql ms', 'api ms']
+        widths = [max(len(row[i]) for row in rows + [header]) for i in range(len(header))]
+        lines = ['  '.join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))) for row in [header] + rows]
+        table = ''
+        for line in lines:
+            # stay under the 2000 character message limit
+            if len(table) + len(line) > 1900:
+                break
+            table += line + '\n'
+        await ctx.send(f'Per call averages since startup:\n```\n{table}```', ephemeral=True)
+
+    @stats.error
+    async def stats_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, Throttled):
+            return
+        if isinstance(error, commands.NotOwner):
+            await ctx.send('Only the bot owner can view statistics.', ephemeral=True)
+        else:
+            await ctx.send('An error occurred. Please try again.', ephemeral=True)
         
 async def setup(bot: commands.Bot):
-    await bot.add_cog(Study(bot), guilds=[discord.Object(id=config.guild_id)])
+    await bot.add_cog(Study(bot))
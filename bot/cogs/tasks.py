@@ -1,24 +1,81 @@
-from discord.ext import commands, tasks
+import logging
 import discord
-from utils import Check
+from discord.ext import commands, tasks
 import config
+from cache import SessionCache
+from metrics import Metrics
+from retention import Retention
+
+logger = logging.getLogger(__name__)
 
 
 class Tasks(commands.Cog):
-    """The description for Tasks goes here."""
+    """Runs the session scheduler that starts and ends topics on time, feeds voice presence to attendance tracking, archives ended sessions, refreshes the session cache when the database is shared and exports metrics."""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.check_start_times.start()
-        self.check_end_times.start()
-    
-    @tasks.loop(seconds=config.check_start_times_interval)
-    async def check_start_times(self):
-        await Check.checkStartTimes(self.bot)
-    
-    @tasks.loop(seconds=config.check_end_times_interval)
-    async def check_end_times(self):
-        await Check.checkEndTimes()
+
+    async def cog_load(self):
+        await self.bot.scheduler.start()
+        # loaded after the gateway is ready, so on_ready has already fired
+        if config.attendance_voice and self.bot.is_ready():
+            self.bot.attendance.syncPresence()
+        if config.metrics_file:
+            self.export_metrics.change_interval(seconds=config.metrics_interval)
+            self.export_metrics.start()
+        if config.maintenance_interval:
+            self.maintain.change_interval(seconds=config.maintenance_interval)
+            self.maintain.start()
+        if config.shared_database:
+            self.refresh_cache.change_interval(seconds=config.cache_refresh_interval)
+            self.refresh_cache.start()
+
+    async def cog_unload(self):
+        await self.bot.scheduler.stop()
+        if self.refresh_cache.is_running():
+            self.refresh_cache.cancel()
+        self.maintain.cancel()
+        if self.export_metrics.is_running():
+            self.export_metrics.cancel()
+            # keep the counts of the last interval
+            self.writeMetrics()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # voice states are only known once the guilds are cached
+        if config.attendance_voice:
+            self.bot.attendance.syncPresence()
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        if not config.attendance_voice or (before.channel is None) == (after.channel is None):
+            return
+        self.bot.attendance.voiceChanged(member.guild.id, member.id, after.channel is not None)
+
+    @tasks.loop(seconds=3600)
+    async def maintain(self):
+        try:
+            await Retention.run()
+        except Exception as exc:
+            logger.exception('Maintenance failed due to %s: %s', exc.__class__.__name__, exc)
+
+    @tasks.loop(seconds=2)
+    async def refresh_cache(self):
+        # other processes sharing the database write behind this process's cache
+        try:
+            await SessionCache.refresh()
+        except Exception as exc:
+            logger.exception('Cache refresh failed due to %s: %s', exc.__class__.__name__, exc)
+
+    @tasks.loop(seconds=60)
+    async def export_metrics(self):
+        self.writeMetrics()
+
+    def writeMetrics(self):
+        try:
+            Metrics.writePrometheus(config.metrics_file)
+        except OSError as exc:
+            logger.warning('Could not write metrics to %s due to %s: %s', config.metrics_file, exc.__class__.__name__, exc)
 
 async def setup(bot: commands.Bot):
-    await bot.add_cog(Tasks(bot), guilds=[discord.Object(id=config.guild_id)])
+    await bot.add_cog(Tasks(bot))
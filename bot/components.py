@@ -1,10 +1,14 @@
-from discord import Interaction, ButtonStyle, TextStyle, ui
-from utils import Resource
+from abc import ABC, abstractmethod
+from typing import Any, List
+from discord import Embed, Interaction, ButtonStyle, TextStyle, ui
+from utils import Resource, Topic
+import config
 
 
 class AddResourceModal(ui.Modal, title='Add a Resource'):
-    def __init__(self, topic_name: str, author_id: int, status: str):
+    def __init__(self, guild_id: int, topic_name: str, author_id: int, status: str):
         super().__init__()
+        self.guild_id = guild_id
         self.topic_name = topic_name
         self.author_id = author_id
         self.status = status
@@ -13,13 +17,15 @@ class AddResourceModal(ui.Modal, title='Add a Resource'):
 
     async def on_submit(self, interaction: Interaction):
         await interaction.response.defer()
-        await Resource.addResource(self.topic_name, self.author_id, self.status, self.url.value)
+        url_key = await Resource.addResource(self.guild_id, self.topic_name, self.author_id, self.status, self.url.value)
+        interaction.client.enricher.enqueue(url_key)
         success_message = f"Successfully added a new resource to the topic: {self.topic_name}"
         await interaction.followup.send(success_message, ephemeral=True)
 
 class AddResourceView(ui.View):
-    def __init__(self, topic_name: str, author_id: int, status: str):
+    def __init__(self, guild_id: int, topic_name: str, author_id: int, status: str):
         super().__init__(timeout=None)
+        self.guild_id = guild_id
         self.topic_name = topic_name
         self.author_id = author_id
         self.status = status
@@ -27,4 +33,77 @@ class AddResourceView(ui.View):
     @ui.button(label='Add Resource', style=ButtonStyle.primary)
     async def add_resource(self, interaction: Interaction, button: ui.Button):
         # Send a modal with a form to add a new resource
-        await interaction.response.send_modal(AddResourceModal(self.topic_name, self.author_id, self.status))
\ No newline at end of file
+        await interaction.response.send_modal(AddResourceModal(self.guild_id, self.topic_name, self.author_id, self.status))
+
+class PaginatedView(ui.View, ABC):
+    """Previous/next buttons over keyset-paginated rows, fetching one page per click"""
+    def __init__(self, rows: List[Any], total: int, page_size: int):
+        super().__init__(timeout=300)
+        self.rows = rows
+        self.total = total
+        self.page_size = page_size
+        self.page = 0
+        # the keyset cursor each visited page starts after, so going back needs no offsets
+        self.cursors = [None]
+        self.updateButtons()
+
+    @abstractmethod
+    async def fetchPage(self, cursor) -> List[Any]:
+        ...
+
+    @abstractmethod
+    def cursorAfter(self, row) -> Any:
+        ...
+
+    @abstractmethod
+    async def render(self) -> Embed:
+        ...
+
+    def updateButtons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = len(self.rows) < self.page_size or (self.page + 1) * self.page_size >= self.total
+
+    async def showPage(self, interaction: Interaction, page: int):
+        if page == len(self.cursors):
+            self.cursors.append(self.cursorAfter(self.rows[-1]))
+        self.page = page
+        self.rows = await self.fetchPage(self.cursors[page])
+        self.updateButtons()
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @ui.button(label='Previous', style=ButtonStyle.secondary)
+    async def previous_page(self, interaction: Interaction, button: ui.Button):
+        await self.showPage(interaction, self.page - 1)
+
+    @ui.button(label='Next', style=ButtonStyle.secondary)
+    async def next_page(self, interaction: Interaction, button: ui.Button):
+        await self.showPage(interaction, self.page + 1)
+
+class TopicListView(PaginatedView):
+    def __init__(self, guild_id: int, rows: List[Any], total: int):
+        self.guild_id = guild_id
+        super().__init__(rows, total, config.list_page_size)
+
+    async def fetchPage(self, cursor) -> List[Any]:
+        return await Topic.getLiveTopicsPage(self.guild_id, cursor, self.page_size)
+
+    def cursorAfter(self, row) -> Any:
+        return (row[3], row[0])
+
+    async def render(self) -> Embed:
+        return await Topic.createTopicsListEmbed(self.rows, page=self.page, total=self.total)
+
+class MemberRosterView(PaginatedView):
+    def __init__(self, guild_id: int, topic_name: str, rows: List[Any], total: int):
+        self.guild_id = guild_id
+        self.topic_name = topic_name
+        super().__init__(rows, total, config.members_page_size)
+
+    async def fetchPage(self, cursor) -> List[Any]:
+        return await Topic.getTopicMembersPage(self.guild_id, self.topic_name, cursor or 0, self.page_size)
+
+    def cursorAfter(self, row) -> Any:
+        return row[0]
+
+    async def render(self) -> Embed:
+        return await Topic.createTopicMembersEmbed(self.topic_name, self.rows, page=self.page, total=self.total)
@@ -1,6 +1,85 @@
 token = "YOUR_BOT_TOKEN"
-cogs = ["cogs.study", "cogs.tasks"]
-guild_id = 1234567890
+# cogs are loaded before connecting; deferred_cogs are loaded in the background once the gateway is ready
+cogs = ["cogs.study"]
+deferred_cogs = ["cogs.tasks"]
 prefix = "!" 
-check_start_times_interval=10
-check_end_times_interval=10
\ No newline at end of file
+database_path = "study.db"
+database_pool_size = 4
+delivery_concurrency = 8
+delivery_user_cache_size = 1000
+embed_cache_size = 256
+list_page_size = 10
+members_page_size = 20
+# run one process per group of shards: set sharded = True, the total shard_count and the shard_ids this process owns
+sharded = False
+shard_count = None
+shard_ids = None
+# write Prometheus text-format metrics to this file every metrics_interval seconds, e.g. for the node_exporter textfile collector
+metrics_file = None
+metrics_interval = 60
+# logging is written by a background thread; log_format is "json" or "text", log_file None means stdout
+log_level = "INFO"
+log_format = "json"
+log_file = None
+# fraction of DEBUG lines kept, e.g. the per-command timing lines
+log_debug_sample_rate = 0.1
+# link previews for !study resources, fetched in the background
+resource_fetch_concurrency = 4
+resource_fetch_timeout = 10
+resource_fetch_max_bytes = 65536
+resource_fetch_max_redirects = 5
+resource_metadata_ttl = 604800
+resource_metadata_error_ttl = 3600
+# fuzzy topic lookup: names containing less than search_min_coverage of the query are hidden, and a single match at or above search_autocorrect_similarity is used in place of a mistyped name
+search_min_coverage = 0.5
+search_autocorrect_similarity = 0.5
+# attendance is accumulated in memory and written every attendance_flush_interval seconds; with attendance_voice only time spent in a voice channel of the guild counts
+attendance_flush_interval = 60
+attendance_voice = False
+# ended topics and their resources move to the archive tables archive_after seconds after they end; maintenance runs every maintenance_interval seconds, 0 disables it
+archive_after = 86400
+archive_batch_size = 500
+maintenance_interval = 3600
+# return up to vacuum_pages free pages per maintenance run; needs the one-time offline rebuild `python retention.py --enable-incremental-vacuum` with the bot stopped
+incremental_vacuum = True
+vacuum_pages = 1000
+# joins, leaves and reminders arriving within group_commit_delay seconds share one commit, up to group_commit_max_ops per commit; 0 commits as soon as the writer is free, batching only what queued meanwhile
+group_commit_delay = 0.005
+group_commit_max_ops = 128
+# hash of the last synced slash command tree; the sync is skipped on restart while it matches
+command_tree_hash_file = ".command_tree_hash"
+# slash commands used to be synced to one guild only; set this to that guild's ID and its old copies, listed next to the global commands, are removed on the next sync
+legacy_command_guild_id = None
+# several bot processes on one host may share the database file: set shared_database = True in each; one of them at a time holds the scheduler lease (renewed every scheduler_lease_ttl / 3 seconds)
+# and the others rewarm their session cache every cache_refresh_interval seconds when another process has written
+shared_database = False
+scheduler_lease_ttl = 30
+cache_refresh_interval = 2
+# a connection waits up to database_busy_timeout ms for a lock held by another process; BEGIN IMMEDIATE is retried database_busy_retries times after that, backing off from database_busy_backoff seconds
+database_busy_timeout = 5000
+database_busy_retries = 5
+database_busy_backoff = 0.05
+# reminders and notifications go through the outbox table: up to outbox_batch_size messages are claimed for outbox_claim_timeout seconds per batch, failures are retried up to outbox_max_attempts times
+# backing off from outbox_retry_backoff seconds up to outbox_retry_max_delay; the outbox is polled every outbox_poll_interval seconds and finished messages are kept outbox_retention seconds
+outbox_batch_size = 100
+outbox_claim_timeout = 120
+outbox_max_attempts = 8
+outbox_retry_backoff = 5
+outbox_retry_max_delay = 3600
+outbox_poll_interval = 30
+outbox_retention = 604800
+# recurring sessions: the next occurrence of a series becomes an upcoming topic series_lookahead seconds before it starts, up to series_batch_size series per run;
+# an occurrence clashing with a live topic of the same name or author is retried every series_retry_interval seconds until it would have started
+series_lookahead = 3600
+series_batch_size = 100
+series_retry_interval = 60
+# the series names offered by autocomplete are reloaded at most every series_names_ttl seconds
+series_names_ttl = 30
+# study commands are limited with token buckets of (commands, per seconds) per user, per guild and, for the expensive commands listed, per user and command
+rate_limit_user = (5, 10)
+rate_limit_guild = (60, 10)
+rate_limit_commands = {"study notify": (2, 60), "study repeat": (3, 60)}
+# at most max_running_commands study commands run at once; up to command_queue_size more wait command_queue_timeout seconds for a slot, the rest are turned away
+max_running_commands = 32
+command_queue_size = 64
+command_queue_timeout = 2
\ No newline at end of file
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import random
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import aiosqlite
+import config
+from metrics import Metrics, StatementCounter
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """
+    Bot-scoped pool of SQLite connections shared by the data-access classes in utils.py
+
+    One writer connection is serialised behind a lock and commits when its block exits,
+    while a small pool of read-only WAL-mode connections serves reads concurrently. Every
+    connection waits config.database_busy_timeout ms for locks held by other processes, and a
+    write transaction that still cannot start is retried with exponential backoff, so several
+    processes can share the file.
+    """
+    path: str = 'study.db'
+    _writer: Optional[aiosqlite.Connection] = None
+    _write_lock: Optional[asyncio.Lock] = None
+    _readers: Optional[asyncio.Queue] = None
+    _connections: List[aiosqlite.Connection] = []
+    _counters: Dict[aiosqlite.Connection, StatementCounter] = {}
+
+    @classmethod
+    async def connect(cls, path: str, pool_size: int):
+        """
+        Open the writer and the reader pool
+
+        Parameters:
+            path (str): The path of the SQLite database file
+            pool_size (int): The number of reader connections
+        """
+        if cls._writer is not None:
+            return
+        cls.path = path
+        # transactions on the writer are opened explicitly by write(), so DDL is transactional too
+        cls._writer = await aiosqlite.connect(path, isolation_level=None)
+        await cls._writer.execute(f'PRAGMA busy_timeout={int(config.database_busy_timeout)}')
+        # WAL lets the readers keep working while the writer holds its lock
+        await cls._writer.execute_fetchall('PRAGMA journal_mode=WAL')
+        # in WAL mode NORMAL only syncs at checkpoints, a power loss can drop the last commits but never corrupts
+        await cls._writer.execute('PRAGMA synchronous=NORMAL')
+        cls._connections = [cls._writer]
+        cls._write_lock = asyncio.Lock()
+        cls._readers = asyncio.Queue()
+        for _ in range(max(1, pool_size)):
+            reader = await aiosqlite.connect(path)
+            await reader.execute(f'PRAGMA busy_timeout={int(config.database_busy_timeout)}')
+            await reader.execute('PRAGMA query_only=ON')
+            cls._connections.append(reader)
+            cls._readers.put_nowait(reader)
+        cls._counters = {}
+        for connection in cls._connections:
+            cls._counters[connection] = StatementCounter()
+            await connection.set_trace_callback(cls._counters[connection])
+
+    @classmethod
+    async def close(cls):
+        """
+        Close every pooled connection
+        """
+        for connection in cls._connections:
+            await connection.close()
+        cls._connections = []
+        cls._counters = {}
+        cls._writer = None
+        cls._write_lock = None
+        cls._readers = None
+
+    @classmethod
+    @asynccontextmanager
+    async def read(cls) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Borrow a reader connection from the pool
+        """
+        reader = await cls._readers.get()
+        try:
+            with Metrics.sql(cls._counters[reader]):
+                yield reader
+        finally:
+            cls._readers.put_nowait(reader)
+
+    @classmethod
+    @asynccontextmanager
+    async def write(cls) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Hold the writer connection, committing on success and rolling back on error
+        """
+        async with cls._write_lock:
+            with Metrics.sql(cls._counters[cls._writer]):
+                await cls._begin()
+                try:
+                    yield cls._writer
+                except BaseException:
+                    await cls._writer.execute('ROLLBACK')
+                    raise
+                await cls._writer.execute('COMMIT')
+
+    @staticmethod
+    def isBusy(error: sqlite3.OperationalError) -> bool:
+        code = getattr(error, 'sqlite_errorcode', None)
+        if code is not None:
+            return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        return 'locked' in str(error) or 'busy' in str(error)
+
+    @classmethod
+    async def _begin(cls):
+        # busy_timeout already waited for the lock, back off before asking again so processes do not retry in lockstep
+        for attempt in range(config.database_busy_retries + 1):
+            try:
+                await cls._writer.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as exc:
+                if not cls.isBusy(exc) or attempt == config.database_busy_retries:
+                    raise
+                delay = config.database_busy_backoff * 2 ** attempt * (1 + random.random())
+                logger.warning('Database is busy, retrying in %.2f s', delay, extra={'count': attempt + 1})
+                await asyncio.sleep(delay)
+
+    @classmethod
+    @asynccontextmanager
+    async def exclusive(cls) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Hold the writer connection outside a transaction, for statements such as VACUUM that cannot run inside one
+        """
+        async with cls._write_lock:
+            with Metrics.sql(cls._counters[cls._writer]):
+                yield cls._writer
+
+    @classmethod
+    def counter(cls, connection: aiosqlite.Connection) -> StatementCounter:
+        """
+        Get the statement counter of a pooled connection, for Metrics.charge
+        """
+        return cls._counters[connection]
+
+    @classmethod
+    def statementCount(cls) -> int:
+        """
+        Get the number of statements run on every pooled connection since connect, excluding transaction control
+        """
+        return sum(counter.count for counter in cls._counters.values())
+
+    @staticmethod
+    def shardFilter(column: str='guild_id') -> Tuple[str, list]:
+        """
+        Build an SQL condition restricting a guild ID column to the shards this process owns
+
+        Parameters:
+            column (str): The guild ID column
+
+        Returns:
+            Tuple[str, list]: The condition, starting with AND or empty when every shard is owned, and its parameters
+        """
+        if not config.sharded or not config.shard_ids:
+            return '', []
+        placeholders = ', '.join('?' * len(config.shard_ids))
+        # the shard of a guild is (guild_id >> 22) % shard_count, as documented by Discord
+        return f' AND ({column} >> 22) % ? IN ({placeholders})', [config.shard_count, *config.shard_ids]
@@ -0,0 +1,44 @@
+from collections import OrderedDict
+from typing import Optional
+import discord
+import config
+
+
+class Delivery:
+    """
+    Resolves the recipients of direct messages, from cache before hitting the API
+
+    discord.py already queues requests per rate-limit bucket and retries on 429, so the outbox
+    only caps how many sends are in flight.
+    """
+    _users: 'OrderedDict[int, discord.User]' = OrderedDict()
+
+    @staticmethod
+    async def resolveUser(bot: discord.Client, user_id: int) -> Optional[discord.User]:
+        """
+        Get a user from the client cache, falling back to fetch_user
+
+        Parameters:
+            bot (discord.Client): The bot instance
+            user_id (int): The user ID
+
+        Returns:
+            Optional[discord.User]: The user, or None if it could not be fetched this time
+
+        Raises:
+            discord.NotFound: If the account does not exist, which retrying will not change
+        """
+        user = bot.get_user(user_id) or Delivery._users.get(user_id)
+        if user is None:
+            try:
+                user = await bot.fetch_user(user_id)
+            except discord.NotFound:
+                raise
+            except discord.HTTPException:
+                return None
+            Delivery._users[user_id] = user
+            if len(Delivery._users) > config.delivery_user_cache_size:
+                Delivery._users.popitem(last=False)
+        elif user_id in Delivery._users:
+            Delivery._users.move_to_end(user_id)
+        return user
@@ -0,0 +1,268 @@
+import asyncio
+import html
+import ipaddress
+import logging
+import re
+import socket
+import time
+from typing import List, Optional, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import aiohttp
+from aiohttp.abc import AbstractResolver, ResolveResult
+from aiohttp.resolver import DefaultResolver
+from yarl import URL
+import config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# query parameters that only track where a link was shared and never change the resource
+TRACKING_PARAMETERS = ('utm_', 'fbclid', 'gclid')
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class BlockedAddress(OSError):
+    """A resource link that points at a loopback, private, link-local or reserved address"""
+
+
+def isPublicAddress(host: str) -> bool:
+    address = ipaddress.ip_address(host.split('%', 1)[0])
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+class PublicResolver(AbstractResolver):
+    """
+    Resolves like aiohttp's default resolver but refuses hosts with any non-public address
+
+    The connection is made to the addresses checked here, so a name cannot pass the check and
+    then resolve somewhere else; this covers every redirect hop as well.
+    """
+
+    def __init__(self):
+        self._resolver = DefaultResolver()
+
+    async def resolve(self, host: str, port: int=0, family: socket.AddressFamily=socket.AF_INET) -> List[ResolveResult]:
+        addresses = await self._resolver.resolve(host, port, family)
+        for address in addresses:
+            if not isPublicAddress(address['host']):
+                raise BlockedAddress(f'{host} resolves to {address["host"]}')
+        return addresses
+
+    async def close(self):
+        await self._resolver.close()
+
+
+class ResourceEnricher:
+    """
+    Background fetcher that stores the title, content type and size of resource links
+
+    Links are normalised so one URL shared in many topics is fetched once, and the results are
+    kept in the resource_metadata table until they expire. Commands only ever read that table,
+    so rendering resources never waits on the network.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # normalised URLs that are queued or being fetched
+        self._pending: Set[str] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._workers: List[asyncio.Task] = []
+
+    @staticmethod
+    def normalizeUrl(url: str) -> str:
+        """
+        Reduce a URL to the form used as its metadata key
+
+        Lowercases the scheme and host, drops default ports, fragments and tracking parameters,
+        and sorts the query so equivalent links share one key.
+
+        Parameters:
+            url (str): The URL as submitted
+
+        Returns:
+            str: The normalised URL, or the stripped input if it is not an http(s) URL
+        """
+        url = url.strip()
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS or not parts.hostname:
+            return url
+        host = parts.hostname
+        if ':' in host:
+            host = f'[{host}]'
+        if port is not None and port != DEFAULT_PORTS[scheme]:
+            host = f'{host}:{port}'
+        if parts.username:
+            host = f'{parts.username}:{parts.password}@{host}' if parts.password else f'{parts.username}@{host}'
+        query = sorted(
+            (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith(TRACKING_PARAMETERS)
+        )
+        return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+    async def start(self):
+        """
+        Open the HTTP session, start the workers and queue every live resource without fresh metadata
+        """
+        if self._session is not None:
+            return
+        self._session = aiohttp.ClientSession(
+            # links are submitted by any topic author, so the bot must not reach into its own network
+            connector=aiohttp.TCPConnector(resolver=PublicResolver()),
+            timeout=aiohttp.ClientTimeout(total=config.resource_fetch_timeout),
+            headers={'User-Agent': 'StudyAssist-Bot (resource previews)'},
+        )
+        self._workers = [asyncio.create_task(self._work()) for _ in range(max(1, config.resource_fetch_concurrency))]
+        await self._backfillKeys()
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT DISTINCT resources.url_key FROM resources
+                LEFT JOIN resource_metadata ON resource_metadata.url = resources.url_key
+                WHERE resources.status IN ('active', 'upcoming')
+                AND (resource_metadata.url IS NULL OR resource_metadata.expires_at <= ?)
+            ''', (int(time.time()),)) as cursor:
+                for (url_key,) in await cursor.fetchall():
+                    self.enqueue(url_key)
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def enqueue(self, url_key: str):
+        """
+        Fetch the metadata of a normalised URL in the background, unless it is already queued
+
+        Parameters:
+            url_key (str): The normalised URL
+        """
+        if url_key in self._pending or not url_key.startswith(('http://', 'https://')):
+            return
+        self._pending.add(url_key)
+        self._queue.put_nowait(url_key)
+
+    async def _backfillKeys(self):
+        # resources added before enrichment existed have no key yet
+        async with Database.read() as db:
+            async with db.execute('SELECT id, url FROM resources WHERE url_key IS NULL') as cursor:
+                rows = await cursor.fetchall()
+        if rows:
+            async with Database.write() as db:
+                await db.executemany('UPDATE resources SET url_key=? WHERE id=?', [
+                    (ResourceEnricher.normalizeUrl(url), resource_id) for resource_id, url in rows
+                ])
+
+    async def _work(self):
+        while True:
+            url_key = await self._queue.get()
+            try:
+                if not await self._isFresh(url_key):
+                    await self._store(url_key, **await self._fetch(url_key))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Could not enrich resource %s', url_key)
+            finally:
+                self._pending.discard(url_key)
+                self._queue.task_done()
+
+    async def _isFresh(self, url_key: str) -> bool:
+        async with Database.read() as db:
+            async with db.execute('SELECT expires_at FROM resource_metadata WHERE url=?', (url_key,)) as cursor:
+                row = await cursor.fetchone()
+        return row is not None and row[0] > time.time()
+
+    @staticmethod
+    def checkHost(url: str):
+        """
+        Refuse a URL whose host is a non-public IP literal, which aiohttp connects to without resolving
+
+        Raises:
+            BlockedAddress: If the host is a loopback, private, link-local or reserved address
+        """
+        host = urlsplit(url).hostname or ''
+        try:
+            public = isPublicAddress(host)
+        except ValueError:
+            # a name, checked by PublicResolver when connecting
+            return
+        if not public:
+            raise BlockedAddress(f'{host} is not a public address')
+
+    async def _fetch(self, url_key: str) -> dict:
+        try:
+            url = url_key
+            # redirects are followed by hand so every hop is checked before it is requested
+            for _ in range(config.resource_fetch_max_redirects + 1):
+                ResourceEnricher.checkHost(url)
+                async with self._session.get(url, allow_redirects=False) as response:
+                    location = response.headers.get('Location')
+                    if response.status in REDIRECT_STATUSES and location:
+                        url = str(response.url.join(URL(location)))
+                        if not url.startswith(('http://', 'https://')):
+                            return {'title': None, 'content_type': None, 'size': None, 'status': response.status, 'error': 'UnsupportedRedirect'}
+                        continue
+                    return await ResourceEnricher._describe(response)
+            return {'title': None, 'content_type': None, 'size': None, 'status': None, 'error': 'TooManyRedirects'}
+        except BlockedAddress:
+            logger.info('Refused to fetch resource %s on a non-public address', url_key)
+            return {'title': None, 'content_type': None, 'size': None, 'status': None, 'error': 'BlockedAddress'}
+        except aiohttp.ClientConnectorError as exc:
+            error = 'BlockedAddress' if isinstance(exc.os_error, BlockedAddress) else exc.__class__.__name__
+            if error == 'BlockedAddress':
+                logger.info('Refused to fetch resource %s on a non-public address', url_key)
+            return {'title': None, 'content_type': None, 'size': None, 'status': None, 'error': error}
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeError, LookupError, ValueError) as exc:
+            return {'title': None, 'content_type': None, 'size': None, 'status': None, 'error': exc.__class__.__name__}
+
+    @staticmethod
+    async def _describe(response: aiohttp.ClientResponse) -> dict:
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip() or None
+        size = response.content_length
+        title = None
+        if content_type in ('text/html', 'application/xhtml+xml'):
+            # only the head of the page is needed for its title
+            head = b''
+            while len(head) < config.resource_fetch_max_bytes and b'</title' not in head.lower():
+                chunk = await response.content.read(config.resource_fetch_max_bytes - len(head))
+                if not chunk:
+                    break
+                head += chunk
+            match = TITLE_PATTERN.search(head)
+            if match:
+                charset = response.charset or 'utf-8'
+                title = html.unescape(match.group(1).decode(charset, errors='replace')).strip()
+                title = ' '.join(title.split())[:200] or None
+        return {'title': title, 'content_type': content_type, 'size': size, 'status': response.status, 'error': None}
+
+    async def _store(self, url_key: str, title: Optional[str], content_type: Optional[str], size: Optional[int], status: Optional[int], error: Optional[str]):
+        now = int(time.time())
+        # failures are retried sooner than successful lookups are refreshed
+        ttl = config.resource_metadata_ttl if error is None and status is not None and status < 400 else config.resource_metadata_error_ttl
+        async with Database.write() as db:
+            await db.execute('''
+                INSERT INTO resource_metadata (url, title, content_type, size, status, error, fetched_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    title=excluded.title, content_type=excluded.content_type, size=excluded.size,
+                    status=excluded.status, error=excluded.error, fetched_at=excluded.fetched_at, expires_at=excluded.expires_at
+            ''', (url_key, title, content_type, size, status, error, now, now + ttl))
+        logger.debug('Enriched resource %s', url_key, extra={'failed': error is not None})
+
+    async def join(self):
+        """
+        Wait until every queued URL has been fetched
+        """
+        await self._queue.join()
@@ -0,0 +1,54 @@
+import logging
+import os
+import socket
+import time
+import uuid
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    """
+    Time-limited ownership of a named job among the processes sharing the database
+
+    The holder renews the lease well before it expires; if the holder dies, the lease runs out
+    and the next process to ask takes it over, so the job fails over without coordination.
+    """
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.held = False
+
+    async def acquire(self) -> bool:
+        """
+        Take the lease if it is free or expired, or renew it if this process holds it
+
+        Returns:
+            bool: Whether this process holds the lease for the next ttl seconds
+        """
+        now = time.time()
+        async with Database.write() as db:
+            async with db.execute('''
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at <= ?
+                RETURNING holder
+            ''', (self.name, self.holder, now + self.ttl, now)) as cursor:
+                held = await cursor.fetchone() is not None
+        if held != self.held:
+            logger.info('%s lease %s', 'Acquired' if held else 'Lost', self.name)
+        self.held = held
+        return held
+
+    async def release(self):
+        """
+        Give the lease up so another process can take over without waiting for it to expire
+        """
+        if not self.held:
+            return
+        self.held = False
+        async with Database.write() as db:
+            await db.execute('DELETE FROM leases WHERE name=? AND holder=?', (self.name, self.holder))
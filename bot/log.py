@@ -0,0 +1,87 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from typing import Optional
+import config
+
+# structured fields passed through `extra`, written in this order when present
+FIELDS = ('command', 'guild', 'topic', 'user', 'duration_ms', 'count', 'failed')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the message, its level and any structured fields"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain log lines for local development, with the structured fields appended as key=value"""
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = ' '.join(f'{field}={getattr(record, field)}' for field in FIELDS if hasattr(record, field))
+        return f'{line} {fields}' if fields else line
+
+
+class DebugSampler(logging.Filter):
+    """Keep only a fraction of DEBUG records so per-command lines stay cheap under load"""
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class Log:
+    """
+    Logging that never writes to stdout on the event loop
+
+    Records are put on an in-memory queue by a QueueHandler on the root logger, and a
+    QueueListener thread formats and writes them. discord.py's own loggers go through the same queue.
+    """
+    _listener: Optional[logging.handlers.QueueListener] = None
+
+    @staticmethod
+    def setup():
+        """
+        Route every logger through the queue, using the level, format and sample rate from config.py
+        """
+        if Log._listener is not None:
+            return
+        stream = logging.FileHandler(config.log_file, encoding='utf-8') if config.log_file else logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if config.log_format == 'json' else TextFormatter())
+        records = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(records)
+        handler.addFilter(DebugSampler(config.log_debug_sample_rate))
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(config.log_level)
+        Log._listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+        Log._listener.start()
+
+    @staticmethod
+    def stop():
+        """
+        Flush the queue and stop the writer thread
+        """
+        if Log._listener is None:
+            return
+        Log._listener.stop()
+        Log._listener = None
@@ -0,0 +1,318 @@
+import contextvars
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import aiohttp
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+
+class StatementCounter:
+    """
+    sqlite3 trace callback counting the statements run on one connection
+
+    Each connection runs on its own worker thread, so the count is only ever written by one thread.
+    Transaction control is left out so the count matches the queries a method issues.
+    """
+    def __init__(self):
+        self.count = 0
+        # statements and seconds already charged to other spans by Metrics.charge, left out by the enclosing Metrics.sql
+        self.charged = 0
+        self.charged_seconds = 0.0
+
+    def __call__(self, statement: str):
+        if not statement.lstrip().upper().startswith(TRANSACTION_CONTROL):
+            self.count += 1
+
+
+class Span:
+    """The statements, SQL time and Discord API time accumulated by one command invocation"""
+    __slots__ = ('statements', 'sql_seconds', 'api_seconds', 'api_requests', 'started')
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.api_seconds = 0.0
+        self.api_requests = 0
+        self.started = time.perf_counter()
+
+
+class CommandStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.api_seconds = 0.0
+        self.api_requests = 0
+        self.latency_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, span: Span, latency: float, failed: bool):
+        self.calls += 1
+        self.errors += failed
+        self.statements += span.statements
+        self.sql_seconds += span.sql_seconds
+        self.api_seconds += span.api_seconds
+        self.api_requests += span.api_requests
+        self.latency_seconds += latency
+        self.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Estimate a latency quantile as the upper bound of the bucket it falls in
+
+        Parameters:
+            fraction (float): The quantile, e.g. 0.95
+
+        Returns:
+            float: The latency in seconds, inf if it falls in the unbounded bucket
+        """
+        rank = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """
+    Per-command statement counts, SQL time, Discord API time and latency histograms
+
+    The Study cog opens a span before each command and closes it afterwards. Database.read and
+    Database.write add the statements and time spent holding a connection to the current span,
+    and the aiohttp trace config adds the time spent in Discord HTTP requests. Work done outside
+    a command, such as scheduler ticks, is recorded under the name 'background'. Mutations run by
+    the group commit are charged to the commands that submitted them.
+    """
+    commands: Dict[str, CommandStats] = {}
+    _current: contextvars.ContextVar = contextvars.ContextVar('metrics_span', default=None)
+
+    @staticmethod
+    def begin() -> contextvars.Token:
+        return Metrics._current.set(Span())
+
+    @staticmethod
+    def end(token: contextvars.Token, command_name: str, failed: bool) -> float:
+        """
+        Close the span opened by begin and record it for a command
+
+        Parameters:
+            token (contextvars.Token): The token returned by begin
+            command_name (str): The qualified command name
+            failed (bool): Whether the command raised
+
+        Returns:
+            float: The latency of the command in seconds
+        """
+        span = Metrics._current.get()
+        try:
+            Metrics._current.reset(token)
+        except ValueError:
+            # closed from an event listener, which runs on a copy of the command's context
+            pass
+        if span is None:
+            return 0.0
+        latency = time.perf_counter() - span.started
+        Metrics.commands.setdefault(command_name, CommandStats()).add(span, latency, failed)
+        return latency
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        """
+        Get the span of the running command, None outside a command
+        """
+        return Metrics._current.get()
+
+    @staticmethod
+    def _background() -> CommandStats:
+        return Metrics.commands.setdefault('background', CommandStats())
+
+    @staticmethod
+    @contextmanager
+    def sql(counter: StatementCounter) -> Iterator[None]:
+        """
+        Attribute the statements and time spent holding a connection to the current span
+
+        Parameters:
+            counter (StatementCounter): The statement counter of the held connection
+        """
+        started = time.perf_counter()
+        before, charged, charged_seconds = counter.count, counter.charged, counter.charged_seconds
+        try:
+            yield
+        finally:
+            span = Metrics._current.get()
+            target = span if span is not None else Metrics._background()
+            target.statements += counter.count - before - (counter.charged - charged)
+            target.sql_seconds += time.perf_counter() - started - (counter.charged_seconds - charged_seconds)
+
+    @staticmethod
+    @contextmanager
+    def charge(spans: List[Optional[Span]], counter: StatementCounter) -> Iterator[None]:
+        """
+        Charge the statements and time of a block on a held connection to the commands it runs for
+
+        Used inside a transaction shared by several commands, such as a group commit. The cost is split
+        evenly between the spans, None standing for background work, and left out of the span holding
+        the connection.
+
+        Parameters:
+            spans (List[Optional[Span]]): The spans of the commands, as returned by current
+            counter (StatementCounter): The statement counter of the held connection
+        """
+        started = time.perf_counter()
+        before = counter.count
+        try:
+            yield
+        finally:
+            statements = counter.count - before
+            seconds = time.perf_counter() - started
+            counter.charged += statements
+            counter.charged_seconds += seconds
+            share, remainder = divmod(statements, len(spans))
+            for index, span in enumerate(spans):
+                target = span if span is not None else Metrics._background()
+                target.statements += share + (index < remainder)
+                target.sql_seconds += seconds / len(spans)
+
+    @staticmethod
+    def httpTrace() -> aiohttp.TraceConfig:
+        """
+        Build the trace config passed to discord.Client as http_trace
+
+        aiohttp runs the trace callbacks in the task making the request, so the command's span is current.
+
+        Returns:
+            aiohttp.TraceConfig: The trace config
+        """
+        async def on_request_start(session, context, params):
+            context.started = time.perf_counter()
+
+        async def on_request_done(session, context, params):
+            span = Metrics._current.get()
+            target = span if span is not None else Metrics._background()
+            target.api_seconds += time.perf_counter() - context.started
+            target.api_requests += 1
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_done)
+        trace.on_request_exception.append(on_request_done)
+        return trace
+
+    @staticmethod
+    def rows() -> List[List[str]]:
+        """
+        Summarise each command, busiest first
+
+        Returns:
+            List[List[str]]: Name, calls, errors, mean and p95 latency in ms, queries, SQL ms and API ms per call
+        """
+        rows = []
+        for name, stats in sorted(Metrics.commands.items(), key=lambda item: -item[1].sql_seconds - item[1].latency_seconds):
+            calls = stats.calls or 1
+            rows.append([
+                name,
+                str(stats.calls),
+                str(stats.errors),
+                f'{stats.latency_seconds / calls * 1000:.1f}' if stats.calls else '-',
+                f'{stats.quantile(0.95) * 1000:.0f}' if stats.calls else '-',
+                f'{stats.statements / calls:.1f}',
+                f'{stats.sql_seconds / calls * 1000:.1f}',
+                f'{stats.api_seconds / calls * 1000:.1f}',
+            ])
+        return rows
+
+    @staticmethod
+    def prometheus() -> str:
+        """
+        Render every counter in the Prometheus text exposition format
+
+        Returns:
+            str: The exposition text
+        """
+        lines = [
+            '# TYPE studyassist_command_calls_total counter',
+            '# TYPE studyassist_command_errors_total counter',
+            '# TYPE studyassist_command_statements_total counter',
+            '# TYPE studyassist_command_sql_seconds_total counter',
+            '# TYPE studyassist_command_api_seconds_total counter',
+            '# TYPE studyassist_command_api_requests_total counter',
+            '# TYPE studyassist_command_latency_seconds histogram',
+        ]
+        for name, stats in sorted(Metrics.commands.items()):
+            label = 'command="{}"'.format(name.replace('\\', '\\\\').replace('"', '\\"'))
+            lines.append(f'studyassist_command_calls_total{{{label}}} {stats.calls}')
+            lines.append(f'studyassist_command_errors_total{{{label}}} {stats.errors}')
+            lines.append(f'studyassist_command_statements_total{{{label}}} {stats.statements}')
+            lines.append(f'studyassist_command_sql_seconds_total{{{label}}} {stats.sql_seconds:.6f}')
+            lines.append(f'studyassist_command_api_seconds_total{{{label}}} {stats.api_seconds:.6f}')
+            lines.append(f'studyassist_command_api_requests_total{{{label}}} {stats.api_requests}')
+            if not stats.calls:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'studyassist_command_latency_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'studyassist_command_latency_seconds_bucket{{{label},le="+Inf"}} {stats.calls}')
+            lines.append(f'studyassist_command_latency_seconds_sum{{{label}}} {stats.latency_seconds:.6f}')
+            lines.append(f'studyassist_command_latency_seconds_count{{{label}}} {stats.calls}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def writePrometheus(path: str):
+        """
+        Write the exposition text to a file, replacing it atomically so scrapers never see a partial file
+
+        Parameters:
+            path (str): The file path, e.g. in node_exporter's textfile collector directory
+        """
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(Metrics.prometheus())
+        os.replace(temporary, path)
+
+    @staticmethod
+    def reset():
+        Metrics.commands = {}
+
+
+class StartupTimer:
+    """Wall-clock durations of the startup phases, logged as one breakdown once startup has finished"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self.phases.append((name, self._last - started))
+
+    def mark(self, name: str):
+        """
+        Record the time since the previous phase ended as a phase, e.g. waiting for the gateway
+
+        Parameters:
+            name (str): The phase name
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown(self) -> str:
+        return ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in self.phases)
@@ -0,0 +1,354 @@
+import logging
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Each entry upgrades the schema by one version; the applied version is kept in PRAGMA user_version.
+# Never edit a migration that has shipped, append a new one instead.
+MIGRATIONS = [
+    # 1: base tables, created with IF NOT EXISTS so databases from before versioning are adopted as-is
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS topics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'upcoming',
+            start_time TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            duration INTEGER NOT NULL DEFAULT 0,
+            author_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS topic_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic_name TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            joined_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            topic_name TEXT NOT NULL,
+            FOREIGN KEY (topic_name) REFERENCES topics(name)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS resources (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic_name INTEGER,
+            author_id INTEGER,
+            status TEXT,
+            url TEXT NOT NULL,
+            FOREIGN KEY (topic_name) REFERENCES topics(name),
+            FOREIGN KEY (author_id) REFERENCES topics(author_id),
+            FOREIGN KEY (status) REFERENCES topics(status)
+        )
+        ''',
+    ],
+    # 2: indexes for the lookups every command makes
+    [
+        'CREATE INDEX IF NOT EXISTS idx_topics_name_status ON topics(name, status)',
+        'CREATE INDEX IF NOT EXISTS idx_topics_status_start_time ON topics(status, start_time)',
+        'CREATE INDEX IF NOT EXISTS idx_topics_author_status ON topics(author_id, status)',
+        'CREATE INDEX IF NOT EXISTS idx_topic_members_topic_user ON topic_members(topic_name, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_topic ON reminders(topic_name)',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_user_topic ON reminders(user_id, topic_name)',
+        'CREATE INDEX IF NOT EXISTS idx_resources_topic_status ON resources(topic_name, status)',
+        'ANALYZE',
+    ],
+    # 3: let the database reject duplicate live topics, memberships and reminders
+    [
+        # keep only the newest live topic per name and per author
+        '''
+        UPDATE topics SET status='ended'
+        WHERE status IN ('active', 'upcoming')
+        AND id NOT IN (SELECT MAX(id) FROM topics WHERE status IN ('active', 'upcoming') GROUP BY name)
+        ''',
+        '''
+        UPDATE topics SET status='ended'
+        WHERE status IN ('active', 'upcoming')
+        AND id NOT IN (SELECT MAX(id) FROM topics WHERE status IN ('active', 'upcoming') GROUP BY author_id)
+        ''',
+        # memberships and reminders only make sense while their topic is live
+        '''
+        DELETE FROM topic_members
+        WHERE topic_name NOT IN (SELECT name FROM topics WHERE status IN ('active', 'upcoming'))
+        OR id NOT IN (SELECT MIN(id) FROM topic_members GROUP BY topic_name, user_id)
+        ''',
+        '''
+        DELETE FROM reminders
+        WHERE topic_name NOT IN (SELECT name FROM topics WHERE status IN ('active', 'upcoming'))
+        OR id NOT IN (SELECT MIN(id) FROM reminders GROUP BY user_id, topic_name)
+        ''',
+        'DROP INDEX IF EXISTS idx_topic_members_topic_user',
+        'DROP INDEX IF EXISTS idx_reminders_user_topic',
+        '''CREATE UNIQUE INDEX ux_topics_live_name ON topics(name) WHERE status IN ('active', 'upcoming')''',
+        '''CREATE UNIQUE INDEX ux_topics_live_author ON topics(author_id) WHERE status IN ('active', 'upcoming')''',
+        'CREATE UNIQUE INDEX ux_topic_members_topic_user ON topic_members(topic_name, user_id)',
+        'CREATE UNIQUE INDEX ux_reminders_user_topic ON reminders(user_id, topic_name)',
+    ],
+    # 4: replace the start_time text column with integer UTC epochs so due checks are plain comparisons
+    [
+        '''
+        CREATE TABLE topics_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'upcoming',
+            start_ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            duration INTEGER NOT NULL DEFAULT 0,
+            author_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            end_ts INTEGER
+        )
+        ''',
+        '''
+        INSERT INTO topics_new (id, name, status, start_ts, duration, author_id, guild_id, end_ts)
+        SELECT id, name, status, CAST(strftime('%s', start_time) AS INTEGER), duration, author_id, guild_id,
+            CASE WHEN duration > 0 THEN CAST(strftime('%s', start_time) AS INTEGER) + duration * 60 END
+        FROM topics
+        ''',
+        'DROP TABLE topics',
+        'ALTER TABLE topics_new RENAME TO topics',
+        'CREATE INDEX idx_topics_name_status ON topics(name, status)',
+        'CREATE INDEX idx_topics_author_status ON topics(author_id, status)',
+        'CREATE INDEX idx_topics_status_start_ts ON topics(status, start_ts)',
+        'CREATE INDEX idx_topics_status_end_ts ON topics(status, end_ts)',
+        '''CREATE UNIQUE INDEX ux_topics_live_name ON topics(name) WHERE status IN ('active', 'upcoming')''',
+        '''CREATE UNIQUE INDEX ux_topics_live_author ON topics(author_id) WHERE status IN ('active', 'upcoming')''',
+        'ANALYZE topics',
+    ],
+    # 5: keyset pagination of the live topic list and of member rosters
+    [
+        '''CREATE INDEX idx_topics_live_start ON topics(start_ts) WHERE status IN ('active', 'upcoming')''',
+        'CREATE INDEX idx_topic_members_topic ON topic_members(topic_name)',
+        'ANALYZE',
+    ],
+    # 6: partition every table by guild so topic names are only unique within a guild
+    [
+        'ALTER TABLE topic_members ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE reminders ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE resources ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0',
+        # until now names were global, so the newest topic with a name owns its rows
+        '''
+        UPDATE topic_members SET guild_id = COALESCE(
+            (SELECT guild_id FROM topics WHERE topics.name = topic_members.topic_name ORDER BY id DESC LIMIT 1), 0)
+        ''',
+        '''
+        UPDATE reminders SET guild_id = COALESCE(
+            (SELECT guild_id FROM topics WHERE topics.name = reminders.topic_name ORDER BY id DESC LIMIT 1), 0)
+        ''',
+        '''
+        UPDATE resources SET guild_id = COALESCE(
+            (SELECT guild_id FROM topics WHERE topics.name = resources.topic_name ORDER BY id DESC LIMIT 1), 0)
+        ''',
+        'DROP INDEX ux_topics_live_name',
+        'DROP INDEX ux_topics_live_author',
+        'DROP INDEX idx_topics_name_status',
+        'DROP INDEX idx_topics_author_status',
+        'DROP INDEX idx_topics_live_start',
+        'DROP INDEX ux_topic_members_topic_user',
+        'DROP INDEX idx_topic_members_topic',
+        'DROP INDEX ux_reminders_user_topic',
+        'DROP INDEX IF EXISTS idx_reminders_topic',
+        'DROP INDEX IF EXISTS idx_resources_topic_status',
+        '''CREATE UNIQUE INDEX ux_topics_live_name ON topics(guild_id, name) WHERE status IN ('active', 'upcoming')''',
+        '''CREATE UNIQUE INDEX ux_topics_live_author ON topics(guild_id, author_id) WHERE status IN ('active', 'upcoming')''',
+        'CREATE INDEX idx_topics_name_status ON topics(guild_id, name, status)',
+        'CREATE INDEX idx_topics_author_status ON topics(guild_id, author_id, status)',
+        '''CREATE INDEX idx_topics_live_start ON topics(guild_id, start_ts) WHERE status IN ('active', 'upcoming')''',
+        'CREATE UNIQUE INDEX ux_topic_members_topic_user ON topic_members(guild_id, topic_name, user_id)',
+        'CREATE INDEX idx_topic_members_topic ON topic_members(guild_id, topic_name)',
+        'CREATE UNIQUE INDEX ux_reminders_user_topic ON reminders(guild_id, user_id, topic_name)',
+        'CREATE INDEX idx_reminders_topic ON reminders(guild_id, topic_name)',
+        'CREATE INDEX idx_resources_topic_status ON resources(guild_id, topic_name, status)',
+        'ANALYZE',
+    ],
+    # 7: link previews for resources, shared by every resource with the same normalised URL
+    [
+        '''
+        CREATE TABLE resource_metadata (
+            url TEXT PRIMARY KEY,
+            title TEXT,
+            content_type TEXT,
+            size INTEGER,
+            status INTEGER,
+            error TEXT,
+            fetched_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+        ''',
+        # filled in by the enricher, which normalises URLs in Python
+        'ALTER TABLE resources ADD COLUMN url_key TEXT',
+    ],
+    # 8: trigram index over the names of live topics for typo-tolerant search, maintained by triggers
+    [
+        '''
+        CREATE VIRTUAL TABLE topics_fts USING fts5(
+            name, guild_id UNINDEXED, content='topics', content_rowid='id', tokenize='trigram'
+        )
+        ''',
+        '''
+        INSERT INTO topics_fts (rowid, name, guild_id)
+        SELECT id, name, guild_id FROM topics WHERE status IN ('active', 'upcoming')
+        ''',
+        '''
+        CREATE TRIGGER topics_fts_insert AFTER INSERT ON topics
+        WHEN new.status IN ('active', 'upcoming')
+        BEGIN
+            INSERT INTO topics_fts (rowid, name, guild_id) VALUES (new.id, new.name, new.guild_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER topics_fts_delete AFTER DELETE ON topics
+        WHEN old.status IN ('active', 'upcoming')
+        BEGIN
+            INSERT INTO topics_fts (topics_fts, rowid, name, guild_id) VALUES ('delete', old.id, old.name, old.guild_id);
+        END
+        ''',
+        # one trigger so the old entry is always deleted before the new one is added; leaving the
+        # live set removes a topic from the index and returning to it adds it back
+        '''
+        CREATE TRIGGER topics_fts_update AFTER UPDATE OF name, status, guild_id ON topics
+        WHEN new.name IS NOT old.name OR new.guild_id IS NOT old.guild_id
+        OR (old.status IN ('active', 'upcoming')) != (new.status IN ('active', 'upcoming'))
+        BEGIN
+            INSERT INTO topics_fts (topics_fts, rowid, name, guild_id)
+            SELECT 'delete', old.id, old.name, old.guild_id WHERE old.status IN ('active', 'upcoming');
+            INSERT INTO topics_fts (rowid, name, guild_id)
+            SELECT new.id, new.name, new.guild_id WHERE new.status IN ('active', 'upcoming');
+        END
+        ''',
+    ],
+    # 9: seconds each user spent in each session, keyed by topic id because names are reused across sessions
+    [
+        '''
+        CREATE TABLE attendances (
+            topic_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            last_seen INTEGER NOT NULL,
+            PRIMARY KEY (topic_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX attendances_guild_user ON attendances (guild_id, user_id)',
+    ],
+    # 10: archive tables for ended topics and their resources, so the hot tables only hold live sessions
+    [
+        '''
+        CREATE TABLE archived_topics (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            duration INTEGER NOT NULL DEFAULT 0,
+            author_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            end_ts INTEGER,
+            archived_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_archived_topics_name ON archived_topics(guild_id, name)',
+        '''
+        CREATE TABLE archived_resources (
+            id INTEGER PRIMARY KEY,
+            topic_name TEXT NOT NULL,
+            author_id INTEGER,
+            url TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            url_key TEXT,
+            archived_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_archived_resources_topic ON archived_resources(guild_id, topic_name)',
+        # expired link metadata is only purged once no resource refers to it
+        'CREATE INDEX idx_resources_url_key ON resources(url_key)',
+        # topics ended by their author kept their planned end; the start is the best known bound for those without one
+        '''UPDATE topics SET end_ts = start_ts WHERE status='ended' AND end_ts IS NULL''',
+        # resources kept the status of their topic at insert time, end the ones whose topic is no longer live
+        '''
+        UPDATE resources SET status='ended'
+        WHERE status IN ('active', 'upcoming') AND NOT EXISTS (
+            SELECT 1 FROM topics WHERE topics.guild_id = resources.guild_id AND topics.name = resources.topic_name
+            AND topics.status IN ('active', 'upcoming')
+        )
+        ''',
+    ],
+    # 11: leases so only one of the processes sharing the database runs the scheduler
+    [
+        '''
+        CREATE TABLE leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+    ],
+    # 12: outbox of direct messages, written in the transaction that decides to send them and delivered in the background
+    [
+        '''
+        CREATE TABLE outbox (
+            id INTEGER PRIMARY KEY,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            last_error TEXT
+        )
+        ''',
+        "CREATE INDEX idx_outbox_pending ON outbox (next_attempt_at) WHERE status = 'pending'",
+        'CREATE INDEX idx_outbox_status_created_at ON outbox (status, created_at)',
+    ],
+    # 13: recurring sessions, one row per series with only its next occurrence materialised into topics
+    [
+        '''
+        CREATE TABLE series (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            duration INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            next_ts INTEGER NOT NULL,
+            until_ts INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active'
+        )
+        ''',
+        "CREATE UNIQUE INDEX ux_series_live_name ON series(guild_id, name) WHERE status = 'active'",
+        "CREATE INDEX idx_series_due ON series(next_ts) WHERE status = 'active'",
+        'ALTER TABLE topics ADD COLUMN series_id INTEGER',
+        'CREATE INDEX idx_topics_series ON topics(series_id) WHERE series_id IS NOT NULL',
+    ],
+]
+
+
+class Migrations:
+    @staticmethod
+    async def getVersion() -> int:
+        async with Database.read() as db:
+            async with db.execute('PRAGMA user_version') as cursor:
+                return (await cursor.fetchone())[0]
+
+    @staticmethod
+    async def apply():
+        """
+        Bring the schema up to date, applying each pending migration in its own transaction
+        """
+        while True:
+            async with Database.write() as db:
+                # read inside the transaction, another process sharing the file may have migrated meanwhile
+                version = (await db.execute_fetchall('PRAGMA user_version'))[0][0]
+                if version >= len(MIGRATIONS):
+                    return
+                for statement in MIGRATIONS[version]:
+                    await db.execute(statement)
+                await db.execute(f'PRAGMA user_version = {version + 1}')
+            logger.info('Migrated database to version %s', version + 1)
@@ -0,0 +1,307 @@
+import sqlite3
+from enum import Enum
+from typing import List, NamedTuple, Optional, Tuple
+from database import Database
+from cache import SessionCache
+from utils import TimeCalculations
+from series import RULES, Series
+from writebehind import GroupCommit, JOIN, LEAVE
+
+
+class Outcome(Enum):
+    CREATED = 'created'
+    TOPIC_EXISTS = 'topic_exists'
+    AUTHOR_HAS_TOPIC = 'author_has_topic'
+    NOT_FOUND = 'not_found'
+    JOINED = 'joined'
+    ALREADY_JOINED = 'already_joined'
+    IS_AUTHOR = 'is_author'
+    LEFT = 'left'
+    NOT_MEMBER = 'not_member'
+    ENDED = 'ended'
+    NOT_AUTHOR = 'not_author'
+    REMINDER_SET = 'reminder_set'
+    REMINDER_EXISTS = 'reminder_exists'
+    ALREADY_STARTED = 'already_started'
+    SERIES_CREATED = 'series_created'
+    SERIES_EXISTS = 'series_exists'
+    SERIES_UPDATED = 'series_updated'
+    SERIES_CANCELLED = 'series_cancelled'
+
+
+class Result(NamedTuple):
+    outcome: Outcome
+    topic: Optional[Tuple] = None
+    members: Optional[List[Tuple]] = None
+    series: Optional[Tuple] = None
+
+
+class Operations:
+    """
+    One BEGIN IMMEDIATE transaction per study command
+
+    Uniqueness of live topics, memberships and reminders is enforced by the database, so
+    instead of checking and then acting each operation just attempts its write and maps
+    a constraint violation to an Outcome. Joins, leaves and reminders go through GroupCommit,
+    so many of them share one transaction and one fsync.
+    """
+
+    @staticmethod
+    async def _getLiveTopic(db, guild_id: int, topic_name: str) -> Optional[Tuple]:
+        async with db.execute('''
+            SELECT * FROM topics WHERE guild_id=? AND name=? AND (status='active' OR status='upcoming')
+        ''', (guild_id, topic_name)) as cursor:
+            return await cursor.fetchone()
+
+    @staticmethod
+    async def createTopic(guild_id: int, topic_name: str, author_id: int, start_time: int=None, duration: int=0) -> Result:
+        current_time = TimeCalculations.now()
+        start_time = start_time or current_time
+        status = 'active' if start_time <= current_time else 'upcoming'
+        end_time = start_time + duration * 60 if duration > 0 else None
+        async with Database.write() as db:
+            try:
+                async with db.execute('''
+                    INSERT INTO topics (name, status, start_ts, duration, author_id, guild_id, end_ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    RETURNING *
+                ''', (topic_name, status, start_time, duration, author_id, guild_id, end_time)) as cursor:
+                    topic = await cursor.fetchone()
+            except sqlite3.IntegrityError:
+                if await Operations._getLiveTopic(db, guild_id, topic_name):
+                    return Result(Outcome.TOPIC_EXISTS)
+                return Result(Outcome.AUTHOR_HAS_TOPIC)
+        SessionCache.putTopic(topic)
+        return Result(Outcome.CREATED, topic)
+
+    @staticmethod
+    async def joinTopic(guild_id: int, topic_name: str, user_id: int) -> Result:
+        return await GroupCommit.submit(
+            lambda db: Operations._joinTopic(db, guild_id, topic_name, user_id),
+            key=(guild_id, topic_name, user_id), kind=JOIN,
+        )
+
+    @staticmethod
+    async def _joinTopic(db, guild_id: int, topic_name: str, user_id: int):
+        topic = await Operations._getLiveTopic(db, guild_id, topic_name)
+        if not topic:
+            return Result(Outcome.NOT_FOUND), None
+        if topic[5] == user_id:
+            return Result(Outcome.IS_AUTHOR, topic), None
+        try:
+            async with db.execute('''
+                INSERT INTO topic_members (guild_id, topic_name, user_id)
+                VALUES (?, ?, ?)
+                RETURNING *
+            ''', (guild_id, topic_name, user_id)) as cursor:
+                member = await cursor.fetchone()
+        except sqlite3.IntegrityError:
+            return Result(Outcome.ALREADY_JOINED, topic), None
+        return Result(Outcome.JOINED, topic), lambda: SessionCache.addMember(member)
+
+    @staticmethod
+    async def leaveTopic(guild_id: int, topic_name: str, user_id: int) -> Result:
+        return await GroupCommit.submit(
+            lambda db: Operations._leaveTopic(db, guild_id, topic_name, user_id),
+            key=(guild_id, topic_name, user_id), kind=LEAVE,
+            cancel=lambda db: Operations._cancelJoinAndLeave(db, guild_id, topic_name, user_id),
+        )
+
+    @staticmethod
+    async def _leaveTopic(db, guild_id: int, topic_name: str, user_id: int):
+        topic = await Operations._getLiveTopic(db, guild_id, topic_name)
+        if not topic:
+            return Result(Outcome.NOT_FOUND), None
+        if topic[5] == user_id:
+            return Result(Outcome.IS_AUTHOR, topic), None
+        cursor = await db.execute('''
+            DELETE FROM topic_members WHERE guild_id=? AND topic_name=? AND user_id=?
+        ''', (guild_id, topic_name, user_id))
+        if not cursor.rowcount:
+            return Result(Outcome.NOT_MEMBER, topic), None
+        return Result(Outcome.LEFT, topic), lambda: SessionCache.removeMember(guild_id, topic_name, user_id)
+
+    @staticmethod
+    async def _cancelJoinAndLeave(db, guild_id: int, topic_name: str, user_id: int) -> Optional[Tuple[Result, Result]]:
+        """
+        Answer a join and the leave queued right after it in the same batch without writing, when the join would succeed
+
+        Returns:
+            Optional[Tuple[Result, Result]]: JOINED and LEFT, or None if the pair has to run as written
+        """
+        topic = await Operations._getLiveTopic(db, guild_id, topic_name)
+        if not topic or topic[5] == user_id:
+            return None
+        async with db.execute('''
+            SELECT 1 FROM topic_members WHERE guild_id=? AND topic_name=? AND user_id=?
+        ''', (guild_id, topic_name, user_id)) as cursor:
+            if await cursor.fetchone() is not None:
+                return None
+        return Result(Outcome.JOINED, topic), Result(Outcome.LEFT, topic)
+
+    @staticmethod
+    async def endTopic(guild_id: int, topic_name: str, author_id: int) -> Result:
+        """
+        End a topic, drop its memberships and reminders and end its resources in the same transaction
+
+        Returns:
+            Result: ENDED with the topic row as it was before ending and the removed members
+        """
+        async with Database.write() as db:
+            topic = await Operations._getLiveTopic(db, guild_id, topic_name)
+            if not topic:
+                return Result(Outcome.NOT_FOUND)
+            if topic[5] != author_id:
+                return Result(Outcome.NOT_AUTHOR, topic)
+            members = await Operations._endTopic(db, topic)
+        SessionCache.removeTopic(guild_id, topic_name)
+        return Result(Outcome.ENDED, topic, members)
+
+    @staticmethod
+    async def _endTopic(db, topic: Tuple) -> List[Tuple]:
+        await db.execute('''
+            UPDATE topics SET status='ended', end_ts=? WHERE id=?
+        ''', (TimeCalculations.now(), topic[0]))
+        async with db.execute('''
+            DELETE FROM topic_members WHERE guild_id=? AND topic_name=? RETURNING *
+        ''', (topic[6], topic[1])) as cursor:
+            members = sorted(await cursor.fetchall())
+        await db.execute('''
+            DELETE FROM reminders WHERE guild_id=? AND topic_name=?
+        ''', (topic[6], topic[1]))
+        await db.execute('''
+            UPDATE resources SET status='ended' WHERE guild_id=? AND topic_name=? AND status IN ('active', 'upcoming')
+        ''', (topic[6], topic[1]))
+        return members
+
+    @staticmethod
+    async def _getLiveSeries(db, guild_id: int, name: str) -> Optional[Tuple]:
+        async with db.execute('''
+            SELECT * FROM series WHERE guild_id=? AND name=? AND status='active'
+        ''', (guild_id, name)) as cursor:
+            return await cursor.fetchone()
+
+    @staticmethod
+    async def _getUpcomingOccurrence(db, series_id: int) -> Optional[Tuple]:
+        async with db.execute('''
+            SELECT * FROM topics WHERE series_id=? AND status='upcoming'
+        ''', (series_id,)) as cursor:
+            return await cursor.fetchone()
+
+    @staticmethod
+    async def createSeries(guild_id: int, name: str, author_id: int, rule: str, start_time: int, duration: int, until: int) -> Result:
+        """
+        Create a recurring session; its occurrences are materialised by Series.materializeDue
+
+        Returns:
+            Result: SERIES_CREATED with the series row, or SERIES_EXISTS
+        """
+        async with Database.write() as db:
+            try:
+                async with db.execute('''
+                    INSERT INTO series (name, rule, duration, author_id, guild_id, next_ts, until_ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    RETURNING *
+                ''', (name, rule, duration, author_id, guild_id, start_time, until)) as cursor:
+                    series = await cursor.fetchone()
+            except sqlite3.IntegrityError:
+                return Result(Outcome.SERIES_EXISTS)
+        Series.forgetNames(guild_id)
+        return Result(Outcome.SERIES_CREATED, series=series)
+
+    @staticmethod
+    async def editSeries(guild_id: int, name: str, author_id: int, rule: str=None, start_time: int=None, duration: int=None, until: int=None) -> Result:
+        """
+        Change the rule, next start, duration or end date of a series, including its occurrence that has not started yet
+
+        Parameters:
+            start_time (int): The new start of the next occurrence, later occurrences follow the rule from there
+
+        Returns:
+            Result: SERIES_UPDATED with the series row and the rescheduled occurrence, if any, or NOT_FOUND or NOT_AUTHOR
+        """
+        async with Database.write() as db:
+            series = await Operations._getLiveSeries(db, guild_id, name)
+            if not series:
+                return Result(Outcome.NOT_FOUND)
+            if series[4] != author_id:
+                return Result(Outcome.NOT_AUTHOR, series=series)
+            rule = rule or series[2]
+            duration = duration or series[3]
+            until = until or series[7]
+            occurrence = await Operations._getUpcomingOccurrence(db, series[0])
+            topic = ended = None
+            if occurrence is not None:
+                start = start_time or occurrence[3]
+                next_ts = start + RULES[rule]
+                if start > until:
+                    await Operations._endTopic(db, occurrence)
+                    ended = occurrence
+                else:
+                    async with db.execute('''
+                        UPDATE topics SET start_ts=?, duration=?, end_ts=? WHERE id=? RETURNING *
+                    ''', (start, duration, start + duration * 60, occurrence[0])) as cursor:
+                        topic = await cursor.fetchone()
+            else:
+                next_ts = start_time or series[6]
+            async with db.execute('''
+                UPDATE series SET rule=?, duration=?, next_ts=?, until_ts=?, status=? WHERE id=? RETURNING *
+            ''', (rule, duration, next_ts, until, 'active' if next_ts <= until else 'finished', series[0])) as cursor:
+                series = await cursor.fetchone()
+        if topic is not None:
+            SessionCache.putTopic(topic)
+        if ended is not None:
+            SessionCache.removeTopic(guild_id, ended[1])
+        Series.forgetNames(guild_id)
+        return Result(Outcome.SERIES_UPDATED, topic, series=series)
+
+    @staticmethod
+    async def cancelSeries(guild_id: int, name: str, author_id: int) -> Result:
+        """
+        Stop a series and call off its occurrence that has not started yet; one already running is left to finish
+
+        Returns:
+            Result: SERIES_CANCELLED with the series row and the called off occurrence, if any, or NOT_FOUND or NOT_AUTHOR
+        """
+        async with Database.write() as db:
+            series = await Operations._getLiveSeries(db, guild_id, name)
+            if not series:
+                return Result(Outcome.NOT_FOUND)
+            if series[4] != author_id:
+                return Result(Outcome.NOT_AUTHOR, series=series)
+            await db.execute("UPDATE series SET status='cancelled' WHERE id=?", (series[0],))
+            occurrence = await Operations._getUpcomingOccurrence(db, series[0])
+            if occurrence is not None:
+                await Operations._endTopic(db, occurrence)
+        if occurrence is not None:
+            SessionCache.removeTopic(guild_id, occurrence[1])
+        Series.forgetNames(guild_id)
+        return Result(Outcome.SERIES_CANCELLED, occurrence, series=series)
+
+    @staticmethod
+    async def setReminder(guild_id: int, topic_name: str, user_id: int) -> Result:
+        return await GroupCommit.submit(
+            lambda db: Operations._setReminder(db, guild_id, topic_name, user_id),
+            key=(guild_id, topic_name, user_id),
+        )
+
+    @staticmethod
+    async def _setReminder(db, guild_id: int, topic_name: str, user_id: int):
+        topic = await Operations._getLiveTopic(db, guild_id, topic_name)
+        if not topic:
+            return Result(Outcome.NOT_FOUND), None
+        if topic[5] != user_id:
+            async with db.execute('''
+                SELECT 1 FROM topic_members WHERE guild_id=? AND topic_name=? AND user_id=?
+            ''', (guild_id, topic_name, user_id)) as cursor:
+                if await cursor.fetchone() is None:
+                    return Result(Outcome.NOT_MEMBER, topic), None
+        if topic[2] == 'active':
+            return Result(Outcome.ALREADY_STARTED, topic), None
+        try:
+            await db.execute('''
+                INSERT INTO reminders (guild_id, user_id, topic_name) VALUES (?, ?, ?)
+            ''', (guild_id, user_id, topic_name))
+        except sqlite3.IntegrityError:
+            return Result(Outcome.REMINDER_EXISTS, topic), None
+        return Result(Outcome.REMINDER_SET, topic), lambda: SessionCache.addReminder(guild_id, user_id, topic_name)
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Iterable, List, Optional, Tuple
+import aiohttp
+import discord
+import config
+from database import Database
+from delivery import Delivery
+
+logger = logging.getLogger(__name__)
+
+SENT = 'sent'
+RETRY = 'retry'
+FAILED = 'failed'
+
+# (idempotency_key, guild_id, user_id, payload)
+Message = Tuple[str, int, int, str]
+
+
+class Outbox:
+    """
+    Durable queue of direct messages, delivered in the background
+
+    Reminders and notifications are inserted into the outbox table in the same transaction as
+    the change that causes them, so a topic is never marked started without its reminders being
+    recorded. The worker claims due rows in batches for config.outbox_claim_timeout seconds,
+    sends them and records the outcome, retrying transient failures with exponential backoff.
+    Rows claimed by a process that died become due again once the claim runs out, so delivery
+    resumes after a restart. Every row has an idempotency key naming the event and recipient,
+    so the same reminder or notification is never queued twice; delivery is at least once.
+    """
+
+    def __init__(self, bot: discord.Client):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # the batch in flight, shielded so stopping never leaves sent messages marked pending
+        self._delivering: Optional[asyncio.Future] = None
+
+    @staticmethod
+    def payload(content: str=None, embed: discord.Embed=None) -> str:
+        """
+        Serialise the arguments of discord.User.send for the outbox
+        """
+        return json.dumps({'content': content, 'embed': embed.to_dict() if embed is not None else None})
+
+    @staticmethod
+    async def enqueue(db, messages: Iterable[Message]) -> int:
+        """
+        Queue direct messages inside the caller's write transaction
+
+        Parameters:
+            db (aiosqlite.Connection): The writer, inside Database.write()
+            messages (Iterable[Message]): The idempotency key, guild ID, recipient and payload of each message
+
+        Returns:
+            int: The number of messages queued, leaving out keys that were already queued
+        """
+        now = time.time()
+        cursor = await db.executemany('''
+            INSERT INTO outbox (idempotency_key, guild_id, user_id, payload, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) DO NOTHING
+        ''', [(key, guild_id, user_id, payload, now, now) for key, guild_id, user_id, payload in messages])
+        return max(cursor.rowcount, 0)
+
+    @staticmethod
+    async def enqueueReminders(db, topics: List[Tuple[int, int, str]]) -> int:
+        """
+        Queue the start reminders of topics and drop the reminders, inside the caller's write transaction
+
+        Parameters:
+            db (aiosqlite.Connection): The writer, inside Database.write()
+            topics (List[Tuple[int, int, str]]): The ID, guild ID and name of each topic that just started
+
+        Returns:
+            int: The number of reminders queued
+        """
+        now = time.time()
+        cursor = await db.executemany('''
+            INSERT INTO outbox (idempotency_key, guild_id, user_id, payload, next_attempt_at, created_at)
+            SELECT 'reminder:' || topics.id || ':' || reminders.user_id, reminders.guild_id, reminders.user_id,
+                json_object('content', 'Reminder: The topic ' || topics.name || ' is starting now!', 'embed', NULL), ?, ?
+            FROM topics JOIN reminders ON reminders.guild_id = topics.guild_id AND reminders.topic_name = topics.name
+            WHERE topics.id = ?
+            ON CONFLICT (idempotency_key) DO NOTHING
+        ''', [(now, now, topic_id) for topic_id, _, _ in topics])
+        queued = max(cursor.rowcount, 0)
+        await db.executemany('DELETE FROM reminders WHERE guild_id=? AND topic_name=?', [(guild_id, name) for _, guild_id, name in topics])
+        return queued
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._delivering is not None:
+            await asyncio.gather(self._delivering, return_exceptions=True)
+            self._delivering = None
+
+    def wake(self):
+        """
+        Deliver newly queued messages now instead of at the next poll
+        """
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                self._delivering = asyncio.ensure_future(self.deliverDue())
+                count = await asyncio.shield(self._delivering)
+                self._delivering = None
+                if count >= config.outbox_batch_size:
+                    continue
+                delay = await self._untilNextDue()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.exception('Outbox delivery failed due to %s: %s', exc.__class__.__name__, exc)
+                delay = config.outbox_poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _untilNextDue(self) -> float:
+        shard_filter, shard_params = Database.shardFilter()
+        async with Database.read() as db:
+            async with db.execute(f"SELECT MIN(next_attempt_at) FROM outbox WHERE status='pending'{shard_filter}", shard_params) as cursor:
+                next_due = (await cursor.fetchone())[0]
+        # other processes sharing the database may queue messages too, so never sleep longer than a poll
+        if next_due is None:
+            return config.outbox_poll_interval
+        return min(max(next_due - time.time(), 0), config.outbox_poll_interval)
+
+    async def deliverDue(self) -> int:
+        """
+        Claim one batch of due messages on this process's shards, send them and record the outcomes
+
+        Returns:
+            int: The number of messages claimed
+        """
+        now = time.time()
+        shard_filter, shard_params = Database.shardFilter()
+        async with Database.write() as db:
+            async with db.execute(f'''
+                UPDATE outbox SET next_attempt_at=?
+                WHERE id IN (
+                    SELECT id FROM outbox WHERE status='pending' AND next_attempt_at <= ?{shard_filter}
+                    ORDER BY next_attempt_at LIMIT ?
+                )
+                RETURNING id, user_id, payload, attempts
+            ''', (now + config.outbox_claim_timeout, now, *shard_params, config.outbox_batch_size)) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            return 0
+        semaphore = asyncio.Semaphore(config.delivery_concurrency)
+        outcomes = await asyncio.gather(*(self._deliver(semaphore, user_id, payload) for _, user_id, payload, _ in rows))
+        now = time.time()
+        sent, retried, failed = [], [], []
+        for (outbox_id, _, _, attempts), (outcome, error) in zip(rows, outcomes):
+            if outcome == SENT:
+                sent.append((outbox_id,))
+            elif outcome == RETRY and attempts + 1 < config.outbox_max_attempts:
+                retried.append((now + Outbox.backoff(attempts), error, outbox_id))
+            else:
+                failed.append((error, outbox_id))
+        async with Database.write() as db:
+            await db.executemany("UPDATE outbox SET status='sent', attempts=attempts+1, last_error=NULL WHERE id=?", sent)
+            await db.executemany('UPDATE outbox SET attempts=attempts+1, next_attempt_at=?, last_error=? WHERE id=?', retried)
+            await db.executemany("UPDATE outbox SET status='failed', attempts=attempts+1, last_error=? WHERE id=?", failed)
+        logger.info('Delivered %s messages, %s to retry and %s failed', len(sent), len(retried), len(failed), extra={
+            'count': len(sent), 'failed': len(failed),
+        })
+        return len(rows)
+
+    @staticmethod
+    def backoff(attempts: int) -> float:
+        """
+        Seconds to wait before the next attempt, doubling per attempt with jitter so retries spread out
+        """
+        delay = min(config.outbox_retry_backoff * 2 ** attempts, config.outbox_retry_max_delay)
+        return delay * random.uniform(0.5, 1)
+
+    async def _deliver(self, semaphore: asyncio.Semaphore, user_id: int, payload: str) -> Tuple[str, Optional[str]]:
+        message = json.loads(payload)
+        kwargs = {'content': message.get('content')}
+        if message.get('embed') is not None:
+            kwargs['embed'] = discord.Embed.from_dict(message['embed'])
+        async with semaphore:
+            try:
+                user = await Delivery.resolveUser(self.bot, user_id)
+            except discord.NotFound as exc:
+                return FAILED, f'{exc.__class__.__name__}: {exc}'
+            if user is None:
+                return RETRY, 'user could not be fetched'
+            try:
+                await user.send(**kwargs)
+            except (discord.Forbidden, discord.NotFound) as exc:
+                # closed direct messages or a deleted account do not heal by retrying
+                return FAILED, f'{exc.__class__.__name__}: {exc}'
+            except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as exc:
+                return RETRY, f'{exc.__class__.__name__}: {exc}'
+        return SENT, None
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from typing import Dict, Hashable, Iterable, Tuple
+from discord.ext import commands
+
+
+class Throttled(commands.CheckFailure):
+    """A command that was turned away before running, already answered by the cog"""
+
+
+class RateLimited(Throttled):
+    def __init__(self, scope: str, retry_after: float, first: bool):
+        self.scope = scope
+        self.retry_after = retry_after
+        # only the first rejection is answered, so spam does not turn into replies
+        self.first = first
+        super().__init__(f'Rate limited per {scope}, retry in {retry_after:.1f}s')
+
+
+class Overloaded(Throttled):
+    def __init__(self):
+        super().__init__('Too many commands in flight')
+
+
+class RateLimiter:
+    """
+    In-memory token buckets, one per key, holding up to rate tokens and refilling rate tokens every per seconds
+
+    A bucket that has refilled completely carries no information, so buckets are dropped once
+    they have been idle for per seconds and memory follows the number of recent callers.
+    """
+
+    def __init__(self, rate: int, per: float):
+        self.capacity = float(rate)
+        self.per = per
+        self.refill = rate / per
+        # key -> (tokens, updated, whether the caller has been told it is limited)
+        self._buckets: Dict[Hashable, Tuple[float, float, bool]] = {}
+        self._pruned = time.monotonic()
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        tokens, updated, _ = self._buckets.get(key, (self.capacity, now, False))
+        return min(self.capacity, tokens + (now - updated) * self.refill)
+
+    def retryAfter(self, key: Hashable, now: float) -> float:
+        """
+        Seconds until the bucket of a key has a token, 0 if it has one now
+        """
+        tokens = self._tokens(key, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.refill
+
+    def take(self, key: Hashable, now: float):
+        self._buckets[key] = (self._tokens(key, now) - 1, now, False)
+        if now - self._pruned > self.per:
+            self._prune(now)
+
+    def warn(self, key: Hashable, now: float) -> bool:
+        """
+        Note that the caller of a key was turned away
+
+        Returns:
+            bool: Whether this is the first rejection since its last allowed command
+        """
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket[2]:
+            return False
+        self._buckets[key] = (self._tokens(key, now), now, True)
+        return True
+
+    def _prune(self, now: float):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < self.per}
+        self._pruned = now
+
+
+class CommandLimits:
+    """
+    Per-user, per-guild and per-command rate limits checked together
+
+    A command only spends a token when every bucket it draws from has one, so a rejected
+    command does not count against the limits that did allow it.
+    """
+
+    def __init__(self, user: Tuple[int, float], guild: Tuple[int, float], per_command: Dict[str, Tuple[int, float]]):
+        self.user = RateLimiter(*user)
+        self.guild = RateLimiter(*guild)
+        self.commands = {name: RateLimiter(*limit) for name, limit in per_command.items()}
+
+    def _buckets(self, ctx: commands.Context) -> Iterable[Tuple[str, RateLimiter, Hashable]]:
+        command = self.commands.get(ctx.command.qualified_name)
+        if command is not None:
+            yield 'command', command, ctx.author.id
+        yield 'user', self.user, ctx.author.id
+        if ctx.guild is not None:
+            yield 'guild', self.guild, ctx.guild.id
+
+    def check(self, ctx: commands.Context):
+        """
+        Spend a token from every bucket of the invocation
+
+        Raises:
+            RateLimited: If a bucket is empty, naming the one that frees up last
+        """
+        now = time.monotonic()
+        buckets = list(self._buckets(ctx))
+        waits = [(limiter.retryAfter(key, now), scope, limiter, key) for scope, limiter, key in buckets]
+        retry_after, scope, limiter, key = max(waits, key=lambda wait: wait[0])
+        if retry_after > 0:
+            raise RateLimited(scope, retry_after, limiter.warn(key, now))
+        for _, limiter, key in buckets:
+            limiter.take(key, now)
+
+
+class Admission:
+    """
+    Bound on the commands running at once, with a short waiting line in front of it
+
+    Commands beyond limit wait up to timeout seconds for a slot, and once queue of them are
+    waiting further commands are shed right away, so a burst cannot pile up unbounded work
+    behind the database and the Discord API.
+    """
+
+    def __init__(self, limit: int, queue: int, timeout: float):
+        self._slots = asyncio.Semaphore(limit)
+        self.queue = queue
+        self.timeout = timeout
+        self._waiting = 0
+
+    def mustWait(self) -> bool:
+        """
+        Whether acquire would queue for a slot rather than take one or shed right away
+        """
+        return self._slots.locked() and self._waiting < self.queue
+
+    async def acquire(self):
+        """
+        Raises:
+            Overloaded: If the waiting line is full or no slot freed up in time
+        """
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        if self._waiting >= self.queue:
+            raise Overloaded()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded() from None
+        finally:
+            self._waiting -= 1
+
+    def release(self):
+        self._slots.release()
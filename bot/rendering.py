@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import discord
+import config
+
+
+class EmbedCache:
+    """
+    LRU cache of rendered session embeds keyed by (guild_id, topic_name) and version
+
+    SessionCache bumps a topic's version whenever its status or members change, which
+    makes any embed rendered for an older version unreachable. Versions come from one
+    global counter so a recreated topic never reuses the version of an earlier one.
+    Cached embeds are shared, so callers must not mutate them.
+    """
+    hits: int = 0
+    misses: int = 0
+    _clock: int = 0
+    _versions: Dict[Tuple[int, str], int] = {}
+    _entries: 'OrderedDict[Tuple[Tuple[int, str], int], discord.Embed]' = OrderedDict()
+
+    @staticmethod
+    def version(topic_key: Tuple[int, str]) -> int:
+        return EmbedCache._versions.get(topic_key, 0)
+
+    @staticmethod
+    def bump(topic_key: Tuple[int, str]):
+        """
+        Invalidate every embed rendered for a topic
+
+        Parameters:
+            topic_key (Tuple[int, str]): The guild ID and topic name
+        """
+        EmbedCache._entries.pop((topic_key, EmbedCache.version(topic_key)), None)
+        EmbedCache._clock += 1
+        EmbedCache._versions[topic_key] = EmbedCache._clock
+
+    @staticmethod
+    def forget(topic_key: Tuple[int, str]):
+        """
+        Drop a topic that is no longer live
+
+        Parameters:
+            topic_key (Tuple[int, str]): The guild ID and topic name
+        """
+        EmbedCache._entries.pop((topic_key, EmbedCache.version(topic_key)), None)
+        EmbedCache._versions.pop(topic_key, None)
+
+    @staticmethod
+    def get(topic_key: Tuple[int, str]) -> Optional[discord.Embed]:
+        key = (topic_key, EmbedCache.version(topic_key))
+        embed = EmbedCache._entries.get(key)
+        if embed is None:
+            EmbedCache.misses += 1
+            return None
+        EmbedCache.hits += 1
+        EmbedCache._entries.move_to_end(key)
+        return embed
+
+    @staticmethod
+    def put(topic_key: Tuple[int, str], version: int, embed: discord.Embed):
+        """
+        Store an embed rendered from the state seen at version, unless the topic changed meanwhile
+
+        Parameters:
+            topic_key (Tuple[int, str]): The guild ID and topic name
+            version (int): The version read before rendering started
+            embed (discord.Embed): The rendered embed
+        """
+        if version == 0 or version != EmbedCache.version(topic_key):
+            return
+        EmbedCache._entries[(topic_key, version)] = embed
+        while len(EmbedCache._entries) > config.embed_cache_size:
+            EmbedCache._entries.popitem(last=False)
+
+    @staticmethod
+    def clear():
+        EmbedCache._entries.clear()
+        EmbedCache._versions.clear()
+        EmbedCache._clock = 0
+        EmbedCache.hits = 0
+        EmbedCache.misses = 0
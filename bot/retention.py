@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import logging
+import time
+from typing import Tuple
+import config
+from database import Database
+from utils import TimeCalculations
+
+logger = logging.getLogger(__name__)
+
+
+class Retention:
+    """
+    Moves ended sessions out of the hot tables and keeps the database file compact
+
+    Ended topics and their resources are copied to archived_topics and archived_resources
+    config.archive_after seconds after they end, one batch per transaction so commands never wait
+    long for the writer. Memberships and reminders without a live topic are purged, the query
+    planner statistics are refreshed with PRAGMA optimize and free pages are returned to the
+    filesystem by incremental vacuum.
+    """
+
+    @staticmethod
+    async def enableIncrementalVacuum():
+        """
+        Switch the database to incremental auto-vacuum
+
+        The mode only takes effect after a full VACUUM, which rewrites the whole file while holding
+        the writer, so this is an offline step run with the bot stopped:
+        python retention.py --enable-incremental-vacuum
+        """
+        async with Database.exclusive() as db:
+            # 2 is INCREMENTAL
+            if (await db.execute_fetchall('PRAGMA auto_vacuum'))[0][0] == 2:
+                return
+            started = time.perf_counter()
+            await db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            await db.execute('VACUUM')
+        logger.info('Enabled incremental vacuum', extra={'duration_ms': round((time.perf_counter() - started) * 1000, 2)})
+
+    @staticmethod
+    async def archiveEndedTopics() -> int:
+        """
+        Move the ended topics on this process's shards and their resources to the archive tables
+
+        Returns:
+            int: The number of archived topics
+        """
+        now = TimeCalculations.now()
+        shard_filter, shard_params = Database.shardFilter()
+        archived = 0
+        while True:
+            async with Database.write() as db:
+                async with db.execute(f'''
+                    SELECT id, guild_id, name FROM topics
+                    WHERE status='ended' AND end_ts <= ?{shard_filter}
+                    ORDER BY end_ts
+                    LIMIT ?
+                ''', (now - config.archive_after, *shard_params, config.archive_batch_size)) as cursor:
+                    topics = await cursor.fetchall()
+                if not topics:
+                    break
+                ids = [(topic[0],) for topic in topics]
+                names = sorted({(topic[1], topic[2]) for topic in topics})
+                await db.executemany('''
+                    INSERT INTO archived_topics (id, name, status, start_ts, duration, author_id, guild_id, end_ts, archived_at)
+                    SELECT id, name, status, start_ts, duration, author_id, guild_id, end_ts, ? FROM topics WHERE id=?
+                ''', [(now, topic_id) for (topic_id,) in ids])
+                await db.executemany('''
+                    INSERT INTO archived_resources (id, topic_name, author_id, url, guild_id, url_key, archived_at)
+                    SELECT id, topic_name, author_id, url, guild_id, url_key, ? FROM resources
+                    WHERE guild_id=? AND topic_name=? AND status='ended'
+                ''', [(now, guild_id, topic_name) for guild_id, topic_name in names])
+                await db.executemany('''DELETE FROM resources WHERE guild_id=? AND topic_name=? AND status='ended' ''', names)
+                await db.executemany('DELETE FROM topics WHERE id=?', ids)
+            archived += len(topics)
+            if len(topics) < config.archive_batch_size:
+                break
+        return archived
+
+    @staticmethod
+    async def purgeOrphans() -> Tuple[int, int, int]:
+        """
+        Delete memberships and reminders whose topic is no longer live, and expired link metadata no resource uses
+
+        Returns:
+            Tuple[int, int, int]: The number of deleted memberships, reminders and metadata rows
+        """
+        async with Database.write() as db:
+            members = await db.execute('''
+                DELETE FROM topic_members WHERE NOT EXISTS (
+                    SELECT 1 FROM topics WHERE topics.guild_id = topic_members.guild_id AND topics.name = topic_members.topic_name
+                    AND topics.status IN ('active', 'upcoming')
+                )
+            ''')
+            reminders = await db.execute('''
+                DELETE FROM reminders WHERE NOT EXISTS (
+                    SELECT 1 FROM topics WHERE topics.guild_id = reminders.guild_id AND topics.name = reminders.topic_name
+                    AND topics.status IN ('active', 'upcoming')
+                )
+            ''')
+            metadata = await db.execute('''
+                DELETE FROM resource_metadata WHERE expires_at <= ? AND NOT EXISTS (
+                    SELECT 1 FROM resources WHERE resources.url_key = resource_metadata.url
+                )
+            ''', (TimeCalculations.now(),))
+        return members.rowcount, reminders.rowcount, metadata.rowcount
+
+    @staticmethod
+    async def purgeOutbox() -> int:
+        """
+        Delete outbox messages sent or given up more than config.outbox_retention seconds ago
+
+        Returns:
+            int: The number of deleted messages
+        """
+        async with Database.write() as db:
+            cursor = await db.execute('''
+                DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at <= ?
+            ''', (time.time() - config.outbox_retention,))
+        return cursor.rowcount
+
+    @staticmethod
+    async def compact():
+        """
+        Refresh the planner statistics and return up to config.vacuum_pages free pages to the filesystem
+        """
+        async with Database.exclusive() as db:
+            # runs ANALYZE on the tables whose statistics are out of date
+            await db.execute_fetchall('PRAGMA optimize')
+            # 2 is INCREMENTAL, in any other mode the pragma does nothing
+            if config.incremental_vacuum and (await db.execute_fetchall('PRAGMA auto_vacuum'))[0][0] == 2:
+                # each step of the pragma frees one page, so it has to be read to the end
+                await db.execute_fetchall(f'PRAGMA incremental_vacuum({int(config.vacuum_pages)})')
+
+    @staticmethod
+    async def run():
+        """
+        Archive, purge and compact once
+        """
+        started = time.perf_counter()
+        archived = await Retention.archiveEndedTopics()
+        members, reminders, metadata = await Retention.purgeOrphans()
+        messages = await Retention.purgeOutbox()
+        await Retention.compact()
+        logger.info('Archived %s topics and purged %s memberships, %s reminders, %s link previews and %s delivered messages', archived, members, reminders, metadata, messages, extra={
+            'count': archived, 'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+        })
+
+
+async def main(args: argparse.Namespace):
+    await Database.connect(config.database_path, 1)
+    try:
+        if args.enable_incremental_vacuum:
+            await Retention.enableIncrementalVacuum()
+    finally:
+        await Database.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline database maintenance, run while the bot is stopped')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true', help='Rebuild the database once so free pages can be returned by the maintenance runs')
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import List, Optional, Set, Tuple
+import aiosqlite
+from discord.ext import commands
+import config
+from lease import Lease
+from series import Series
+from utils import Check, Topic
+
+logger = logging.getLogger(__name__)
+
+START = 'start'
+END = 'end'
+MATERIALIZE = 'materialize'
+
+
+class SessionScheduler:
+    """
+    Min-heap of upcoming session starts and ends that sleeps until the next one is due
+
+    The heap is loaded from the database once and then kept up to date by the study commands,
+    so no database work happens between transitions. Only topics of guilds on the shards this
+    process owns are loaded, and the due checks are restricted to the same shards. Recurring
+    series add a single deadline, for the earliest occurrence that has to be materialised.
+
+    With config.shared_database several processes may run it; only the holder of the scheduler
+    lease for these shards acts. The holder renews the lease every third of its ttl and runs the
+    due checks on each renewal as well, which picks up topics created by the other processes.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._deadlines: List[Tuple[float, str, int, str]] = []
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.lease = Lease(SessionScheduler.leaseName(), config.scheduler_lease_ttl)
+        self._renew_at = 0.0
+
+    @staticmethod
+    def leaseName() -> str:
+        if config.sharded and config.shard_ids:
+            return 'scheduler:' + ','.join(str(shard_id) for shard_id in sorted(config.shard_ids))
+        return 'scheduler'
+
+    async def start(self):
+        """
+        Load the pending deadlines and start waiting for them
+        """
+        if self._task is not None:
+            return
+        await self._load()
+        self._task = asyncio.create_task(self._run())
+
+    async def _load(self):
+        self._deadlines = []
+        for topic in await Topic.getUpcomingTopics() + await Topic.getActiveTopics():
+            self.scheduleTopic(topic)
+        await self._scheduleNextSeries()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.lease.release()
+        except Exception as exc:
+            # the lease then simply expires
+            logger.warning('Could not release the scheduler lease due to %s: %s', exc.__class__.__name__, exc)
+
+    def scheduleTopic(self, topic: aiosqlite.Row):
+        """
+        Add the start and end deadlines of a topic
+
+        Parameters:
+            topic (aiosqlite.Row): The topic row
+        """
+        if topic[2] == 'upcoming':
+            self._push(topic[3], START, topic[6], topic[1])
+        if topic[7] is not None:
+            self._push(topic[7], END, topic[6], topic[1])
+
+    def scheduleSeries(self, series: aiosqlite.Row):
+        """
+        Add the deadline for materialising the next occurrence of a series
+
+        Parameters:
+            series (aiosqlite.Row): The series row
+        """
+        if series[8] == 'active':
+            self._push(series[6] - config.series_lookahead, MATERIALIZE, series[5], series[1])
+
+    async def _scheduleNextSeries(self):
+        due = await Series.nextDue()
+        if due is not None:
+            # an occurrence waiting for a clashing topic to end is retried, not spun on
+            self._push(max(due, time.time() + config.series_retry_interval), MATERIALIZE, 0, '')
+
+    def cancelTopic(self, guild_id: int, topic_name: str):
+        """
+        Drop the pending start and end deadlines of a topic, e.g. when its author ends it early
+
+        Materialise deadlines carry the name of their series, which its occurrences share, so they are kept.
+
+        Parameters:
+            guild_id (int): The guild ID
+            topic_name (str): The topic name
+        """
+        deadlines = [deadline for deadline in self._deadlines if not (deadline[1] in (START, END) and deadline[2:] == (guild_id, topic_name))]
+        if len(deadlines) != len(self._deadlines):
+            heapq.heapify(deadlines)
+            self._deadlines = deadlines
+            self._changed.set()
+
+    def _push(self, due: float, kind: str, guild_id: int, topic_name: str):
+        heapq.heappush(self._deadlines, (due, kind, guild_id, topic_name))
+        # only an earlier head changes how long the loop has to sleep
+        if self._deadlines[0][0] == due:
+            self._changed.set()
+
+    async def _renewLease(self):
+        held = self.lease.held
+        try:
+            await self.lease.acquire()
+        except Exception as exc:
+            # without the database the lease cannot be proven, let it lapse so another process takes over
+            logger.exception('Could not renew the scheduler lease due to %s: %s', exc.__class__.__name__, exc)
+            self.lease.held = False
+        self._renew_at = time.time() + config.scheduler_lease_ttl / 3
+        if self.lease.held and not held:
+            # the deadlines seen while another process was in charge may be stale
+            await self._load()
+
+    async def _tick(self, due: Set[str]):
+        try:
+            if MATERIALIZE in due:
+                for topic in await Series.materializeDue():
+                    self.scheduleTopic(topic)
+                self._deadlines = [deadline for deadline in self._deadlines if deadline[1] != MATERIALIZE]
+                heapq.heapify(self._deadlines)
+                await self._scheduleNextSeries()
+            if START in due:
+                await Check.checkStartTimes(self.bot)
+            if END in due:
+                await Check.checkEndTimes(self.bot)
+        except Exception as exc:
+            logger.exception('Scheduler tick failed due to %s: %s', exc.__class__.__name__, exc)
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            wake = self._deadlines[0][0] if self._deadlines else None
+            if config.shared_database:
+                if time.time() >= self._renew_at:
+                    await self._renewLease()
+                    if self.lease.held:
+                        await self._tick({START, END, MATERIALIZE})
+                wake = self._renew_at if wake is None else min(wake, self._renew_at)
+            if wake is None:
+                await self._changed.wait()
+                continue
+            delay = wake - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = time.time()
+            due = set()
+            while self._deadlines and self._deadlines[0][0] <= now:
+                due.add(heapq.heappop(self._deadlines)[1])
+            if due and (self.lease.held or not config.shared_database):
+                await self._tick(due)
@@ -0,0 +1,209 @@
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+import config
+from database import Database
+
+# a query of a few words has a few dozen trigrams, longer input only adds noise to the ranking
+MAX_QUERY_TRIGRAMS = 64
+# Discord shows at most 25 autocomplete choices
+MAX_COMPLETIONS = 25
+
+
+class Match(NamedTuple):
+    topic: Tuple
+    # how alike the query and the name are as a whole
+    similarity: float
+    # how much of the query appears in the name, so short queries still find long names
+    coverage: float
+
+
+class TrieNode:
+    __slots__ = ('children', 'names')
+
+    def __init__(self):
+        self.children: Dict[str, 'TrieNode'] = {}
+        # names with a word that ends the key spelled by the path to this node
+        self.names: Set[str] = set()
+
+
+class PrefixIndex:
+    """
+    Per-guild prefix trie of live topic names for slash-command autocomplete
+
+    Every name is inserted once from the start of each of its words, lowercased, so typing the
+    beginning of any word finds it. SessionCache adds and removes names as topics are created,
+    started and ended, so completing a keystroke is a walk down the trie and never touches SQLite.
+    """
+    _guilds: Dict[int, TrieNode] = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.lower().split())
+
+    @staticmethod
+    def keys(name: str) -> List[str]:
+        normalized = PrefixIndex.normalize(name)
+        return [normalized[i:] for i in range(len(normalized)) if i == 0 or normalized[i - 1] == ' ']
+
+    @staticmethod
+    def add(guild_id: int, name: str):
+        root = PrefixIndex._guilds.setdefault(guild_id, TrieNode())
+        for key in PrefixIndex.keys(name):
+            node = root
+            for char in key:
+                node = node.children.setdefault(char, TrieNode())
+            node.names.add(name)
+
+    @staticmethod
+    def remove(guild_id: int, name: str):
+        root = PrefixIndex._guilds.get(guild_id)
+        if root is None:
+            return
+        for key in PrefixIndex.keys(name):
+            path = [root]
+            for char in key:
+                node = path[-1].children.get(char)
+                if node is None:
+                    break
+                path.append(node)
+            else:
+                path[-1].names.discard(name)
+                # prune the branch back up to the first node still in use
+                for depth in range(len(key), 0, -1):
+                    node = path[depth]
+                    if node.names or node.children:
+                        break
+                    del path[depth - 1].children[key[depth - 1]]
+        if not root.children:
+            del PrefixIndex._guilds[guild_id]
+
+    @staticmethod
+    def complete(guild_id: int, prefix: str, limit: int=MAX_COMPLETIONS) -> List[str]:
+        """
+        Find live topic names with a word starting with a prefix
+
+        Parameters:
+            guild_id (int): The guild ID
+            prefix (str): What the user has typed so far
+            limit (int): The maximum number of names
+
+        Returns:
+            List[str]: Names starting with the prefix first, then names with a later word starting with it, alphabetically
+        """
+        prefix = PrefixIndex.normalize(prefix)
+        node = PrefixIndex._guilds.get(guild_id)
+        for char in prefix:
+            if node is None:
+                return []
+            node = node.children.get(char)
+        if node is None:
+            return []
+        found: Dict[str, None] = {}
+        # depth first in character order, stopping as soon as enough names are found
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            for name in sorted(node.names):
+                found.setdefault(name)
+            stack.extend(node.children[char] for char in sorted(node.children, reverse=True))
+        names = sorted(found, key=lambda name: (not PrefixIndex.normalize(name).startswith(prefix), name.lower()))
+        return names[:limit]
+
+    @staticmethod
+    def clear():
+        PrefixIndex._guilds = {}
+
+
+class TopicSearch:
+    """
+    Typo-tolerant lookup of live topics through the topics_fts trigram index
+
+    The index only holds active and upcoming topics, kept in sync by triggers on topics, so its
+    size does not grow with the history. A query matches every topic sharing any of its trigrams;
+    the best candidates by bm25 are then ranked by trigram similarity to the query.
+    """
+
+    @staticmethod
+    def trigrams(text: str) -> Set[str]:
+        text = ' '.join(text.lower().split())
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    @staticmethod
+    def compare(query: str, topic: Tuple) -> Match:
+        """
+        Score a topic name against a query by their trigrams
+
+        Parameters:
+            query (str): The text the user typed
+            topic (Tuple): The topic row
+
+        Returns:
+            Match: The Jaccard similarity of both trigram sets and the share of the query's trigrams found in the name
+        """
+        query_trigrams, name_trigrams = TopicSearch.trigrams(query), TopicSearch.trigrams(topic[1])
+        if not query_trigrams or not name_trigrams:
+            score = 1.0 if query.lower().strip() == topic[1].lower().strip() else 0.0
+            return Match(tuple(topic), score, score)
+        shared = len(query_trigrams & name_trigrams)
+        return Match(tuple(topic), shared / len(query_trigrams | name_trigrams), shared / len(query_trigrams))
+
+    @staticmethod
+    def matchExpression(query: str) -> Optional[str]:
+        trigrams = sorted(TopicSearch.trigrams(query))[:MAX_QUERY_TRIGRAMS]
+        if not trigrams:
+            return None
+        return ' OR '.join('"{}"'.format(trigram.replace('"', '""')) for trigram in trigrams)
+
+    @staticmethod
+    async def search(guild_id: int, query: str, limit: int=10) -> List[Match]:
+        """
+        Find the live topics of a guild whose names resemble a query
+
+        Parameters:
+            guild_id (int): The guild ID
+            query (str): The text to look for
+            limit (int): The maximum number of matches
+
+        Returns:
+            List[Match]: The matches covering at least config.search_min_coverage of the query, most similar first
+        """
+        expression = TopicSearch.matchExpression(query)
+        async with Database.read() as db:
+            if expression is None:
+                # too short for trigrams, fall back to a prefix match over the guild's live topics
+                async with db.execute('''
+                    SELECT * FROM topics
+                    WHERE guild_id=? AND status IN ('active', 'upcoming') AND name LIKE ? ESCAPE '\\'
+                    ORDER BY start_ts, id
+                    LIMIT ?
+                ''', (guild_id, query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%', limit)) as cursor:
+                    return [Match(tuple(topic), 0.0, 1.0) for topic in await cursor.fetchall()]
+            # bm25 picks the candidates in the index, the exact ranking is done on a few of them
+            async with db.execute('''
+                SELECT topics.* FROM topics_fts
+                JOIN topics ON topics.id = topics_fts.rowid
+                WHERE topics_fts MATCH ? AND topics_fts.guild_id = ?
+                ORDER BY bm25(topics_fts)
+                LIMIT ?
+            ''', (expression, guild_id, limit * 4)) as cursor:
+                candidates = await cursor.fetchall()
+        matches = [TopicSearch.compare(query, topic) for topic in candidates]
+        matches = [match for match in matches if match.coverage >= config.search_min_coverage]
+        matches.sort(key=lambda match: (-match.similarity, -match.coverage))
+        return matches[:limit]
+
+    @staticmethod
+    def bestMatch(matches: List[Match]) -> Optional[Tuple]:
+        """
+        Pick the topic a mistyped name most likely meant, if one stands out
+
+        Parameters:
+            matches (List[Match]): The matches returned by search
+
+        Returns:
+            Optional[Tuple]: The topic row, or None when no match is close enough or several are equally close
+        """
+        if not matches or matches[0].similarity < config.search_autocorrect_similarity:
+            return None
+        if len(matches) > 1 and matches[1].similarity >= matches[0].similarity:
+            return None
+        return matches[0].topic
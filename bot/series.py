@@ -0,0 +1,153 @@
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import aiosqlite
+import config
+from database import Database
+from cache import SessionCache
+from utils import TimeCalculations
+
+logger = logging.getLogger(__name__)
+
+# seconds between occurrences; timestamps are UTC, so a series keeps its UTC time across daylight saving changes
+RULES = {'daily': 86400, 'weekly': 7 * 86400}
+
+
+class Series:
+    """
+    Recurring study sessions stored as one row per series
+
+    Only the next occurrence of a series is inserted into topics, config.series_lookahead seconds
+    before it starts, so the topics table and the scheduler's heap grow with the number of
+    occurrences about to happen rather than with the number of series. Series rows are
+    (id, name, rule, duration, author_id, guild_id, next_ts, until_ts, status), and every
+    occurrence carries the series id in topics.series_id.
+    """
+    # guild_id -> (when it was loaded, names of the guild's active series), for autocomplete
+    _names: Dict[int, Tuple[float, List[str]]] = {}
+
+    @staticmethod
+    def parseUntil(text: str) -> int:
+        """
+        Parse an end date given as YYYY-MM-DD
+
+        Parameters:
+            text (str): The date
+
+        Returns:
+            int: The epoch timestamp of the end of that day in UTC
+
+        Raises:
+            ValueError: If the date is not valid
+        """
+        day = datetime.strptime(text, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        return int((day + timedelta(days=1)).timestamp()) - 1
+
+    @staticmethod
+    async def getSeries(guild_id: int) -> List[aiosqlite.Row]:
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT * FROM series WHERE guild_id=? AND status='active' ORDER BY next_ts
+            ''', (guild_id,)) as cursor:
+                return await cursor.fetchall()
+
+    @staticmethod
+    async def getSeriesNames(guild_id: int) -> List[str]:
+        """
+        Get the names of the active series of a guild, reloaded at most every config.series_names_ttl seconds
+
+        Parameters:
+            guild_id (int): The guild ID
+
+        Returns:
+            List[str]: The names, alphabetically
+        """
+        now = time.monotonic()
+        cached = Series._names.get(guild_id)
+        if cached is not None and now - cached[0] < config.series_names_ttl:
+            return cached[1]
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT name FROM series WHERE guild_id=? AND status='active' ORDER BY name
+            ''', (guild_id,)) as cursor:
+                names = [row[0] for row in await cursor.fetchall()]
+        Series._names[guild_id] = (now, names)
+        return names
+
+    @staticmethod
+    def forgetNames(guild_id: int):
+        """
+        Drop the cached series names of a guild after one of its series was created, edited or cancelled
+        """
+        Series._names.pop(guild_id, None)
+
+    @staticmethod
+    async def nextDue() -> Optional[int]:
+        """
+        Get when the next occurrence of any series on this process's shards has to be materialised
+
+        Returns:
+            Optional[int]: The epoch timestamp, or None if there are no active series
+        """
+        shard_filter, shard_params = Database.shardFilter()
+        async with Database.read() as db:
+            async with db.execute(f'''
+                SELECT MIN(next_ts) FROM series WHERE status='active'{shard_filter}
+            ''', shard_params) as cursor:
+                next_ts = (await cursor.fetchone())[0]
+        return next_ts - config.series_lookahead if next_ts is not None else None
+
+    @staticmethod
+    async def materializeDue() -> List[aiosqlite.Row]:
+        """
+        Insert the next occurrence of every series on this process's shards that starts within config.series_lookahead seconds
+
+        Each series runs in its own savepoint, so one whose occurrence cannot be created does not hold
+        back the others. An occurrence that clashes with a live topic of the same name or author is
+        retried on the next run until its start time, and skipped after that. Occurrences missed
+        while the bot was down are skipped.
+
+        Returns:
+            List[aiosqlite.Row]: The created topics
+        """
+        now = TimeCalculations.now()
+        shard_filter, shard_params = Database.shardFilter()
+        topics = []
+        async with Database.write() as db:
+            async with db.execute(f'''
+                SELECT * FROM series WHERE status='active' AND next_ts <= ?{shard_filter} ORDER BY next_ts LIMIT ?
+            ''', (now + config.series_lookahead, *shard_params, config.series_batch_size)) as cursor:
+                due = await cursor.fetchall()
+            for series_id, name, rule, duration, author_id, guild_id, next_ts, until_ts, _ in due:
+                interval = RULES[rule]
+                while next_ts + duration * 60 <= now:
+                    next_ts += interval
+                topic = None
+                if next_ts <= until_ts:
+                    await db.execute('SAVEPOINT occurrence')
+                    try:
+                        async with db.execute('''
+                            INSERT INTO topics (name, status, start_ts, duration, author_id, guild_id, end_ts, series_id)
+                            VALUES (?, 'upcoming', ?, ?, ?, ?, ?, ?)
+                            RETURNING *
+                        ''', (name, next_ts, duration, author_id, guild_id, next_ts + duration * 60, series_id)) as cursor:
+                            topic = await cursor.fetchone()
+                    except sqlite3.IntegrityError:
+                        await db.execute('ROLLBACK TO occurrence')
+                        logger.info('Occurrence of series %s clashes with a live topic', series_id, extra={'guild': guild_id, 'topic': name})
+                    await db.execute('RELEASE occurrence')
+                if topic is not None:
+                    topics.append(topic)
+                    next_ts += interval
+                elif next_ts <= now:
+                    next_ts += interval
+                elif next_ts <= until_ts:
+                    # not started yet, try again on the next run
+                    continue
+                status = 'active' if next_ts <= until_ts else 'finished'
+                await db.execute('UPDATE series SET next_ts=?, status=? WHERE id=?', (next_ts, status, series_id))
+        for topic in topics:
+            SessionCache.putTopic(topic)
+        return topics
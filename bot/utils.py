@@ -2,57 +2,78 @@ import discord
 from discord.ext import commands
 from discord.app_commands import Group
 import aiosqlite
-from datetime import datetime, timedelta
-from typing import List
-import pytz
+import logging
+import time
+from typing import List, Optional, Tuple
 import config
+from database import Database
+from cache import SessionCache
+from rendering import EmbedCache
+from outbox import Outbox
+from enrichment import ResourceEnricher
+
+logger = logging.getLogger(__name__)
 
 class Resource:
     @staticmethod
-    async def createTableIfNotExists():
-        async with aiosqlite.connect('study.db') as db:
-                # foreign key to the topics table's status column
-            await db.execute('''CREATE TABLE IF NOT EXISTS resources (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                topic_name INTEGER,
-                author_id INTEGER,
-                status TEXT,
-                url TEXT NOT NULL,
-                FOREIGN KEY (topic_name) REFERENCES topics(name),
-                FOREIGN KEY (author_id) REFERENCES topics(author_id),
-                FOREIGN KEY (status) REFERENCES topics(status)
-            );''')
-            await db.commit()
-    
-    @staticmethod
-    async def addResource(topic_name: str, author_id: int, status: str, url: str):
-        await Resource.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''INSERT INTO resources (topic_name, author_id, status, url) VALUES (?, ?, ?, ?);''', (topic_name, author_id, status, url))
-            await db.commit()
-    
-    @staticmethod
-    async def getResources(topic_name: str):
-        await Resource.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
-            async with db.execute('''SELECT * FROM resources WHERE topic_name=? AND (status='active' OR status='upcoming');''', (topic_name,)) as cursor:
+    async def addResource(guild_id: int, topic_name: str, author_id: int, status: str, url: str) -> str:
+        """
+        Add a resource to a topic
+        
+        Parameters:
+            guild_id (int): The guild ID
+            topic_name (str): The topic name
+            author_id (int): The ID of the user adding it
+            status (str): The status of the topic
+            url (str): The URL as submitted
+            
+        Returns:
+            str: The normalised URL to enrich
+        """
+        url_key = ResourceEnricher.normalizeUrl(url)
+        async with Database.write() as db:
+            await db.execute('''INSERT INTO resources (guild_id, topic_name, author_id, status, url, url_key) VALUES (?, ?, ?, ?, ?, ?);''', (guild_id, topic_name, author_id, status, url, url_key))
+        return url_key
+    
+    @staticmethod
+    async def getResources(guild_id: int, topic_name: str):
+        async with Database.read() as db:
+            async with db.execute('''SELECT * FROM resources WHERE guild_id=? AND topic_name=? AND (status='active' OR status='upcoming');''', (guild_id, topic_name)) as cursor:
                 return await cursor.fetchall()
     
-
-class TimeCalculations:
     @staticmethod
-    def timeDifference(start_time: datetime, current_time: datetime) -> int:
+    async def getResourcesWithMetadata(guild_id: int, topic_name: str):
         """
-        Calculate the difference between two datetime objects
+        Get a topic's resources with whatever link metadata has been fetched so far
         
         Parameters:
-            start_time (datetime): The start time
-            current_time (datetime): The current time
+            guild_id (int): The guild ID
+            topic_name (str): The topic name
             
         Returns:
-            int: The difference in seconds
+            List[aiosqlite.Row]: (url, title, content_type, size) per resource in the order they were added
         """
-        return int((current_time - start_time).total_seconds())
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT resources.url, resource_metadata.title, resource_metadata.content_type, resource_metadata.size
+                FROM resources
+                LEFT JOIN resource_metadata ON resource_metadata.url = resources.url_key
+                WHERE resources.guild_id=? AND resources.topic_name=? AND resources.status IN ('active', 'upcoming')
+                ORDER BY resources.id
+            ''', (guild_id, topic_name)) as cursor:
+                return await cursor.fetchall()
+    
+
+class TimeCalculations:
+    @staticmethod
+    def now() -> int:
+        """
+        Get the current UTC time as an epoch timestamp
+        
+        Returns:
+            int: The timestamp in seconds
+        """
+        return int(time.time())
 
     @staticmethod
     def minutesToText(minutes: int) -> str:
@@ -70,230 +91,170 @@ class TimeCalculations:
         return f'{hours} hours {minutes} minutes' if hours > 0 else f'{minutes} minutes'
     
     @staticmethod
-    def minutesToDateTime(minutes: int) -> datetime:
+    def minutesToTimestamp(minutes: int) -> int:
         """
-        Convert minutes to datetime
+        Get the epoch timestamp a number of minutes from now
         
         Parameters:
             minutes (int): The number of minutes
             
         Returns:
-            datetime: The datetime object
+            int: The timestamp in seconds
         """
-        return discord.utils.utcnow() + timedelta(minutes=minutes)
+        return TimeCalculations.now() + minutes * 60
     
     @staticmethod
-    def remainingTime(start_time: str, current_time: str) -> int:
+    def bytesToText(size: int) -> str:
         """
-        Calculate the remaining time between the start time and the current time
+        Convert a size in bytes to a short human readable text
         
         Parameters:
-            start_time (str): The start time
-            current_time (str): The current time
+            size (int): The size in bytes
             
         Returns:
-            int: The remaining time in minutes
+            str: The size, e.g. 1.5 MB
         """
-        start_time = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-        current_time = datetime.strptime(current_time, '%Y-%m-%d %H:%M:%S')
-        return int((start_time - current_time).total_seconds() // 60)
-    
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if size < 1024 or unit == 'GB':
+                return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+            size /= 1024
+
     @staticmethod
-    async def datetimeToSeconds(datetime_str: str) -> int:
+    def formatTimestamp(timestamp: int, style: str) -> str:
         """
-        Convert a datetime string to seconds
+        Format a timestamp as Discord markdown, like discord.utils.format_dt but without building a datetime
         
         Parameters:
-            datetime_str (str): The datetime string
+            timestamp (int): The timestamp
+            style (str): The Discord timestamp style, e.g. 'R' or 'f'
             
         Returns:
-            int: The seconds
+            str: The formatted timestamp
         """
-        return int((datetime.strptime(datetime_str, '%Y-%m-%d %H:%M:%S') - datetime.strptime(discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S'), '%Y-%m-%d %H:%M:%S')).total_seconds())
+        return f'<t:{timestamp}:{style}>'
 
 class Topic:
-    def __init__(self, name, author_id, guild_id):
-        self.name = name
-        self.author_id = author_id
-        self.guild_id = guild_id
-
-    async def insertTopicToDatabase(self, start_time: datetime=None, duration: int=0):
-        current_time = discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        start_time = start_time.strftime('%Y-%m-%d %H:%M:%S') if start_time else current_time
-        print(f"Start time: {start_time}, Current time: {current_time}")
-        status = 'active' if start_time <= current_time else 'upcoming'
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                INSERT INTO topics (name, status, start_time, duration, author_id, guild_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (self.name, status, start_time, duration, self.author_id, self.guild_id))
-            await db.commit()
-
-    @staticmethod
-    async def createTablesIfNotExists():
-        """
-        Create the tables if they do not exist
-        """
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS topics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'upcoming',
-                    start_time TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    duration INTEGER NOT NULL DEFAULT 0,
-                    author_id INTEGER NOT NULL,
-                    guild_id INTEGER NOT NULL
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS topic_members (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    topic_name TEXT NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'active',
-                    joined_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            await db.commit()
-    
     @staticmethod
     async def getActiveTopics():
-        await Topic.createTablesIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
-            async with db.execute('''
-                SELECT * FROM topics WHERE status='active'
-            ''') as cursor:
+        if SessionCache.ready:
+            return SessionCache.getTopicsByStatus('active')
+        shard_filter, shard_params = Database.shardFilter()
+        async with Database.read() as db:
+            async with db.execute(f'''
+                SELECT * FROM topics WHERE status='active'{shard_filter}
+            ''', shard_params) as cursor:
                 return await cursor.fetchall()
     
     @staticmethod
     async def getUpcomingTopics():
-        await Topic.createTablesIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
-            async with db.execute('''
-                SELECT * FROM topics WHERE status='upcoming'
-            ''') as cursor:
+        if SessionCache.ready:
+            return SessionCache.getTopicsByStatus('upcoming')
+        shard_filter, shard_params = Database.shardFilter()
+        async with Database.read() as db:
+            async with db.execute(f'''
+                SELECT * FROM topics WHERE status='upcoming'{shard_filter}
+            ''', shard_params) as cursor:
                 return await cursor.fetchall()
         
     @staticmethod
-    async def getTopics():
-        await Topic.createTablesIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getTopics(guild_id: int):
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topics
-            ''') as cursor:
+                SELECT * FROM topics WHERE guild_id=?
+            ''', (guild_id,)) as cursor:
                 return await cursor.fetchall()
             
     @staticmethod
-    async def joinTopic(topic_name, user_id):
-        await Topic.createTablesIfNotExists()
-        await Topic.insertTopicMember(topic_name, user_id)
-    
-    @staticmethod
-    async def checkIfAlreadyJoined(topic_name, user_id):
-        async with aiosqlite.connect('study.db') as db:
+    async def checkIfAlreadyJoined(guild_id: int, topic_name, user_id):
+        if SessionCache.ready and SessionCache.getTopic(guild_id, topic_name):
+            return SessionCache.isMember(guild_id, topic_name, user_id)
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topic_members WHERE topic_name=? AND user_id=?
-            ''', (topic_name, user_id)) as cursor:
+                SELECT * FROM topic_members WHERE guild_id=? AND topic_name=? AND user_id=?
+            ''', (guild_id, topic_name, user_id)) as cursor:
                 return await cursor.fetchone() is not None
     
     @staticmethod
-    async def checkIfAuthor(topic_name, author_id):
-        async with aiosqlite.connect('study.db') as db:
+    async def checkIfAuthor(guild_id: int, topic_name, author_id):
+        if SessionCache.ready:
+            topic = SessionCache.getTopic(guild_id, topic_name)
+            return topic is not None and topic[5] == author_id
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topics WHERE name=? AND author_id=? AND (status='active' OR status='upcoming')
-            ''', (topic_name, author_id)) as cursor:
+                SELECT * FROM topics WHERE guild_id=? AND name=? AND author_id=? AND (status='active' OR status='upcoming')
+            ''', (guild_id, topic_name, author_id)) as cursor:
                 return await cursor.fetchone() is not None
     
     @staticmethod
-    async def insertTopicMember(topic_name, user_id):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                INSERT INTO topic_members (topic_name, user_id)
-                VALUES (?, ?)
-            ''', (topic_name, user_id))
-            await db.commit()
-    
-    @staticmethod
-    async def removeTopicMember(topic_name, user_id):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                DELETE FROM topic_members
-                WHERE topic_name=? AND user_id=?
-            ''', (topic_name, user_id))
-            await db.commit()
-    
-    @staticmethod
-    async def getTopicMembers(topic_name: str) -> List[aiosqlite.Row]:
-        await Topic.createTablesIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getTopicMembers(guild_id: int, topic_name: str) -> List[aiosqlite.Row]:
+        if SessionCache.ready and SessionCache.getTopic(guild_id, topic_name):
+            return SessionCache.getMembers(guild_id, topic_name)
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topic_members WHERE topic_name=?
-            ''', (topic_name,)) as cursor:
+                SELECT * FROM topic_members WHERE guild_id=? AND topic_name=?
+            ''', (guild_id, topic_name)) as cursor:
                 return await cursor.fetchall()
     
     @staticmethod
-    async def getTopicByName(topic_name: str) -> aiosqlite.Row:
-        await Topic.createTablesIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getTopicByName(guild_id: int, topic_name: str) -> aiosqlite.Row:
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topics WHERE name=?
-            ''', (topic_name,)) as cursor:
+                SELECT * FROM topics WHERE guild_id=? AND name=?
+            ''', (guild_id, topic_name)) as cursor:
                 return await cursor.fetchone()
     
     @staticmethod
-    async def activeOrUpcomingTopicExists(topic_name: str) -> bool:
-        await Topic.createTablesIfNotExists()
-        return await Topic.getActiveOrUpcomingTopicByName(topic_name) is not None
+    async def activeOrUpcomingTopicExists(guild_id: int, topic_name: str) -> bool:
+        return await Topic.getActiveOrUpcomingTopicByName(guild_id, topic_name) is not None
     
     @staticmethod
-    async def getActiveOrUpcomingTopicByName(topic_name: str) -> aiosqlite.Row:
-        await Topic.createTablesIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getActiveOrUpcomingTopicByName(guild_id: int, topic_name: str) -> aiosqlite.Row:
+        if SessionCache.ready:
+            return SessionCache.getTopic(guild_id, topic_name)
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topics WHERE name=? AND (status='active' OR status='upcoming')
-            ''', (topic_name,)) as cursor:
+                SELECT * FROM topics WHERE guild_id=? AND name=? AND (status='active' OR status='upcoming')
+            ''', (guild_id, topic_name)) as cursor:
                 return await cursor.fetchone()
     
     @staticmethod
-    async def endTopic(topic_name: str, author_id: int):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                UPDATE topics
-                SET status='ended'
-                WHERE name=? AND author_id=? AND (status='active' OR status='upcoming')
-            ''', (topic_name, author_id))
-            await db.commit()
-    
-    @staticmethod
-    async def isTopicStarted(topic_name: str) -> bool:
-        async with aiosqlite.connect('study.db') as db:
+    async def isTopicStarted(guild_id: int, topic_name: str) -> bool:
+        if SessionCache.ready and SessionCache.getTopic(guild_id, topic_name):
+            return SessionCache.getTopic(guild_id, topic_name)[2] == 'active'
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT status FROM topics WHERE name=? ORDER BY id DESC LIMIT 1
-            ''', (topic_name,)) as cursor:
+                SELECT status FROM topics WHERE guild_id=? AND name=? ORDER BY id DESC LIMIT 1
+            ''', (guild_id, topic_name)) as cursor:
                 topic = await cursor.fetchone()
-                return topic[0] == 'active'
+                return topic is not None and topic[0] == 'active'
     
     @staticmethod
-    async def isTopicEnded(topic_name: str) -> bool:
-        async with aiosqlite.connect('study.db') as db:
+    async def isTopicEnded(guild_id: int, topic_name: str) -> bool:
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT status FROM topics WHERE name=?
-            ''', (topic_name,)) as cursor:
+                SELECT status FROM topics WHERE guild_id=? AND name=? ORDER BY id DESC LIMIT 1
+            ''', (guild_id, topic_name)) as cursor:
                 topic = await cursor.fetchone()
-                return topic[0] == 'ended'
-    
-    @staticmethod
-    async def createTopicEmbed(topic: aiosqlite.Row, end=False):
-        print(topic)
-        embed = discord.Embed(title=f"Session:\n{topic[1]}", color=discord.Color.green() if not end else discord.Color.dark_orange())
-        members = await Topic.getTopicMembers(topic[1])
-        topic_started = await Topic.isTopicStarted(topic[1])
+                # archived topics are no longer in the table
+                return topic is None or topic[0] == 'ended'
+    
+    @staticmethod
+    async def createTopicEmbed(topic: aiosqlite.Row, end=False, members: List[aiosqlite.Row]=None):
+        guild_id, topic_name = topic[6], topic[1]
+        # only live topics are versioned; the end embed shows the current time so it is never cached
+        cacheable = SessionCache.ready and not end and members is None and SessionCache.getTopic(guild_id, topic_name) is not None
+        if cacheable:
+            embed = EmbedCache.get((guild_id, topic_name))
+            if embed is not None:
+                return embed
+            version = EmbedCache.version((guild_id, topic_name))
+        embed = discord.Embed(title=f"Session:\n{topic_name}", color=discord.Color.green() if not end else discord.Color.dark_orange())
+        if members is None:
+            members = await Topic.getTopicMembers(guild_id, topic_name)
+        topic_started = not end and await Topic.isTopicStarted(guild_id, topic_name)
         start_time = topic[3]
-        start_time_dt = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-        start_time_dt_utc = start_time_dt.replace(tzinfo=pytz.utc)
-        time_remaining = discord.utils.format_dt(start_time_dt_utc, 'R')
-        time_since_end = discord.utils.format_dt(discord.utils.utcnow(), 'R')
+        time_remaining = TimeCalculations.formatTimestamp(start_time, 'R')
+        time_since_end = TimeCalculations.formatTimestamp(TimeCalculations.now(), 'R')
         status = 'Starting' if not topic_started else 'Started'
         status = 'Ended by author' if end else status
         if topic_started:
@@ -304,183 +265,270 @@ class Topic:
             embed.add_field(name="Duration", value=TimeCalculations.minutesToText(topic[4]), inline=False)
         embed.add_field(name="Host", value=f"<@{topic[5]}>", inline=False)
         if len(members) > 0:
-            embed.add_field(name="Members", value="\n".join([f"<@{member[2]}>" for member in members]), inline=False)
+            # a field value is capped at 1024 characters, the full roster is paginated by !study members
+            value = "\n".join([f"<@{member[2]}>" for member in members[:config.members_page_size]])
+            if len(members) > config.members_page_size:
+                value += f"\n... and {len(members) - config.members_page_size} more, see `{config.prefix}study members {topic_name}`"
+            embed.add_field(name=f"Members ({len(members)})", value=value, inline=False)
         else:
             embed.add_field(name="Members", value="No members joined yet", inline=False)
-        embed.add_field(name="** **", value=f"Start time: {discord.utils.format_dt(start_time_dt_utc, 'f')} in your timezone", inline=False)
+        embed.add_field(name="** **", value=f"Start time: {TimeCalculations.formatTimestamp(start_time, 'f')} in your timezone", inline=False)
+        if cacheable:
+            EmbedCache.put((guild_id, topic_name), version, embed)
         return embed
     
     @staticmethod
-    async def createTopicsListEmbed(topics: List[aiosqlite.Row], title="Topics"):
+    async def createTopicsListEmbed(topics: List[aiosqlite.Row], title="Topics", page: int=0, total: int=None):
         embed = discord.Embed(title=title, color=discord.Color.green())
         for topic in topics:
-            start_time = topic[3]
-            start_time_dt = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-            start_time_dt_utc = start_time_dt.replace(tzinfo=pytz.utc)
-            time_remaining = discord.utils.format_dt(start_time_dt_utc, 'R')
+            time_remaining = TimeCalculations.formatTimestamp(topic[3], 'R')
             status = 'Starting' if topic[2] == 'upcoming' else 'Started'
             embed.add_field(name=topic[1], value=f"- **Host:** <@{topic[5]}>\n- **Status:** {status} {time_remaining}", inline=False)
+        if total is not None:
+            pages = max(1, -(-total // config.list_page_size))
+            embed.set_footer(text=f"Page {page + 1}/{pages} · {total} sessions")
         return embed
     
     @staticmethod
-    async def startTopic(topic_name: str, author_id: int):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                UPDATE topics
-                SET status='active'
-                WHERE name=? AND author_id=? AND status='upcoming'
-            ''', (topic_name, author_id))
-            await db.commit()
+    async def createTopicMembersEmbed(topic_name: str, members: List[aiosqlite.Row], page: int=0, total: int=None):
+        embed = discord.Embed(title=f"Members of {topic_name}", color=discord.Color.green())
+        if len(members) > 0:
+            embed.description = "\n".join([f"<@{member[2]}>" for member in members])
+        else:
+            embed.description = "No members joined yet"
+        if total is not None:
+            pages = max(1, -(-total // config.members_page_size))
+            embed.set_footer(text=f"Page {page + 1}/{pages} · {total} members")
+        return embed
     
     @staticmethod
-    async def getDetails(topic_name: str):
-        await Topic.createTablesIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getLiveTopicsPage(guild_id: int, after: Optional[Tuple[int, int]]=None, limit: int=10) -> List[aiosqlite.Row]:
+        """
+        Get one page of a guild's active and upcoming topics ordered by start time
+        
+        Parameters:
+            guild_id (int): The guild ID
+            after (Optional[Tuple[int, int]]): The (start_ts, id) of the last topic on the previous page
+            limit (int): The page size
+            
+        Returns:
+            List[aiosqlite.Row]: The topics on the page
+        """
+        after = after or (-1, -1)
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topics WHERE name=? AND (status='active' OR status='upcoming')
-            ''', (topic_name,)) as cursor:
-                return await cursor.fetchone()
+                SELECT * FROM topics
+                WHERE guild_id=? AND status IN ('active', 'upcoming') AND (start_ts, id) > (?, ?)
+                ORDER BY start_ts, id
+                LIMIT ?
+            ''', (guild_id, after[0], after[1], limit)) as cursor:
+                return await cursor.fetchall()
     
     @staticmethod
-    async def leaveTopic(topic_name: str, user_id: int):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                DELETE FROM topic_members
-                WHERE topic_name=? AND user_id=?
-            ''', (topic_name, user_id))
-            await db.commit()
+    async def countLiveTopics(guild_id: int) -> int:
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT COUNT(*) FROM topics WHERE guild_id=? AND status IN ('active', 'upcoming')
+            ''', (guild_id,)) as cursor:
+                return (await cursor.fetchone())[0]
+    
+    @staticmethod
+    async def getTopicMembersPage(guild_id: int, topic_name: str, after: int=0, limit: int=20) -> List[aiosqlite.Row]:
+        """
+        Get one page of a topic's members in join order
+        
+        Parameters:
+            guild_id (int): The guild ID
+            topic_name (str): The topic name
+            after (int): The id of the last member on the previous page
+            limit (int): The page size
+            
+        Returns:
+            List[aiosqlite.Row]: The members on the page
+        """
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT * FROM topic_members
+                WHERE guild_id=? AND topic_name=? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (guild_id, topic_name, after, limit)) as cursor:
+                return await cursor.fetchall()
+    
+    @staticmethod
+    async def countTopicMembers(guild_id: int, topic_name: str) -> int:
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT COUNT(*) FROM topic_members WHERE guild_id=? AND topic_name=?
+            ''', (guild_id, topic_name)) as cursor:
+                return (await cursor.fetchone())[0]
+    
+    @staticmethod
+    async def startDueTopics() -> Tuple[List[Tuple[int, str]], int]:
+        """
+        Start every upcoming topic on this process's shards whose start time has been reached, moving their reminders to the outbox in the same transaction
+        
+        Returns:
+            Tuple[List[Tuple[int, str]], int]: The guild ID and name of each started topic, and the number of reminders queued
+        """
+        shard_filter, shard_params = Database.shardFilter()
+        async with Database.write() as db:
+            async with db.execute(f'''
+                UPDATE topics
+                SET status='active'
+                WHERE status='upcoming' AND start_ts <= ?{shard_filter}
+                RETURNING id, guild_id, name
+            ''', (TimeCalculations.now(), *shard_params)) as cursor:
+                started = [tuple(row) for row in await cursor.fetchall()]
+            queued = await Outbox.enqueueReminders(db, started)
+        topics = [(guild_id, topic_name) for _, guild_id, topic_name in started]
+        for guild_id, topic_name in topics:
+            SessionCache.setStatus(guild_id, topic_name, 'active')
+            SessionCache.removeReminders(guild_id, topic_name)
+        return topics, queued
+    
+    @staticmethod
+    async def endExpiredTopics() -> List[Tuple[int, str]]:
+        """
+        End every active topic on this process's shards whose duration has passed, removing their members and reminders and ending their resources in one transaction
+        
+        Returns:
+            List[Tuple[int, str]]: The guild ID and name of each ended topic
+        """
+        shard_filter, shard_params = Database.shardFilter()
+        async with Database.write() as db:
+            async with db.execute(f'''
+                UPDATE topics
+                SET status='ended'
+                WHERE status='active' AND end_ts <= ?{shard_filter}
+                RETURNING guild_id, name
+            ''', (TimeCalculations.now(), *shard_params)) as cursor:
+                topics = [tuple(row) for row in await cursor.fetchall()]
+            # a row-value IN list cannot use the (guild_id, topic_name) indexes, one indexed delete per topic can
+            await db.executemany('DELETE FROM topic_members WHERE guild_id=? AND topic_name=?', topics)
+            await db.executemany('DELETE FROM reminders WHERE guild_id=? AND topic_name=?', topics)
+            await db.executemany('''UPDATE resources SET status='ended' WHERE guild_id=? AND topic_name=? AND status IN ('active', 'upcoming')''', topics)
+        for guild_id, topic_name in topics:
+            SessionCache.removeTopic(guild_id, topic_name)
+        return topics
+    
+    @staticmethod
+    async def getDetails(guild_id: int, topic_name: str):
+        if SessionCache.ready:
+            return SessionCache.getTopic(guild_id, topic_name)
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT * FROM topics WHERE guild_id=? AND name=? AND (status='active' OR status='upcoming')
+            ''', (guild_id, topic_name)) as cursor:
+                return await cursor.fetchone()
     
     @staticmethod
-    async def createTopicResourcesEmbed(topic_name: str):
-        resources = await Resource.getResources(topic_name)
-        resources = [resource for resource in resources if resource[3] == 'active' or resource[3] == 'upcoming']
+    async def createTopicResourcesEmbed(guild_id: int, topic_name: str):
+        resources = await Resource.getResourcesWithMetadata(guild_id, topic_name)
         embed = discord.Embed(title=f"Resources for {topic_name}", color=discord.Color.green())
         if len(resources) == 0:
             embed.description = "No resources found for this topic"
-        else:
-            for resource in resources:
-                embed.add_field(name=f"** **", value=f"- [Resource {resources.index(resource) + 1}]({resource[4]})", inline=False)
+            return embed
+        lines = []
+        length = 0
+        for number, (url, title, content_type, size) in enumerate(resources, start=1):
+            label = discord.utils.escape_markdown(title).replace(']', '\\]') if title else f"Resource {number}"
+            details = [detail for detail in (content_type, TimeCalculations.bytesToText(size) if size else None) if detail]
+            line = f"- [{label}]({url})" + (f" · {' · '.join(details)}" if details else "")
+            # an embed description is capped at 4096 characters
+            if length + len(line) + 1 > 4000:
+                lines.append(f"... and {len(resources) - number + 1} more")
+                break
+            lines.append(line)
+            length += len(line) + 1
+        embed.description = "\n".join(lines)
         return embed
 
     @staticmethod
-    async def authorHasActiveOrUpcomingTopic(author_id: int) -> bool:
-        async with aiosqlite.connect('study.db') as db:
+    async def authorHasActiveOrUpcomingTopic(guild_id: int, author_id: int) -> bool:
+        if SessionCache.ready:
+            return SessionCache.getTopicNameByAuthor(guild_id, author_id) is not None
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM topics WHERE author_id=? AND (status='active' OR status='upcoming')
-            ''', (author_id,)) as cursor:
+                SELECT * FROM topics WHERE guild_id=? AND author_id=? AND (status='active' OR status='upcoming')
+            ''', (guild_id, author_id)) as cursor:
                 return await cursor.fetchone() is not None
     
     @staticmethod
-    async def getTopicNameByAuthor(author_id: int) -> str:
-        async with aiosqlite.connect('study.db') as db:
+    async def getTopicNameByAuthor(guild_id: int, author_id: int) -> str:
+        if SessionCache.ready:
+            return SessionCache.getTopicNameByAuthor(guild_id, author_id)
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT name FROM topics WHERE author_id=? AND (status='active' OR status='upcoming') ORDER BY id DESC LIMIT 1
-            ''', (author_id,)) as cursor:
+                SELECT name FROM topics WHERE guild_id=? AND author_id=? AND (status='active' OR status='upcoming') ORDER BY id DESC LIMIT 1
+            ''', (guild_id, author_id)) as cursor:
                 row = await cursor.fetchone()
                 return row[0] if row else None
     
     @staticmethod
-    async def notifyTopicMembers(bot: discord.Client, topic_name: str, message: str):
-        members = await Topic.getTopicMembers(topic_name)
-        members = [member for member in members if member[3] == 'active']
+    async def notifyTopicMembers(bot: discord.Client, guild_id: int, topic_name: str, message: str, key: str) -> int:
+        """
+        Queue a notification to the active members of a topic in the outbox
+        
+        Parameters:
+            bot (discord.Client): The bot instance
+            guild_id (int): The guild ID
+            topic_name (str): The topic name
+            message (str): The notification text
+            key (str): Identifies the request, e.g. the invoking message, so a repeated request is not queued twice
+            
+        Returns:
+            int: The number of members the notification was queued for
+        """
+        members = await Topic.getTopicMembers(guild_id, topic_name)
         embed = discord.Embed(title=f"Notification for {topic_name}", description=message, color=discord.Color.green())
-        for member in members:
-            member = await bot.fetch_user(member[2])
-            if member:
-                await member.send(embed=embed)
+        payload = Outbox.payload(embed=embed)
+        async with Database.write() as db:
+            queued = await Outbox.enqueue(db, [
+                (f'notify:{key}:{member[2]}', guild_id, member[2], payload) for member in members if member[3] == 'active'
+            ])
+        bot.outbox.wake()
+        return queued
 
 class Reminder:
     @staticmethod
-    async def createTableIfNotExists():
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS reminders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    topic_name TEXT NOT NULL,
-                    FOREIGN KEY (topic_name) REFERENCES topics(name)
-                )
-            ''')
-            await db.commit()
-    
-    @staticmethod
-    async def newReminder(user_id: int, topic_name: str):
-        await Reminder.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                INSERT INTO reminders (user_id, topic_name)
-                VALUES (?, ?)
-            ''', (user_id, topic_name))
-            await db.commit()
-    
-    @staticmethod
-    async def createReminder(user_id: int, topic_name: str):
-        await Reminder.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                INSERT INTO reminders (user_id, topic_name)
-                VALUES (?, ?)
-            ''', (user_id, topic_name))
-            await db.commit()
-    
-    @staticmethod
-    async def sendReminder(bot: discord.Client, user_id: int, topic_name: str):
-        await Reminder.createTableIfNotExists()
-        member = await bot.fetch_user(user_id)
-        await member.send(f"Reminder: The topic {topic_name} is starting now!")
-    
-    @staticmethod
-    async def getReminders():
-        await Reminder.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getReminders(guild_id: int):
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM reminders
-            ''') as cursor:
+                SELECT * FROM reminders WHERE guild_id=?
+            ''', (guild_id,)) as cursor:
                 return await cursor.fetchall()
     
     @staticmethod
-    async def deleteReminder(user_id: int, topic_name: str):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                DELETE FROM reminders
-                WHERE user_id=? AND topic_name=?
-            ''', (user_id, topic_name))
-            await db.commit()
-    
-    @staticmethod
-    async def getRemindersByUser(user_id: int):
-        await Reminder.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getRemindersByUser(guild_id: int, user_id: int):
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM reminders WHERE user_id=?
-            ''', (user_id,)) as cursor:
+                SELECT * FROM reminders WHERE guild_id=? AND user_id=?
+            ''', (guild_id, user_id)) as cursor:
                 return await cursor.fetchall()
     
     @staticmethod
-    async def getRemindersByTopic(topic_name: str):
-        await Reminder.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def getRemindersByTopic(guild_id: int, topic_name: str):
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM reminders WHERE topic_name=?
-            ''', (topic_name,)) as cursor:
+                SELECT * FROM reminders WHERE guild_id=? AND topic_name=?
+            ''', (guild_id, topic_name)) as cursor:
                 return await cursor.fetchall()
     
     @staticmethod
-    async def deleteRemindersByTopic(topic_name: str):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                DELETE FROM reminders
-                WHERE topic_name=?
-            ''', (topic_name,))
-            await db.commit()
+    async def getReminderUserIds(guild_id: int, topic_name: str) -> List[int]:
+        if SessionCache.ready and SessionCache.getTopic(guild_id, topic_name):
+            return SessionCache.getReminderUsers(guild_id, topic_name)
+        return [reminder[1] for reminder in await Reminder.getRemindersByTopic(guild_id, topic_name)]
     
     @staticmethod
-    async def reminderExists(user_id: int, topic_name: str):
-        await Reminder.createTableIfNotExists()
-        async with aiosqlite.connect('study.db') as db:
+    async def reminderExists(guild_id: int, user_id: int, topic_name: str):
+        if SessionCache.ready and SessionCache.getTopic(guild_id, topic_name):
+            return SessionCache.hasReminder(guild_id, user_id, topic_name)
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM reminders WHERE user_id=? AND topic_name=?
-            ''', (user_id, topic_name)) as cursor:
+                SELECT * FROM reminders WHERE guild_id=? AND user_id=? AND topic_name=?
+            ''', (guild_id, user_id, topic_name)) as cursor:
                 return await cursor.fetchone() is not None
 
 class Check:
@@ -495,20 +543,21 @@ class Check:
         Returns:
             None
         """
-        upcoming_topics = await Topic.getUpcomingTopics()
-        for topic in upcoming_topics:
-            start_time = topic[3]
-            current_time = discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-            if start_time <= current_time:
-                print(f"Starting topic: {topic[1]}")
-                await Topic.startTopic(topic[1], topic[5])
-                reminders = await Reminder.getRemindersByTopic(topic[1])
-                for reminder in reminders:
-                    await Reminder.sendReminder(bot, reminder[1], reminder[2])
-                await Reminder.deleteRemindersByTopic(topic[1])
-    
-    @staticmethod
-    async def checkEndTimes():
+        started_topics, queued = await Topic.startDueTopics()
+        if queued:
+            # the reminders are already durable, the tick does not wait for them to be sent
+            bot.outbox.wake()
+        for guild_id, topic_name in started_topics:
+            topic = await Topic.getActiveOrUpcomingTopicByName(guild_id, topic_name)
+            if topic is not None:
+                members = await Topic.getTopicMembers(guild_id, topic_name)
+                bot.attendance.topicStarted(topic, [member[2] for member in members])
+            logger.info('Started topic', extra={'guild': guild_id, 'topic': topic_name})
+        if started_topics:
+            logger.info('Queued %s reminders for %s started topics', queued, len(started_topics), extra={'count': queued})
+    
+    @staticmethod
+    async def checkEndTimes(bot: commands.Bot):
         """
         Check the ending times for active topics
         
@@ -518,21 +567,10 @@ class Check:
         Returns:
             None
         """
-        active_topics = await Topic.getActiveTopics()
-        for topic in active_topics:
-            start_time = topic[3]
-            duration = topic[4]
-            if duration == 0:
-                continue
-            current_time = discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-            # Check if the duration has passed
-            if TimeCalculations.timeDifference(datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S'), datetime.strptime(current_time, '%Y-%m-%d %H:%M:%S')) >= duration * 60:
-                topic_name = topic[1]
-                print(f"Ending topic: {topic_name}")
-                await Topic.endTopic(topic_name, topic[5])
-                topic_members = await Topic.getTopicMembers(topic_name)
-                for member in topic_members:
-                    await Topic.removeTopicMember(topic_name, member[2])
+        ended_topics = await Topic.endExpiredTopics()
+        for guild_id, topic_name in ended_topics:
+            bot.attendance.topicEnded(guild_id, topic_name)
+            logger.info('Ended topic', extra={'guild': guild_id, 'topic': topic_name})
 
 class Utils:
     @staticmethod
@@ -556,34 +594,35 @@ class Utils:
 
 class Attendance:
     @staticmethod
-    async def createTableIfNotExists():
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS attendances (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    FOREIGN KEY (topic_name) REFERENCES topics(name),
-                    FOREIGN KEY (user_id) REFERENCES users(id),
-                    attended_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    time_spent INTEGER NOT NULL DEFAULT 0
-                )
-            ''')
-            await db.commit()
-    
-    @staticmethod
-    async def createAttendance(topic_name, user_id, time_spent=0):
-        async with aiosqlite.connect('study.db') as db:
-            await db.execute('''
-                INSERT INTO attendances (topic_name, user_id, time_spent)
-                VALUES (?, ?, ?)
-            ''', (topic_name, user_id, time_spent))
-            await db.commit()
+    async def getTimeSpent(guild_id: int, user_id: int) -> int:
+        """
+        Get the total seconds a user has spent in the sessions of a guild
+        
+        Parameters:
+            guild_id (int): The guild ID
+            user_id (int): The user ID
             
+        Returns:
+            int: The seconds written so far, see AttendanceTracker.pendingSeconds for the rest
+        """
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT COALESCE(SUM(seconds), 0) FROM attendances WHERE guild_id=? AND user_id=?
+            ''', (guild_id, user_id)) as cursor:
+                return (await cursor.fetchone())[0]
+    
     @staticmethod
-    async def getAttendances():
-        async with aiosqlite.connect('study.db') as db:
+    async def getSessionCount(guild_id: int, user_id: int) -> int:
+        async with Database.read() as db:
             async with db.execute('''
-                SELECT * FROM attendances
-            ''') as cursor:
-                return await cursor.fetchall()
+                SELECT COUNT(*) FROM attendances WHERE guild_id=? AND user_id=?
+            ''', (guild_id, user_id)) as cursor:
+                return (await cursor.fetchone())[0]
     
-    
\ No newline at end of file
+    @staticmethod
+    async def getTopicAttendances(topic_id: int) -> List[aiosqlite.Row]:
+        async with Database.read() as db:
+            async with db.execute('''
+                SELECT * FROM attendances WHERE topic_id=? ORDER BY seconds DESC
+            ''', (topic_id,)) as cursor:
+                return await cursor.fetchall()
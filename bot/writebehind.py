@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+import aiosqlite
+import config
+from database import Database
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+JOIN = 'join'
+LEAVE = 'leave'
+
+# applies a mutation on the writer inside the batch transaction, returning its value and what to run once it is durable
+Apply = Callable[[aiosqlite.Connection], Awaitable[Tuple[Any, Optional[Callable[[], None]]]]]
+# decides whether a join followed by a leave can be answered without writing, returning both values if so
+Cancel = Callable[[aiosqlite.Connection], Awaitable[Optional[Tuple[Any, Any]]]]
+
+
+class Mutation:
+    __slots__ = ('apply', 'key', 'kind', 'cancel', 'future', 'span')
+
+    def __init__(self, apply: Apply, key: Optional[Hashable], kind: Optional[str], cancel: Optional[Cancel]):
+        self.apply = apply
+        self.key = key
+        self.kind = kind
+        self.cancel = cancel
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # the command that submitted the mutation pays for its statements, although the flusher runs them
+        self.span = Metrics.current()
+
+
+class GroupCommit:
+    """
+    Write-behind queue that commits membership and reminder mutations in groups
+
+    Mutations submitted within config.group_commit_delay seconds of each other, up to
+    config.group_commit_max_ops, run in one BEGIN IMMEDIATE transaction, each inside its own
+    savepoint so a failing mutation does not undo the others. Callers are answered only after the
+    COMMIT, so an acknowledged command is durable. A join followed by a leave of the same user and
+    topic in one batch is answered without writing anything.
+    """
+    _pending: List[Mutation] = []
+    _wakeup: Optional[asyncio.Event] = None
+    _full: Optional[asyncio.Event] = None
+    _task: Optional[asyncio.Task] = None
+    # the commit in flight, shielded so stopping the flusher never abandons a batch halfway
+    _committing: Optional[asyncio.Future] = None
+
+    @classmethod
+    def submit(cls, apply: Apply, key: Optional[Hashable]=None, kind: Optional[str]=None, cancel: Optional[Cancel]=None) -> Awaitable:
+        """
+        Queue a mutation for the next group commit
+
+        Parameters:
+            apply (Apply): Runs the mutation on the writer connection
+            key (Optional[Hashable]): The (guild_id, topic_name, user_id) the mutation touches, for join and leave pairing
+            kind (Optional[str]): JOIN, LEAVE or None
+            cancel (Optional[Cancel]): For a leave, answers a pending join and this leave together without writing
+
+        Returns:
+            Awaitable: Resolves to the value returned by apply once the batch has committed
+        """
+        if cls._task is None or cls._task.done():
+            cls._wakeup = asyncio.Event()
+            cls._full = asyncio.Event()
+            # in an empty context, or the flusher would inherit the span of the command that started it
+            cls._task = contextvars.Context().run(asyncio.create_task, cls._run())
+        mutation = Mutation(apply, key, kind, cancel)
+        cls._pending.append(mutation)
+        cls._wakeup.set()
+        if len(cls._pending) >= config.group_commit_max_ops:
+            cls._full.set()
+        return mutation.future
+
+    @classmethod
+    async def drain(cls):
+        """
+        Commit everything queued and stop the flusher, e.g. before the database is closed
+        """
+        if cls._task is not None:
+            cls._task.cancel()
+            await asyncio.gather(cls._task, return_exceptions=True)
+            cls._task = None
+        if cls._committing is not None:
+            await asyncio.gather(cls._committing, return_exceptions=True)
+            cls._committing = None
+        while cls._pending:
+            await cls._commit(cls._take())
+
+    @classmethod
+    def _take(cls) -> List[Mutation]:
+        batch, cls._pending = cls._pending[:config.group_commit_max_ops], cls._pending[config.group_commit_max_ops:]
+        if len(cls._pending) < config.group_commit_max_ops:
+            cls._full.clear()
+        if not cls._pending:
+            cls._wakeup.clear()
+        return batch
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            await cls._wakeup.wait()
+            # give the commands arriving at the same moment a chance to share the commit
+            if not cls._full.is_set():
+                try:
+                    await asyncio.wait_for(cls._full.wait(), timeout=config.group_commit_delay)
+                except asyncio.TimeoutError:
+                    pass
+            cls._committing = asyncio.ensure_future(cls._commit(cls._take()))
+            await asyncio.shield(cls._committing)
+            cls._committing = None
+
+    @staticmethod
+    def _pair(batch: List[Mutation]) -> List[List[Mutation]]:
+        """
+        Group a join with the leave that directly follows it for the same key, keeping every other mutation on its own
+        """
+        groups: List[List[Mutation]] = []
+        # key -> index in groups of the last mutation on it
+        last: Dict[Hashable, int] = {}
+        for mutation in batch:
+            previous = last.get(mutation.key) if mutation.key is not None else None
+            if (mutation.kind == LEAVE and mutation.cancel is not None and previous is not None
+                    and len(groups[previous]) == 1 and groups[previous][0].kind == JOIN):
+                # the pair runs where the leave was queued, after everything between touched other keys
+                groups.append([groups[previous].pop(), mutation])
+            else:
+                groups.append([mutation])
+            if mutation.key is not None:
+                last[mutation.key] = len(groups) - 1
+        return [group for group in groups if group]
+
+    @classmethod
+    async def _commit(cls, batch: List[Mutation]):
+        if not batch:
+            return
+        outcomes: List[Tuple[Mutation, Any]] = []
+        try:
+            async with Database.write() as db:
+                for group in cls._pair(batch):
+                    with Metrics.charge([mutation.span for mutation in group], Database.counter(db)):
+                        await db.execute('SAVEPOINT mutation')
+                        try:
+                            values = None
+                            if len(group) == 2:
+                                values = await group[1].cancel(db)
+                            if values is not None:
+                                results = [(value, None) for value in values]
+                            else:
+                                results = [await mutation.apply(db) for mutation in group]
+                        except Exception as exc:
+                            await db.execute('ROLLBACK TO mutation')
+                            results = [exc] * len(group)
+                        await db.execute('RELEASE mutation')
+                    outcomes.extend(zip(group, results))
+        except Exception as exc:
+            logger.exception('Group commit of %s mutations failed', len(batch))
+            for mutation in batch:
+                if not mutation.future.done():
+                    mutation.future.set_exception(exc)
+            return
+        logger.debug('Committed mutations', extra={'count': len(batch)})
+        for mutation, result in outcomes:
+            if isinstance(result, Exception):
+                if not mutation.future.done():
+                    mutation.future.set_exception(result)
+                continue
+            value, after_commit = result
+            # caches follow the database even if the caller has gone away
+            if after_commit is not None:
+                after_commit()
+            if not mutation.future.done():
+                mutation.future.set_result(value)